@@ -75,22 +75,35 @@ def predict_with_voting(input_data):
     Perform predictions using SVC, One-Class SVM, and Ensemble models.
     Return the majority voting result and individual predictions.
     """
-    input_data = np.array(input_data).reshape(1, -1)
+    return predict_with_voting_batch([input_data])[0]
+
+
+def predict_with_voting_batch(input_rows):
+    """
+    Perform predictions for several inputs at once, with a single call to each model.
+    Return the majority voting result and individual predictions of every input.
+    """
+    input_data = np.array(input_rows).reshape(len(input_rows), -1)
 
     # Generate predictions
-    svc_prediction = svc_model.predict(input_data)[0]
-    ocsvm_prediction = ocsvm_model.predict(input_data)[0]
-    ensemble_prediction = ensemble_model.predict(input_data)[0]
+    svc_predictions = svc_model.predict(input_data)
+    ocsvm_predictions = ocsvm_model.predict(input_data)
+    ensemble_predictions = ensemble_model.predict(input_data)
 
-    # Adjust OCSVM prediction: Map 1 -> 0 (Normal), -1 -> 1 (Attack)
-    ocsvm_adjusted = 0 if ocsvm_prediction == 1 else 1
+    results = []
+    for svc_prediction, ocsvm_prediction, ensemble_prediction in zip(
+        svc_predictions, ocsvm_predictions, ensemble_predictions
+    ):
+        # Adjust OCSVM prediction: Map 1 -> 0 (Normal), -1 -> 1 (Attack)
+        ocsvm_adjusted = 0 if ocsvm_prediction == 1 else 1
 
-    # Majority voting
-    predictions = [svc_prediction, ocsvm_adjusted, ensemble_prediction]
-    final_prediction = 1 if predictions.count(1) > predictions.count(0) else 0
-    # Percentage of agreement: 74.92% using test_df with over 100k entries
+        # Majority voting
+        predictions = [svc_prediction, ocsvm_adjusted, ensemble_prediction]
+        final_prediction = 1 if predictions.count(1) > predictions.count(0) else 0
+        # Percentage of agreement: 74.92% using test_df with over 100k entries
+        results.append((final_prediction, predictions))
 
-    return final_prediction, predictions
+    return results
 
 
 def prepare_input(user_input):
@@ -246,9 +259,12 @@ def random_testing(used_indices=None):
 # ==============================================================================
 # Choice 3: Extracting Features from Raw Packet Data
 # ==============================================================================
-def extract_features(packet):
+def extract_features(packet, flow_features=None):
     """
     Extracts the necessary features from the raw packet data.
+
+    flow_features are the features of the packet's flow, as snapshotted by
+    the sniffer when the packet was queued, if its flow was tracked.
     """
     # Extract features from the raw packet data
     # This function should convert the raw packet into the format expected by the model
@@ -263,6 +279,10 @@ def extract_features(packet):
             packet[UDP].dport if UDP in packet else packet[TCP].dport
         ),  # Destination port number
     }
+    # Flow features (duration, bytes, TTLs, state...), named after the dataset columns.
+    # Not used by the models yet : predictions are still made on dataset rows.
+    if flow_features:
+        features.update(flow_features)
     return features
 
 
@@ -304,24 +324,33 @@ def extract_name_from_packet(packet):
 # scaler = joblib.load(scaler_path)
 
 
-def process_packets(packets):
+def process_packets(packets, flow_features=None):
     """
     Processes the packets received by the SIDS.
+
+    flow_features optionally gives the features of each packet's flow, or None.
+    The input of every packet is prepared first, then the whole batch is
+    predicted with a single call to each model.
     """
+    start_time = time.time()
+
     # Set to keep track of used indices for each label
     used_attack_indices = set()
     used_normal_indices = set()
 
     # Convert raw packets to DataFrame
     packet_features = []
-    for packet in packets:
-        start_time = time.time()
-
+    prepared_packets = []
+    input_rows = []
+    if flow_features is None:
+        flow_features = [None] * len(packets)
+    for packet, flow_data in zip(packets, flow_features):
         logging.info(
             f"[*] Processing packet from {packet[IP].src} to {packet[IP].dst}."
         )
 
-        packet_data = extract_features(packet)  # Function to extract necessary features
+        # Function to extract necessary features
+        packet_data = extract_features(packet, flow_data)
         packet_features.append(packet_data)
 
         # Extract the packet name
@@ -374,11 +403,19 @@ def process_packets(packets):
             input_data = prepare_input(selected_row.iloc[0].to_dict())
             # input_data_scaled = scaler.transform([input_data])
             logging.info(f"[*] Input data prepared for model prediction.")
+            prepared_packets.append(packet)
+            input_rows.append(input_data)
+        else:
+            logging.info(
+                f"[*] Unknown Packet's name is not 'Attack' or 'Normal'. Skipping packet."
+            )
 
-            # Use the voting function
-            final_prediction, predictions = predict_with_voting(input_data)
+    if input_rows:
+        # Use the voting function, once for the whole batch
+        results = predict_with_voting_batch(input_rows)
 
-            model_names = ["SVC", "One-Class SVM", "Ensemble"]
+        model_names = ["SVC", "One-Class SVM", "Ensemble"]
+        for packet, (final_prediction, predictions) in zip(prepared_packets, results):
             prediction_results = {
                 name: pred for name, pred in zip(model_names, predictions)
             }
@@ -390,13 +427,13 @@ def process_packets(packets):
                 handle_attack_detection(packet)
             else:
                 logging.info(f"False alarm for packet from {packet[IP].src}")
-        else:
-            logging.info(
-                f"[*] Unknown Packet's name is not 'Attack' or 'Normal'. Skipping packet."
-            )
-        end_time = time.time()  # Record the end time
-        elapsed_time = end_time - start_time  # Calculate elapsed time
-        logging.info(f"[*] Time taken to process packet: {elapsed_time:.4f} seconds")
+
+    end_time = time.time()  # Record the end time
+    elapsed_time = end_time - start_time  # Calculate elapsed time
+    logging.info(
+        f"[*] Time taken to process {len(packets)} packets: {elapsed_time:.4f} seconds"
+        f" ({elapsed_time / max(len(packets), 1):.4f} per packet)"
+    )
 
 
 # ==============================================================================
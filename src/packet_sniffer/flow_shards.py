@@ -0,0 +1,489 @@
+"""Flow-sharded matching : packets are spread over matcher processes by a hash of their 5-tuple."""
+
+import logging
+import multiprocessing
+import pickle
+import queue
+import signal
+import threading
+import time
+from collections import deque
+
+from scapy.layers.inet import IP
+from scapy.layers.l2 import Ether
+
+from src.packet_sniffer.flow_table import FlowTable
+from src.packet_sniffer.packet_matcher import Matcher
+from src.packet_sniffer.packet_ring import PacketRing
+from src.sids.packet_view import IPPROTO_UDP, PacketView, udpEndpoints
+
+# messages of the worker inboxes
+PACKETS = "packets"  # frames written to the ring up to a count, and their layer class
+FRAME = "frame"  # a frame too long for a ring slot : sequence number, timestamp, layer class, bytes
+RULES = "rules"  # replace the whole ruleset, pickled
+INSERT = "insert"  # append one rule, pickled
+
+# seconds given to a matcher process to finish its queued packets when closing
+JOIN_TIMEOUT = 5
+
+# seconds between two checks by the sink that every matcher process is still running
+LIVENESS_INTERVAL = 1.0
+
+
+def flowShard(pkt, shards):
+    """Return the shard of the packet's flow, the same for both directions of a flow."""
+
+    ip = pkt[IP]
+    l4 = ip.payload
+    a = (ip.src, getattr(l4, "sport", 0))
+    b = (ip.dst, getattr(l4, "dport", 0))
+    if b < a:
+        a, b = b, a
+    return hash((ip.proto, a, b)) % shards
+
+
+def udpFrameShard(frame, shards):
+    """
+    Return the shard of a raw Ethernet frame's flow if it holds an IPv4 UDP packet, None otherwise.
+
+    Only the addresses and ports are read; the shard is the same for both directions of a flow.
+    """
+
+    endpoints = udpEndpoints(frame)
+    if endpoints is None:
+        return None
+    src, sport, dst, dport = endpoints
+    a = (src, sport)
+    b = (dst, dport)
+    if b < a:
+        a, b = b, a
+    return hash((IPPROTO_UDP, a, b)) % shards
+
+
+def decodeFrame(frame, timestamp, frameClass):
+    """
+    Decode a frame of the given scapy layer class.
+
+    Ethernet frames are parsed in place, without scapy, which only dissects
+    them if needed : the view then refers to the frame.
+    """
+
+    if frameClass is Ether:
+        return PacketView.fromFrame(frame, timestamp)
+    pkt = frameClass(bytes(frame))
+    pkt.time = timestamp
+    view = PacketView(pkt)
+    view.timestamp = timestamp
+    return view
+
+
+def readFrames(ring, count, frameClass):
+    """
+    Decode the frames of the ring up to the count of frames written, as (sequence number, PacketView).
+
+    Frames are decoded from their slot, without copying them, so the slots
+    stay in use until releaseFrames() is called.
+    """
+
+    views = []
+    for index in range(count - ring.read()):
+        seq, timestamp, frame = ring.peek(index)
+        view = decodeFrame(frame, timestamp, frameClass)
+        if view.frame is None:
+            frame.release()
+        views.append((seq, view))
+    return views
+
+
+def detachFrames(views):
+    """Detach the views returned by readFrames from their frames."""
+    for seq, view in views:
+        if view.frame is not None:
+            view.frame.release()
+            view.frame = None
+
+
+def releaseFrames(ring, views):
+    """Detach the views returned by readFrames from their frames, and release the slots to the producer."""
+    detachFrames(views)
+    ring.advance(len(views))
+
+
+def skipFrames(ring, count):
+    """Release the frames of the ring up to the count of frames written, without decoding them, and return their sequence numbers."""
+    seqs = []
+    for index in range(count - ring.read()):
+        seq, timestamp, frame = ring.peek(index)
+        frame.release()
+        seqs.append(seq)
+    ring.advance(len(seqs))
+    return seqs
+
+
+def matchViews(matcher, views, batchSize, handleUnknown, unknownSource):
+    """
+    Match the (sequence number, PacketView) pairs, returning their
+    (sequence number, alert message or None, packet for the AIDS or None,
+    features of its flow or None).
+
+    The packets logged or handed over are dissected here, while their frames are valid.
+    """
+
+    # the process owns these flows, for their features and cached verdicts
+    flows = []
+    snapshots = []
+    for seq, view in views:
+        flow = matcher.trackFlow(view, view.timestamp)
+        flows.append(flow)
+        # the features as of this packet, for the AIDS if it is unknown
+        unknown = flow is not None and handleUnknown and view.src == unknownSource
+        snapshots.append(flow.features() if unknown else None)
+    if batchSize:
+        verdicts = matcher.matchBatch([view for seq, view in views])
+    else:
+        verdicts = [
+            matcher.matchPacket(view, flow) for (seq, view), flow in zip(views, flows)
+        ]
+
+    results = []
+    for (seq, view), features, rule in zip(views, snapshots, verdicts):
+        if rule is not None:
+            results.append((seq, rule.getMatchedPrintMessage(view.pkt), None, None))
+        elif handleUnknown and view.src == unknownSource:
+            results.append((seq, None, view.pkt, features))
+        else:
+            results.append((seq, None, None, None))
+    return results
+
+
+def matchWorker(
+    ruleIndex,
+    batchSize,
+    handleUnknown,
+    unknownSource,
+    flowTableSize,
+    flowIdleTimeout,
+    shard,
+    ring,
+    inbox,
+    outbox,
+):
+    """
+    Match the frames of the ring against a private copy of the ruleset.
+
+    The inbox tells how far the ring was written, in order with the ruleset
+    updates and the frames too long for the ring. Each batch gives the shard
+    and the list of results of matchViews on the outbox; a batch that fails
+    is logged and gives no result for each of its packets, so the sink never
+    waits for them. Only unknown packets from the unknownSource integer
+    address are returned for the AIDS.
+    """
+
+    # interrupts are handled by the capture process, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # the process owns the flows of its shard
+    matcher = Matcher(ruleIndex, FlowTable(flowTableSize, flowIdleTimeout))
+
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        kind = item[0]
+        if kind == RULES or kind == INSERT:
+            try:
+                if kind == RULES:
+                    matcher.ruleIndex = pickle.loads(item[1])
+                else:
+                    rule = pickle.loads(item[1])
+                    matcher.ruleIndex = matcher.ruleIndex.withRule(rule)
+            except Exception:
+                logging.exception(
+                    f"[*] Matcher process of shard {shard} kept its ruleset, the update failed"
+                )
+        elif kind == FRAME:
+            seq, timestamp, frameClass, frame = item[1:]
+            try:
+                views = [(seq, decodeFrame(frame, timestamp, frameClass))]
+                results = matchViews(
+                    matcher, views, batchSize, handleUnknown, unknownSource
+                )
+            except Exception:
+                logging.exception(
+                    f"[*] Matcher process of shard {shard} skipped a packet it failed to match"
+                )
+                results = [(seq, None, None, None)]
+            outbox.put((shard, results))
+        else:
+            views = []
+            try:
+                views = readFrames(ring, item[1], item[2])
+                results = matchViews(
+                    matcher, views, batchSize, handleUnknown, unknownSource
+                )
+                releaseFrames(ring, views)
+            except Exception:
+                logging.exception(
+                    f"[*] Matcher process of shard {shard} skipped a batch of packets it failed to match"
+                )
+                detachFrames(views)
+                results = [(seq, None, None, None) for seq in skipFrames(ring, item[1])]
+            outbox.put((shard, results))
+
+
+class FlowShards:
+    """
+    N matcher processes, each owning the flows whose 5-tuple hashes to it.
+
+    Packets of a flow always go to the same process, in capture order, and
+    every packet is numbered so the single sink thread can hand the results
+    over in capture order too. Frames reach the processes through a shared
+    memory PacketRing per shard; frames dropped by a full ring are counted.
+    The rare frames too long for a ring slot go through the inbox of the shard.
+    """
+
+    def __init__(
+        self,
+        ruleIndex,
+        workers,
+        onResult,
+        handleUnknown,
+        unknownSource,
+        batchSize=0,
+        dispatchSize=64,
+        ringSlots=4096,
+        flowTableSize=65536,
+        flowIdleTimeout=120.0,
+    ):
+        """
+        onResult(message, pkt, features) is called in capture order from the sink thread,
+        for every alert message or unknown packet from the unknownSource integer address,
+        with the features of its flow.
+        The process of a shard is notified every dispatchSize packets.
+        """
+
+        self.onResult = onResult
+        # notify before the ring fills up, or frames would be dropped while the process waits
+        self.dispatchSize = max(1, min(dispatchSize, ringSlots // 2))
+        self.seq = 0
+        self.nextSeq = 0
+        self.rings = [PacketRing(ringSlots) for _ in range(workers)]
+        self.pending = [0] * workers  # frames written since the last notification
+        self.frameClasses = [None] * workers
+        # sequence numbers submitted to each process and not answered yet, in order,
+        # appended by the capture thread and removed by the sink
+        self.inFlight = [deque() for _ in range(workers)]
+        self.dead = [False] * workers  # processes found dead by the sink
+        self.closing = False
+        self.oversized = 0  # frames sent through the inboxes
+        self.inboxes = [multiprocessing.Queue() for _ in range(workers)]
+        self.outbox = multiprocessing.Queue()
+        self.processes = [
+            multiprocessing.Process(
+                target=matchWorker,
+                args=(
+                    ruleIndex,
+                    batchSize,
+                    handleUnknown,
+                    unknownSource,
+                    flowTableSize,
+                    flowIdleTimeout,
+                    shard,
+                    ring,
+                    inbox,
+                    self.outbox,
+                ),
+                daemon=True,
+            )
+            for shard, (ring, inbox) in enumerate(zip(self.rings, self.inboxes))
+        ]
+        for process in self.processes:
+            process.start()
+        self.sinkThread = threading.Thread(target=self.sink, daemon=True)
+        self.sinkThread.start()
+        logging.info(f"[*] Matching packets in {workers} processes.")
+
+    def submit(self, pkt):
+        """Queue a scapy packet for the matcher process of its flow."""
+        # the captured bytes, rather than the packet built again by scapy
+        frame = pkt.original if pkt.original else bytes(pkt)
+        self.submitFrame(
+            frame, float(pkt.time), pkt.__class__, flowShard(pkt, len(self.rings))
+        )
+
+    def submitFrame(self, frame, timestamp, frameClass, shard):
+        """Queue raw frame bytes, of the given scapy layer class, for the matcher process of the shard."""
+
+        if self.frameClasses[shard] is not frameClass:
+            # the frames of a notification are decoded with a single class
+            self.flushShard(shard)
+            self.frameClasses[shard] = frameClass
+
+        seq = self.seq
+        self.seq += 1
+        if self.dead[shard]:
+            self.skip(seq)
+            return
+        if len(frame) > self.rings[shard].slotSize:
+            # after the frames already written to the ring, in capture order
+            self.flushShard(shard)
+            self.inFlight[shard].append(seq)
+            self.inboxes[shard].put((FRAME, seq, timestamp, frameClass, bytes(frame)))
+            self.oversized += 1
+            return
+        if not self.rings[shard].put(frame, seq, timestamp):
+            self.skip(seq)
+            return
+        self.inFlight[shard].append(seq)
+        self.pending[shard] += 1
+        if self.pending[shard] >= self.dispatchSize:
+            self.flushShard(shard)
+
+    def skip(self, seq):
+        """Tell the sink right away that a dropped packet has no result."""
+        self.outbox.put((None, [(seq, None, None, None)]))
+
+    def flushShard(self, shard):
+        if self.pending[shard]:
+            self.inboxes[shard].put(
+                (PACKETS, self.rings[shard].written(), self.frameClasses[shard])
+            )
+            self.pending[shard] = 0
+
+    def flush(self):
+        """Notify every process of the frames written to its ring."""
+        for shard in range(len(self.rings)):
+            self.flushShard(shard)
+
+    def stats(self):
+        """Return the counters of every ring."""
+        return [ring.stats() for ring in self.rings]
+
+    def publish(self, ruleIndex):
+        """Replace the ruleset of every process, for the packets submitted from now on."""
+        self.broadcast(RULES, ruleIndex)
+
+    def insertRule(self, rule):
+        """Append a rule to the ruleset of every process, for the packets submitted from now on."""
+        self.broadcast(INSERT, rule)
+
+    def broadcast(self, kind, value):
+        """
+        Send a pickled ruleset update to every process.
+
+        The value is pickled once, here, rather than by the feeder thread of each
+        inbox, which would only log a failure and leave the processes on the old ruleset.
+        """
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as err:
+            logging.error(
+                f"[*] Ruleset update not sent to the matcher processes : {err}"
+            )
+            raise
+        for inbox in self.inboxes:
+            inbox.put((kind, payload))
+
+    def sink(self):
+        """
+        Hand the results over in capture order, holding back those that arrive early.
+
+        Every LIVENESS_INTERVAL seconds, the packets in flight to a process
+        found dead are skipped, rather than holding back every later result.
+        Once the processes are stopped, the results still held back are handed
+        over in order.
+        """
+
+        pending = dict()
+        nextCheck = time.monotonic() + LIVENESS_INTERVAL
+        while True:
+            try:
+                item = self.outbox.get(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                # every process is stopped : what is still missing will never come
+                for seq in sorted(pending):
+                    message, pkt, features = pending.pop(seq)
+                    if message is not None or pkt is not None:
+                        self.onResult(message, pkt, features)
+                break
+            if item:
+                self.receive(item, pending)
+            if time.monotonic() >= nextCheck:
+                nextCheck = time.monotonic() + LIVENESS_INTERVAL
+                self.skipDeadShards(pending)
+            while self.nextSeq in pending:
+                message, pkt, features = pending.pop(self.nextSeq)
+                self.nextSeq += 1
+                if message is not None or pkt is not None:
+                    self.onResult(message, pkt, features)
+
+    def receive(self, item, pending):
+        """Hold back the results of an outbox item until their turn, and remove them from the packets in flight."""
+        shard, results = item
+        inFlight = None if shard is None else self.inFlight[shard]
+        for seq, message, pkt, features in results:
+            if inFlight is not None:
+                while inFlight and inFlight[0] <= seq:
+                    inFlight.popleft()
+            if seq >= self.nextSeq:
+                pending[seq] = (message, pkt, features)
+
+    def skipDeadShards(self, pending):
+        """
+        Log the processes found dead, and skip the packets in flight to them.
+
+        The results a process sent before dying are received first.
+        """
+
+        died = False
+        for shard, process in enumerate(self.processes):
+            if not self.dead[shard] and not self.closing and not process.is_alive():
+                logging.error(
+                    f"[*] Matcher process {process.pid} of shard {shard} died "
+                    f"(exit code {process.exitcode}), skipping the packets of its flows."
+                )
+                self.dead[shard] = True
+                died = True
+        if died:
+            while True:
+                try:
+                    item = self.outbox.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # stopped meanwhile, left for the sink loop
+                    self.outbox.put(None)
+                    break
+                self.receive(item, pending)
+        for shard, inFlight in enumerate(self.inFlight):
+            # the capture thread may still have queued packets to it meanwhile
+            while self.dead[shard] and inFlight:
+                seq = inFlight.popleft()
+                if seq >= self.nextSeq and seq not in pending:
+                    pending[seq] = (None, None, None)
+
+    def close(self):
+        """Match the packets still queued, then stop the processes and the sink."""
+
+        self.flush()
+        # processes stopping now are not dead, their last results are still to come
+        self.closing = True
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join(JOIN_TIMEOUT)
+            if process.is_alive():
+                logging.warning(
+                    f"[*] Matcher process {process.pid} did not stop, terminating it."
+                )
+                process.terminate()
+                process.join()
+        self.outbox.put(None)
+        self.sinkThread.join()
+        logging.info(
+            f"[*] Packet rings : {self.stats()}, {self.oversized} frames too long for a slot"
+        )
+        for ring in self.rings:
+            ring.close()
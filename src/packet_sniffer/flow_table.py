@@ -0,0 +1,261 @@
+"""Connection tracking : one record per flow, for retransmission checks, verdict caching and AIDS features."""
+
+import time
+from collections import OrderedDict, deque
+
+from src.sids.packet_string_builder import ACK, FIN, RST, SYN
+from src.sids.protocol_enum import Protocol
+
+# segments remembered per flow direction to recognize retransmissions
+RECENT_SEGMENTS = 16
+
+# connection states, named as in the UNSW-NB15 dataset the AIDS is trained on
+INT = "INT"  # only the initiator has sent packets
+REQ = "REQ"  # TCP connection requested
+CON = "CON"  # both directions seen
+FIN_STATE = "FIN"  # TCP connection being closed
+RST_STATE = "RST"  # TCP connection reset
+
+
+def flowKey(view):
+    """Return the key of the decoded packet's flow, the same for both directions of a flow."""
+    a = (view.src, view.sport)
+    b = (view.dst, view.dport)
+    if b < a:
+        return (view.protocol, b, a)
+    return (view.protocol, a, b)
+
+
+class Flow:
+    """
+    The state of one flow, its "source" being the side that sent the first packet.
+
+    Counters are kept per direction. TCP segments are checked for
+    retransmission against the last RECENT_SEGMENTS segments of their
+    direction, and the verdict of each direction is cached with the ruleset
+    generation that produced it.
+    """
+
+    __slots__ = (
+        "srcAddress",
+        "srcPort",
+        "protocol",
+        "first",
+        "last",
+        "srcLast",
+        "dstFirst",
+        "dstLast",
+        "srcPackets",
+        "dstPackets",
+        "srcBytes",
+        "dstBytes",
+        "srcTtl",
+        "dstTtl",
+        "state",
+        "srcSegments",
+        "dstSegments",
+        "srcVerdict",
+        "dstVerdict",
+    )
+
+    def __init__(self, view, now):
+        self.srcAddress = view.src
+        self.srcPort = view.sport
+        self.protocol = view.protocol
+        self.first = self.last = self.srcLast = now
+        self.dstFirst = self.dstLast = None
+        self.srcPackets = self.dstPackets = 0
+        self.srcBytes = self.dstBytes = 0
+        self.srcTtl = self.dstTtl = None
+        self.state = INT
+        self.srcSegments = self.dstSegments = (
+            None  # (seq, ack, length) of recent segments
+        )
+        self.srcVerdict = self.dstVerdict = None  # (ruleset generation, rule or None)
+
+    def isForward(self, view):
+        """Returns True if the packet goes from the flow's source to its destination."""
+        return view.src == self.srcAddress and view.sport == self.srcPort
+
+    def update(self, view, now):
+        """Count the packet, returning True if it is a TCP retransmission."""
+
+        self.last = now
+        if self.isForward(view):
+            self.srcLast = now
+            self.srcPackets += 1
+            self.srcBytes += view.length
+            self.srcTtl = view.ttl
+            forward = True
+        else:
+            if self.dstFirst is None:
+                self.dstFirst = now
+            self.dstLast = now
+            self.dstPackets += 1
+            self.dstBytes += view.length
+            self.dstTtl = view.ttl
+            forward = False
+
+        if self.protocol != Protocol.TCP:
+            if not forward:
+                self.state = CON
+            return False
+
+        flags = view.flags
+        if flags & RST:
+            self.state = RST_STATE
+        elif flags & FIN:
+            self.state = FIN_STATE
+        elif flags & SYN and not flags & ACK:
+            if self.state == INT:
+                self.state = REQ
+        elif not forward and self.state in (INT, REQ):
+            self.state = CON
+        return self.isRetransmission(view, forward)
+
+    def isRetransmission(self, view, forward):
+        """
+        Returns True if the TCP segment was already seen in its direction, recording it otherwise.
+
+        Only an exact repeat of the sequence number, acknowledgment number and
+        length of one of the recent segments is a retransmission, so segments
+        arriving out of order, or behind a forged sequence number, are still
+        inspected.
+        """
+
+        segment = (view.seq, view.ack, len(view.payload))
+        segments = self.srcSegments if forward else self.dstSegments
+        if segments is None:
+            segments = deque(maxlen=RECENT_SEGMENTS)
+            if forward:
+                self.srcSegments = segments
+            else:
+                self.dstSegments = segments
+        elif segment in segments:
+            return True
+        segments.append(segment)
+        return False
+
+    def features(self):
+        """Return the flow features, named as the UNSW-NB15 columns the AIDS is trained on."""
+
+        duration = self.last - self.first
+
+        def meanInterval(first, last, packets):
+            # milliseconds, as in the dataset
+            if first is None or packets < 2:
+                return 0.0
+            return (last - first) * 1000 / (packets - 1)
+
+        return {
+            "state": self.state,
+            "dur": duration,
+            "sbytes": self.srcBytes,
+            "dbytes": self.dstBytes,
+            "sttl": self.srcTtl or 0,
+            "dttl": self.dstTtl or 0,
+            "Spkts": self.srcPackets,
+            "Dpkts": self.dstPackets,
+            "smeansz": self.srcBytes / self.srcPackets if self.srcPackets else 0,
+            "dmeansz": self.dstBytes / self.dstPackets if self.dstPackets else 0,
+            "Sload": self.srcBytes * 8 / duration if duration else 0.0,
+            "Dload": self.dstBytes * 8 / duration if duration else 0.0,
+            "Sintpkt": meanInterval(self.first, self.srcLast, self.srcPackets),
+            "Dintpkt": meanInterval(self.dstFirst, self.dstLast, self.dstPackets),
+        }
+
+
+class FlowTable:
+    """
+    The flows seen by a sniffer, keyed on their normalized 5-tuple.
+
+    Each packet costs one dict lookup. Flows idle for more than idleTimeout
+    seconds are expired, and the least recently active flow is evicted once
+    maxFlows are held, so memory stays bounded on any link.
+    """
+
+    def __init__(self, maxFlows=65536, idleTimeout=120.0):
+        self.maxFlows = maxFlows
+        self.idleTimeout = idleTimeout
+        self.flows = OrderedDict()  # key -> Flow, least recently active first
+        self.created = 0
+        self.expired = 0
+        self.evictions = 0
+        self.retransmissions = 0
+        self.verdictHits = 0
+        self.verdictMisses = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def update(self, view, now=None):
+        """
+        Count the decoded packet in its flow, creating it if needed.
+
+        Returns (flow, True if the packet is a TCP retransmission).
+        """
+
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+        key = flowKey(view)
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = Flow(view, now)
+            self.flows[key] = flow
+            self.created += 1
+            if len(self.flows) > self.maxFlows:
+                self.flows.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.flows.move_to_end(key)
+        retransmission = flow.update(view, now)
+        if retransmission:
+            self.retransmissions += 1
+        return flow, retransmission
+
+    def expire(self, now):
+        """Drop the flows idle for more than idleTimeout seconds."""
+        flows = self.flows
+        while flows:
+            flow = next(iter(flows.values()))
+            if now - flow.last <= self.idleTimeout:
+                break
+            flows.popitem(last=False)
+            self.expired += 1
+
+    def find(self, view):
+        """Return the flow of the decoded packet, or None if it is not tracked."""
+        return self.flows.get(flowKey(view))
+
+    def getVerdict(self, flow, view, generation):
+        """Return (True, verdict) if a verdict of the ruleset generation is cached for the packet's direction, (False, None) otherwise."""
+
+        entry = flow.srcVerdict if flow.isForward(view) else flow.dstVerdict
+        if entry is not None and entry[0] == generation:
+            self.verdictHits += 1
+            return True, entry[1]
+        self.verdictMisses += 1
+        return False, None
+
+    def putVerdict(self, flow, view, verdict, generation):
+        """Cache the verdict of the ruleset generation for the packet's direction."""
+        if flow.isForward(view):
+            flow.srcVerdict = (generation, verdict)
+        else:
+            flow.dstVerdict = (generation, verdict)
+
+    def clear(self):
+        self.flows.clear()
+
+    def stats(self):
+        """Return the table counters."""
+        return {
+            "size": len(self.flows),
+            "created": self.created,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "retransmissions": self.retransmissions,
+            "verdict_hits": self.verdictHits,
+            "verdict_misses": self.verdictMisses,
+        }
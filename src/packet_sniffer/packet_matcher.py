@@ -0,0 +1,87 @@
+"""Matching of decoded packets against a published ruleset, shared by the sniffer and the matcher processes."""
+
+from src.sids.batch_matcher import NO_MATCH
+from src.sids.protocol_enum import Protocol
+from src.sids.rule_index import iterBits
+
+
+class Matcher:
+    """
+    Matches decoded packets against a RuleIndex, tracking their flows in a FlowTable.
+
+    The ruleIndex is replaced as a whole, never modified in place, so a match
+    always sees a consistent version of the ruleset.
+    """
+
+    def __init__(self, ruleIndex, flows):
+        self.ruleIndex = ruleIndex
+        self.flows = flows
+
+    def trackFlow(self, view, timestamp):
+        """
+        Count the decoded UDP or TCP packet in its flow and return the flow.
+
+        Returns None for a TCP retransmission, or a packet of another protocol.
+        """
+        if view.protocol is None:
+            return None
+        flow, retransmission = self.flows.update(view, timestamp)
+        if retransmission:
+            return None
+        return flow
+
+    def matchPacket(self, view, flow=None):
+        """Return the first rule matched by the decoded packet, or None, reusing the verdict cached in its flow if any."""
+        index = self.ruleIndex
+        if flow is not None:
+            cached, rule = self.flows.getVerdict(flow, view, index.generation)
+            if cached:
+                if rule is not None:
+                    rule.hits += 1
+                return rule
+
+        # Check for matching rules, among the candidates for this protocol and port
+        bits = index.flowBits(view)
+        cacheable = flow is not None and index.isFlowInvariant(bits)
+        if bits & index.contentBits:
+            bits &= index.contentFilter(view)
+        if bits & (index.httpRequestBits | index.protocolBits[Protocol.HTTP]):
+            bits &= index.httpFilter(view)
+
+        verdict = None
+        for position in iterBits(bits):
+            rule = index.rules[position]
+            rule.evaluations += 1
+            if rule.match(view):
+                rule.hits += 1
+                verdict = rule
+                break
+
+        if cacheable:
+            self.flows.putVerdict(flow, view, verdict, index.generation)
+        return verdict
+
+    def matchBatch(self, views):
+        """Return the first rule matched by each decoded packet (or None), header-only rules being matched for the whole batch at once."""
+        index = self.ruleIndex
+        verdicts = []
+        firstHeaderOnly = index.getBatchMatcher().matchViews(views)
+        for view, first in zip(views, firstHeaderOnly.tolist()):
+            # rules with options placed before the first header-only match may still win
+            bits = index.candidateBits(view) & ~index.headerOnlyBits
+            if first != NO_MATCH:
+                bits &= (1 << first) - 1
+            verdict = None
+            for position in iterBits(bits):
+                rule = index.rules[position]
+                rule.evaluations += 1
+                if rule.match(view):
+                    verdict = rule
+                    break
+            if verdict is None and first != NO_MATCH:
+                verdict = index.rules[first]
+                verdict.evaluations += 1
+            if verdict is not None:
+                verdict.hits += 1
+            verdicts.append(verdict)
+        return verdicts
@@ -0,0 +1,138 @@
+"""Fixed-size ring of raw frames in shared memory, between the capture thread and a matcher process."""
+
+import struct
+import time
+from multiprocessing import shared_memory
+
+# ring header : next sequence number to write, next to read, frames dropped.
+# Each counter has a single writer, the consumer only ever writing TAIL.
+HEADER = struct.Struct("<QQQ")
+COUNTER = struct.Struct("<Q")
+HEAD, TAIL, DROPPED = 0, 8, 16
+# slot header : sequence number, capture timestamp, frame length
+SLOT = struct.Struct("<QdI")
+
+
+class PacketRing:
+    """
+    A single-producer single-consumer ring of slots holding frame bytes, timestamp and length.
+
+    The producer never waits : when every slot is in use the frame is dropped
+    and counted, so an overloaded consumer shows up in the counters instead of
+    growing memory. Frames longer than slotSize are refused, the producer
+    has to hand them over some other way. The ring pickles as its shared memory name, so a process can attach to it.
+    """
+
+    def __init__(self, slots=4096, slotSize=2048, name=None):
+        """Create a new ring, or attach to the existing ring called name."""
+
+        self.slots = slots
+        self.slotSize = slotSize
+        self.stride = SLOT.size + slotSize
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=HEADER.size + slots * self.stride
+            )
+            HEADER.pack_into(self.shm.buf, 0, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.buf = self.shm.buf
+
+    def __getstate__(self):
+        return {"name": self.shm.name, "slots": self.slots, "slotSize": self.slotSize}
+
+    def __setstate__(self, state):
+        self.__init__(state["slots"], state["slotSize"], state["name"])
+
+    def slotOffset(self, seq):
+        return HEADER.size + (seq % self.slots) * self.stride
+
+    def put(self, frame, seq, timestamp=None):
+        """
+        Copy the frame bytes into the next slot, tagged with the sequence number seq.
+
+        Returns False if the ring is full and the frame was dropped.
+        Raises ValueError if the frame is longer than slotSize.
+        """
+
+        length = len(frame)
+        if length > self.slotSize:
+            raise ValueError(
+                f"Frame of {length} bytes does not fit in a slot of {self.slotSize} bytes"
+            )
+        head, tail, dropped = HEADER.unpack_from(self.buf, 0)
+        if head - tail >= self.slots:
+            COUNTER.pack_into(self.buf, DROPPED, dropped + 1)
+            return False
+
+        offset = self.slotOffset(head)
+        SLOT.pack_into(
+            self.buf,
+            offset,
+            seq,
+            time.time() if timestamp is None else timestamp,
+            length,
+        )
+        start = offset + SLOT.size
+        self.buf[start : start + length] = frame
+        # publish the slot only once it is written
+        COUNTER.pack_into(self.buf, HEAD, head + 1)
+        return True
+
+    def written(self):
+        """Return the number of frames written so far."""
+        return COUNTER.unpack_from(self.buf, HEAD)[0]
+
+    def read(self):
+        """Return the number of frames read so far."""
+        return COUNTER.unpack_from(self.buf, TAIL)[0]
+
+    def peek(self, index=0):
+        """
+        Return (seq, timestamp, frame) of the index-th oldest unread frame, or None if fewer frames are unread.
+
+        frame is a memoryview into the slot, valid until advance() releases the slot;
+        it must be released before.
+        """
+
+        head, tail = HEADER.unpack_from(self.buf, 0)[:2]
+        if tail + index >= head:
+            return None
+        offset = self.slotOffset(tail + index)
+        seq, timestamp, length = SLOT.unpack_from(self.buf, offset)
+        start = offset + SLOT.size
+        return seq, timestamp, self.buf[start : start + length]
+
+    def advance(self, count=1):
+        """Release the count oldest unread slots to the producer."""
+        tail = COUNTER.unpack_from(self.buf, TAIL)[0]
+        COUNTER.pack_into(self.buf, TAIL, tail + count)
+
+    def get(self):
+        """Return (seq, timestamp, frame bytes) of the oldest unread frame and release its slot, or None if the ring is empty."""
+
+        entry = self.peek()
+        if entry is None:
+            return None
+        seq, timestamp, slot = entry
+        frame = bytes(slot)
+        slot.release()
+        self.advance()
+        return seq, timestamp, frame
+
+    def stats(self):
+        """Return the ring counters."""
+        head, tail, dropped = HEADER.unpack_from(self.buf, 0)
+        return {
+            "written": head,
+            "pending": head - tail,
+            "dropped": dropped,
+        }
+
+    def close(self):
+        """Detach from the ring, and free it if this process created it."""
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -1,44 +1,163 @@
 import logging
 import threading
+import time
 from threading import Thread
 
 from scapy.all import *
 from scapy.layers.inet import IP, TCP, UDP
 
-from src.sids.rule import *
+from src.packet_sniffer.flow_shards import FlowShards, udpFrameShard
+from src.packet_sniffer.flow_table import FlowTable
+from src.packet_sniffer.packet_matcher import Matcher
+from src.packet_sniffer.unknown_packet_queue import DROP_OLDEST, UnknownPacketQueue
+from src.sids.bpf_filter import ALL_IP, admits, captureFilter, checkedFilter
+from src.sids.ip_network_utils import intToIp, ipToInt
+from src.sids.packet_view import PacketView
+from src.sids.Rule import *
+from src.sids.rule_index import RuleIndex
+from src.sids.rule_stats import loadStats, reorder, saveStats
+
+# incomplete batches, and frames not yet notified to the matcher processes,
+# are not held back for longer than this many seconds on a quiet link
+FLUSH_INTERVAL = 1.0
+
+# a capture restarted for new rules is not restarted again before this many seconds,
+# the rules inserted meanwhile being added to the filter all at once
+FILTER_UPDATE_INTERVAL = 5.0
 
 
 class Sniffer(Thread):
     """Thread responsible for sniffing and detecting suspect packet."""
 
-    def __init__(self, ruleList, handle_unknown_packets):
+    def __init__(
+        self,
+        ruleList,
+        handle_unknown_packets,
+        batch_size=0,
+        ruleset_path=None,
+        adaptive_order=False,
+        reorder_interval=10000,
+        flow_table_size=65536,
+        flow_idle_timeout=120.0,
+        ruleIndex=None,
+        match_workers=0,
+        capture_backend="scapy",
+        iface=None,
+        capture_filter=False,
+        unknown_queue_size=1024,
+        unknown_queue_policy=DROP_OLDEST,
+        unknown_source="192.168.2.12",
+    ):
         Thread.__init__(self)
         self.stopped = False
-        self.ruleList = ruleList
+        # Adaptive mode : every reorder_interval packets, most hit rules are moved first
+        # Rule counters are kept next to the ruleset, so a restart begins with a warm order
+        self.ruleset_path = ruleset_path
+        self.adaptive_order = adaptive_order
+        self.reorder_interval = reorder_interval
+        self.packetCount = 0
+        self.reorderThread = None  # the running reorder, off the capture thread
+        if ruleset_path and adaptive_order:
+            loadStats(ruleList, ruleset_path)
+            ruleList = reorder(ruleList)
+        # an index precompiled for this exact rule order can be handed over
+        if ruleIndex is None or ruleIndex.rules != ruleList:
+            ruleIndex = RuleIndex(ruleList, ruleIndex.keys if ruleIndex else ())
+        # Tracked flows, forgotten after flow_idle_timeout seconds without packets or when
+        # more than flow_table_size are held : used to ignore TCP retransmissions, to cache
+        # the verdict of flows whose candidate rules only look at the 5-tuple, and by the AIDS
+        self.flow_table_size = flow_table_size
+        self.flow_idle_timeout = flow_idle_timeout
+        # The published ruleset, matched with the flows by the matcher : replaced as a whole,
+        # never modified in place, so inPacket always sees a consistent version
+        self.matcher = Matcher(ruleIndex, FlowTable(flow_table_size, flow_idle_timeout))
+        self.updateLock = threading.Lock()  # serializes ruleset updates
+        # Batch mode : UDP packets are matched in groups of batch_size (0 to disable)
+        self.batch_size = batch_size
+        self.batch = []
+        # Sharded mode : UDP packets are matched in match_workers processes (0 to disable),
+        # started with the sniffing
+        self.match_workers = match_workers
+        self.shards = None
+        if match_workers and adaptive_order:
+            logging.warning(
+                "[*] Rule counters are kept by the matcher processes, adaptive order is disabled."
+            )
+            self.adaptive_order = False
+        # Capture : "scapy" dissects every packet with sniff(), "raw" reads frames from an
+        # AF_PACKET socket (Linux) and only dissects the packets that are logged or sent to the AIDS
+        self.capture_backend = capture_backend
+        self.iface = iface
+        self.capture = None  # the running scapy capture
+        self.captureFilter = None  # and its filter
+        # held while handling a captured packet, so the flush thread never runs concurrently
+        self.captureLock = threading.Lock()
         self.handle_unknown_packets = handle_unknown_packets
-        self.unknownPackets = []
-        self.processed_sequences = set()  # To track processed sequence numbers
-        self.lock = threading.Lock()
+        # only unknown packets from this address are handed over to the AIDS
+        self.unknownSource = ipToInt(unknown_source)
+        # Kernel filter derived from the rules, regenerated with the ruleset (or every IP packet)
+        self.capture_filter = capture_filter
+        self.bpfFilter = self.buildFilter()
+        self.filterUpdated = float("-inf")  # when the filter last changed
+        self.filterTimer = None  # the pending update of the filter for inserted rules
+        self.alertCount = 0  # matched packets
+        self.unknownCount = 0  # packets handed over to the AIDS
+        # Unknown packets waiting for the AIDS, at most unknown_queue_size; when full,
+        # unknown_queue_policy decides between blocking, dropping the oldest or sampling
+        self.unknownPackets = UnknownPacketQueue(
+            unknown_queue_size, unknown_queue_policy
+        )
 
     def stop(self):
         self.stopped = True
+        self.restartCapture()
 
     def stopfilter(self, x):
         return self.stopped
 
-    def handleUnknownPacket(self, pkt):
-        """Handling unknown packets"""
-        with self.lock:
-            # Acquiring the lock to ensure thread-safe access to unknownPackets
-            self.unknownPackets.append(pkt)  # Store the raw packet data
+    def handleUnknownPacket(self, pkt, features=None):
+        """Handling unknown packets, with the features of their flow when it was tracked"""
+        self.unknownCount += 1
+        # Store the raw packet data, waking up the AIDS
+        self.unknownPackets.put((pkt, features))
+
+    @property
+    def ruleIndex(self):
+        return self.matcher.ruleIndex
+
+    @ruleIndex.setter
+    def ruleIndex(self, ruleIndex):
+        self.matcher.ruleIndex = ruleIndex
+
+    @property
+    def flows(self):
+        return self.matcher.flows
+
+    @property
+    def ruleList(self):
+        return self.ruleIndex.rules
 
     def update_ruleset(self):
 
-        from src.sids.rule_file_reader import read
-        from src.sids.sids_main import DEFAULT_RULESET_PATH
+        from src.sids.ruleset_cache import readCompiled
+        from src.sids.sids_main import (
+            DEFAULT_RULESET_PATH,
+            sids_optimize_ruleset,
+            sids_rewrite_optimized_ruleset,
+        )
 
         logging.info("[*] Reloading rules due to new rule addition...")
-        self.ruleList, errorCount = read(DEFAULT_RULESET_PATH)
+        with self.updateLock:
+            self.saveStats()
+            ruleList, errorCount, ruleIndex = readCompiled(
+                DEFAULT_RULESET_PATH,
+                optimized=sids_optimize_ruleset,
+                rewrite=sids_rewrite_optimized_ruleset,
+            )
+            if self.ruleset_path and self.adaptive_order:
+                loadStats(ruleList, self.ruleset_path)
+                ruleIndex = RuleIndex(reorder(ruleList), ruleIndex.keys)
+            self.publish(ruleIndex)
         if errorCount == 0:
             logging.info(
                 f"[*] All ({len(self.ruleList)}) rules have been correctly read."
@@ -47,44 +166,254 @@ class Sniffer(Thread):
             logging.info(f"[*] {len(self.ruleList)} rules have been correctly read.")
             logging.info(f"[*] {errorCount} rules have errors and could not be read.")
 
-    def inPacket(self, pkt):
-        """Directive for each received packet."""
+    def insert_rule(self, rule_string):
+        """
+        Add one rule to the live ruleset, after the existing ones.
+
+        Only the new rule is parsed; the indexes are extended copy-on-write and
+        the new version is published with a single assignment.
+        Returns the new Rule, or None if the rule string is invalid or already in use.
+        """
+        try:
+            rule = Rule(rule_string)
+        except ValueError as err:
+            logging.error(f"Invalid rule not inserted : {err}")
+            return None
+
+        with self.updateLock:
+            if self.ruleIndex.hasRule(rule):
+                logging.info(f"[*] Rule already in use, not inserted : {rule}")
+                return None
+            if self.shards is not None:
+                self.shards.insertRule(rule)
+            self.ruleIndex = self.ruleIndex.withRule(rule)
+            if not admits(self.bpfFilter, rule, self.filterUnknownSource()):
+                self.scheduleFilterUpdate()
+        logging.info(f"[*] Rule inserted, {len(self.ruleIndex)} rules in use.")
+        return rule
+
+    def publish(self, ruleIndex):
+        """Make the ruleset the one matched from now on, in this thread and the matcher processes."""
+        if self.shards is not None:
+            self.shards.publish(ruleIndex)
+        self.ruleIndex = ruleIndex
+        self.updateFilter()
+
+    def filterUnknownSource(self):
+        """Return the address whose UDP packets the capture filter keeps for the AIDS, or None."""
+        return intToIp(self.unknownSource) if self.handle_unknown_packets else None
+
+    def buildFilter(self):
+        """Return the BPF expression of the packets the ruleset or the AIDS may need."""
+        if not self.capture_filter:
+            return ALL_IP
+        return checkedFilter(
+            captureFilter(self.ruleList, self.filterUnknownSource()), self.iface
+        )
+
+    def updateFilter(self):
+        """Regenerate the capture filter, restarting a scapy capture if it changed."""
+        if self.filterTimer is not None:
+            # the whole ruleset is covered now
+            self.filterTimer.cancel()
+            self.filterTimer = None
+        bpfFilter = self.buildFilter()
+        if bpfFilter != self.bpfFilter:
+            self.bpfFilter = bpfFilter
+            self.filterUpdated = time.monotonic()
+            logging.info(f"[*] Capture filter : {bpfFilter}")
+            self.restartCapture()
+
+    def scheduleFilterUpdate(self):
+        """
+        Update the capture filter for inserted rules, at most once every FILTER_UPDATE_INTERVAL seconds.
+
+        Called with the update lock held. Until then, the packets of the new rules may not be captured.
+        """
+        if self.filterTimer is not None:
+            return
+        delay = self.filterUpdated + FILTER_UPDATE_INTERVAL - time.monotonic()
+        if delay <= 0:
+            self.updateFilter()
+            return
+        self.filterTimer = threading.Timer(delay, self.scheduledFilterUpdate)
+        self.filterTimer.daemon = True
+        self.filterTimer.start()
+
+    def scheduledFilterUpdate(self):
+        """Update the capture filter for the rules inserted since the last update."""
+        with self.updateLock:
+            if self.filterTimer is threading.current_thread():
+                self.filterTimer = None
+                self.updateFilter()
+
+    def restartCapture(self):
+        """Interrupt the running scapy capture, which the sniffing loop restarts unless stopped."""
+        capture = self.capture
+        if capture is not None and capture.running:
+            try:
+                capture.stop(join=False)
+            except Scapy_Exception:
+                pass  # finished meanwhile
+
+    def has_rule(self, rule_string):
+        """Returns True if the live ruleset already holds a rule equivalent to the rule string."""
+        try:
+            return self.ruleIndex.hasRule(Rule(rule_string))
+        except ValueError:
+            return False
+
+    def saveStats(self):
+        """Persist the rule counters next to the ruleset."""
+        if self.ruleset_path:
+            saveStats(self.ruleList, self.ruleset_path)
+
+    def reorderRules(self):
+        """
+        Move the most hit rules first, where it does not change any verdict.
+
+        The new order is built from the published ruleset without holding the
+        update lock, and only published if no update replaced that ruleset meanwhile,
+        and if the order actually changed.
+        """
+        ruleIndex = self.ruleIndex
+        rules = reorder(ruleIndex.rules)
+        reordered = None
+        if any(rule is not current for rule, current in zip(rules, ruleIndex.rules)):
+            reordered = RuleIndex(rules, ruleIndex.keys)
+        with self.updateLock:
+            if reordered is not None and self.ruleIndex is ruleIndex:
+                self.publish(reordered)
+            self.saveStats()
+
+    def startReorder(self):
+        """Reorder the rules in a background thread, unless the previous reorder is still running."""
+        if self.reorderThread is not None and self.reorderThread.is_alive():
+            return
+        self.reorderThread = threading.Thread(target=self.reorderRules, daemon=True)
+        self.reorderThread.start()
+
+    def countPacket(self):
+        """Count a handled packet, reordering the rules periodically in adaptive mode."""
+        self.packetCount += 1
+        if self.adaptive_order and self.packetCount % self.reorder_interval == 0:
+            self.startReorder()
+
+    def matchPacket(self, view, flow=None):
+        """Return the first rule matched by the decoded packet, or None, reusing the verdict cached in its flow if any."""
+        return self.matcher.matchPacket(view, flow)
+
+    def matchBatch(self, views):
+        """Return the first rule matched by each decoded packet (or None), header-only rules being matched for the whole batch at once."""
+        return self.matcher.matchBatch(views)
+
+    def flushBatch(self):
+        """Match and handle the packets waiting in the batch."""
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        rules = self.matchBatch([view for view, features in batch])
+        for (view, features), rule in zip(batch, rules):
+            self.handleVerdict(view, rule, features)
+
+    def flowFeatures(self, view, flow):
+        """Return a snapshot of the flow features if the packet may be handed over to the AIDS, None otherwise."""
+        if flow is None or not self.handle_unknown_packets:
+            return None
+        if view.src != self.unknownSource:
+            return None
+        return flow.features()
+
+    def handleVerdict(self, view, rule, features=None):
+        """Log the matched rule, or hand the unknown packet over to the AIDS with the features of its flow."""
+        pkt = view.pkt
+        self.countPacket()
+        if rule is not None:
+            # matched = True  # packet matched a rule - Known traffic
+            self.alertCount += 1
+            logging.info(rule.getMatchedPrintMessage(pkt))
+            return
 
-        # Uncomment for TCP implementation
-        # Check if this packet is a retransmission (for TCP packets)
-        if TCP in pkt:
-            seq_number = pkt[TCP].seq
-            ack_number = pkt[TCP].ack
-            # Create a unique key for this TCP connection
-            tcp_key = (
-                pkt[IP].src,
-                pkt[IP].dst,
-                pkt[TCP].sport,
-                pkt[TCP].dport,
-                seq_number,
-                ack_number,
+        if view.src == self.unknownSource:
+            if self.handle_unknown_packets:
+                logging.info(
+                    f"[*] Processing unknown packet from IP: {pkt[IP].src} ..."
+                )
+                self.handleUnknownPacket(pkt, features)
+
+    def handleView(self, view, flow=None):
+        """Match a decoded UDP packet of the flow, at once or with its batch."""
+        # taken now, the flow keeps changing while the packet waits for its batch or the AIDS
+        features = self.flowFeatures(view, flow)
+        if self.batch_size:
+            self.batch.append((view, features))
+            if len(self.batch) >= self.batch_size:
+                self.flushBatch()
+            return
+        self.handleVerdict(view, self.matchPacket(view, flow), features)
+
+    def inFrame(self, frame, timestamp):
+        """Directive for each raw frame of the raw capture backend, parsed without scapy."""
+
+        if self.shards is not None:
+            shard = udpFrameShard(frame, self.match_workers)
+            if shard is not None:
+                # decoded, tracked and matched by the process owning its flow
+                self.shards.submitFrame(frame, timestamp, Ether, shard)
+                return
+
+        view = PacketView.fromFrame(frame, timestamp)
+        # only IP packets are handled, as with the "ip" filter of sniff()
+        if view.src is None:
+            return
+
+        flow = self.trackFlow(view, timestamp)
+        if flow is None and view.protocol == Protocol.TCP:
+            return  # Ignore this packet as it's a retransmission
+
+        if view.protocol == Protocol.UDP:
+            self.handleView(view, flow)
+        elif view.protocol == Protocol.TCP and view.dport == 5000:
+            logging.info(
+                f"[*] Sorry, TCP packets not implemented thanks to Windows Firewall issues..."
             )
-            if tcp_key in self.processed_sequences:
-                return  # Ignore this packet as it's a retransmission
-            self.processed_sequences.add(tcp_key)  # Mark this packet as processed
+
+    def handleShardResult(self, message, pkt, features):
+        """Log the alert message, or hand the unknown packet and its flow features over to the AIDS, of a packet matched in a matcher process."""
+        if message is not None:
+            self.alertCount += 1
+            logging.info(message)
+        else:
+            logging.info(f"[*] Processing unknown packet from IP: {pkt[IP].src} ...")
+            self.handleUnknownPacket(pkt, features)
+
+    def trackFlow(self, view, timestamp):
+        """
+        Count the decoded UDP or TCP packet in its flow and return the flow.
+
+        Returns None for a TCP retransmission, or a packet of another protocol.
+        """
+        return self.matcher.trackFlow(view, timestamp)
+
+    def inPacket(self, pkt):
+        """Directive for each received packet."""
 
         # Check for IP packets
         if IP in pkt:
+            if self.shards is not None and UDP in pkt:
+                # decoded, tracked and matched by the process owning its flow
+                self.shards.submit(pkt)
+                return
+
+            # Decode the packet once for the flow table and every rule check
+            view = PacketView(pkt)
+            flow = self.trackFlow(view, float(pkt.time))
+            if flow is None and view.protocol == Protocol.TCP:
+                return  # Ignore this packet as it's a retransmission
+
             # Check for UDP packets
             if UDP in pkt:
-                # Check for matching rules
-                for rule in self.ruleList:
-                    if rule.match(pkt):
-                        # matched = True  # packet matched a rule - Known traffic
-                        logging.info(rule.getMatchedPrintMessage(pkt))
-                        return
-
-                if pkt[IP].src == "192.168.2.12":
-                    if self.handle_unknown_packets:
-                        logging.info(
-                            f"[*] Processing unknown packet from IP: {pkt[IP].src} ..."
-                        )
-                        self.handleUnknownPacket(pkt)
+                self.handleView(view, flow)
             # Check for TCP packets
             elif TCP in pkt:
                 if pkt[TCP].dport == 5000:
@@ -113,24 +442,7 @@ class Sniffer(Thread):
         #     # Check for TCP packets
         #     elif TCP in pkt:
         #         logging.info(f"[*] Detected TCP packet from {pkt[IP].src} to {pkt[IP].dst}.")
-        #         # Create a unique key for this TCP connection to check for retransmissions
-        #         seq_number = pkt[TCP].seq
-        #         ack_number = pkt[TCP].ack
-        #         tcp_key = (
-        #             pkt[IP].src,
-        #             pkt[IP].dst,
-        #             pkt[TCP].sport,
-        #             pkt[TCP].dport,
-        #             seq_number,
-        #             ack_number,
-        #         )
-        #         # Check if the TCP packet is already processed
-        #         if tcp_key in self.processed_sequences:
-        #             logging.info(f"[*] TCP packet {tcp_key} is a retransmission. Ignoring.")
-        #             return  # Ignore this packet as it's a retransmission
-        #         # Mark this TCP packet as processed
-        #         self.processed_sequences.add(tcp_key)
-        #         # After confirming it's not a retransmission, process like UDP
+        #         # Retransmissions were already ignored by the flow table, process like UDP
         #         for rule in self.ruleList:
         #             if rule.match(pkt):
         #                 logging.info(rule.getMatchedPrintMessage(pkt))
@@ -142,8 +454,108 @@ class Sniffer(Thread):
         #             )
         #             self.handleUnknownPacket(pkt)
 
+    def startShards(self):
+        """Start the matcher processes of sharded mode, if enabled."""
+        if self.match_workers:
+            with self.updateLock:
+                self.shards = FlowShards(
+                    self.ruleIndex,
+                    self.match_workers,
+                    self.handleShardResult,
+                    self.handle_unknown_packets,
+                    self.unknownSource,
+                    batchSize=self.batch_size,
+                    flowTableSize=self.flow_table_size,
+                    flowIdleTimeout=self.flow_idle_timeout,
+                )
+
+    def flushPending(self):
+        """Match the incomplete batch, and notify the matcher processes of the frames submitted so far."""
+        self.flushBatch()
+        if self.shards is not None:
+            self.shards.flush()
+
+    def flushPeriodically(self):
+        """Flush what is pending every FLUSH_INTERVAL seconds until stopped, alongside the scapy capture."""
+        while not self.stopped:
+            time.sleep(FLUSH_INTERVAL)
+            with self.captureLock:
+                self.flushPending()
+
+    def capturePacket(self):
+        """Return the packet callback of the scapy capture."""
+        if not self.batch_size and self.shards is None:
+            return self.inPacket
+
+        def inPacket(pkt):
+            with self.captureLock:
+                self.inPacket(pkt)
+
+        return inPacket
+
+    def runScapyCapture(self):
+        """Sniff with scapy until stopped, restarting the capture whenever the filter changes."""
+
+        # In batch or sharded mode, a thread flushes every second so an incomplete batch
+        # is not held back on a quiet link, while the capture stays open
+        flushThread = None
+        if self.batch_size or self.shards is not None:
+            flushThread = threading.Thread(target=self.flushPeriodically, daemon=True)
+            flushThread.start()
+        prn = self.capturePacket()
+        while not self.stopped:
+            # stoppable from update_ruleset, and joined before the next one is started
+            self.captureFilter = self.bpfFilter
+            self.capture = AsyncSniffer(
+                prn=prn,
+                filter=self.captureFilter,  # only packets with an IP are captured
+                store=0,
+                stop_filter=self.stopfilter,
+                started_callback=self.captureStarted,
+            )
+            self.capture.start()
+            self.capture.join()
+        if flushThread is not None:
+            flushThread.join()
+        self.flushPending()
+
+    def captureStarted(self):
+        """Called by the scapy capture once it can be stopped, to stop it if it was outdated meanwhile."""
+        if self.stopped or self.captureFilter != self.bpfFilter:
+            self.restartCapture()
+
+    def runRawCapture(self):
+        """Read frames from an AF_PACKET socket until stopped."""
+        from src.packet_sniffer.raw_capture import RawCapture
+
+        capture = RawCapture(self.iface)
+        lastFlush = time.monotonic()
+        try:
+            while not self.stopped:
+                if capture.filter != self.bpfFilter:
+                    capture.setFilter(self.bpfFilter)
+                frames = capture.read(timeout=FLUSH_INTERVAL)
+                for frame, timestamp in frames:
+                    self.inFrame(frame, timestamp)
+                # do not hold back incomplete batches for more than FLUSH_INTERVAL
+                if not frames or time.monotonic() - lastFlush >= FLUSH_INTERVAL:
+                    lastFlush = time.monotonic()
+                    self.flushPending()
+        finally:
+            capture.close()
+
     def run(self):
         logging.info("[*] Sniffing started.")
-        sniff(
-            prn=self.inPacket, filter="ip", store=0, stop_filter=self.stopfilter
-        )  # ensuring only packets with an IP are captured
+        self.startShards()
+        logging.info(f"[*] Capture filter : {self.bpfFilter}")
+        if self.capture_backend == "raw":
+            self.runRawCapture()
+        else:
+            self.runScapyCapture()
+        if self.shards is not None:
+            self.shards.close()
+        if self.reorderThread is not None:
+            self.reorderThread.join()
+        self.saveStats()
+        logging.info(f"[*] Flow table : {self.flows.stats()}")
+        logging.info(f"[*] Unknown packet queue : {self.unknownPackets.stats()}")
@@ -1,5 +1,7 @@
 # sniffer_manager.py
 
+import logging
+
 from src.packet_sniffer.packet_sniffer import Sniffer
 
 _sniffer_instance = None
@@ -21,3 +23,12 @@ def update_sniffer_ruleset():
         _sniffer_instance.update_ruleset()
     else:
         print.error("No running Sniffer instance found to update rules.")
+
+
+def insert_sniffer_rule(rule_string):
+    """Add one rule to the running Sniffer without reloading the whole ruleset."""
+    global _sniffer_instance
+    if _sniffer_instance is not None:
+        _sniffer_instance.insert_rule(rule_string)
+    else:
+        logging.error("No running Sniffer instance found to insert the rule.")
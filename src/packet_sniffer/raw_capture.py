@@ -0,0 +1,69 @@
+"""Linux capture backend reading raw Ethernet frames from an AF_PACKET socket."""
+
+import logging
+import select
+import socket
+import time
+
+from scapy.arch.linux import attach_filter
+from scapy.error import Scapy_Exception
+
+ETH_P_ALL = 0x0003
+
+
+class RawCapture:
+    """
+    Reads raw frames from an AF_PACKET socket, a batch at a time, without any dissection.
+
+    Frames are returned as bytes with their receive timestamp; parsing is left
+    to PacketView.fromFrame. Requires Linux and CAP_NET_RAW.
+    """
+
+    def __init__(self, iface=None, batchSize=64, frameSize=65535, bufferSize=1 << 24):
+        """Open the socket on the interface (every interface if None)."""
+
+        if not hasattr(socket, "AF_PACKET"):
+            raise OSError("Raw socket capture requires Linux (AF_PACKET).")
+        self.iface = iface
+        self.filter = None
+        self.batchSize = batchSize
+        self.frameSize = frameSize
+        self.sock = socket.socket(
+            socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL)
+        )
+        # a large kernel buffer absorbs bursts while a batch is being matched
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, bufferSize)
+        if iface is not None:
+            self.sock.bind((iface, ETH_P_ALL))
+        self.sock.setblocking(False)
+
+    def setFilter(self, bpfFilter):
+        """Attach a BPF filter expression to the socket, replacing the previous one without missing frames."""
+        self.filter = bpfFilter
+        try:
+            attach_filter(self.sock, bpfFilter, self.iface)
+        except (ImportError, OSError, Scapy_Exception) as e:
+            logging.warning(f"Capture filter not attached, every frame is read : {e}")
+
+    def read(self, timeout=1.0):
+        """
+        Return a list of up to batchSize (frame, timestamp) pairs.
+
+        Waits at most timeout seconds for the first frame, then takes whatever
+        is already queued in the socket. The list is empty on timeout.
+        """
+
+        frames = []
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return frames
+        while len(frames) < self.batchSize:
+            try:
+                frame = self.sock.recv(self.frameSize)
+            except BlockingIOError:
+                break
+            frames.append((frame, time.time()))
+        return frames
+
+    def close(self):
+        self.sock.close()
@@ -5,9 +5,19 @@ from scapy.all import *
 from scapy.layers.inet import ICMP, IP, TCP, UDP, Ether
 
 from src.packet_sniffer.packet_sniffer import *
-from src.packet_sniffer.packet_sniffer_manager import update_sniffer_ruleset
+from src.packet_sniffer.packet_sniffer_manager import get_sniffer, insert_sniffer_rule
 from src.sids.sids_main import *
 
+# Ruleset file the rules created for detected attacks are appended to,
+# or None to only insert them into the running Sniffer (e.g. when replaying a capture)
+rules_output_path = DEFAULT_RULESET_PATH
+
+
+def set_rules_output(ruleset_path):
+    """Set the ruleset file new rules are appended to, None keeping them in memory only."""
+    global rules_output_path
+    rules_output_path = ruleset_path
+
 
 def create_rule(action, protocol, src_ip, src_port, dst_ip, dst_port, msg):
     """
@@ -31,30 +41,50 @@ def create_rule(action, protocol, src_ip, src_port, dst_ip, dst_port, msg):
     return rule
 
 
-def add_rule_to_file(rule_string, ruleset_path=DEFAULT_RULESET_PATH):
+def add_rule_to_file(rule_string, ruleset_path=None):
     """
-    Append a new rule to the specified ruleset file.
+    Append a new rule to the specified ruleset file, and insert it into the running sniffer.
 
     Args:
         rule_string (str): The rule to be added.
-        ruleset_path (str): The path to the ruleset file.
+        ruleset_path (str): The path to the ruleset file, rules_output_path by default.
     """
+    # the same rule is generated for every packet of an attack, keep only one
+    sniffer = get_sniffer()
+    if sniffer is not None and sniffer.has_rule(rule_string):
+        logging.info(f"[*] Rule already in use, not added: {rule_string}")
+        return
+
+    if ruleset_path is None:
+        ruleset_path = rules_output_path
+    if ruleset_path is None:
+        logging.info(f"[*] New rule kept in memory only: {rule_string}")
+        insert_sniffer_rule(rule_string)
+        return
+
     try:
+        # make sure the rule starts on its own line
+        with open(ruleset_path, "ab+") as file:
+            if file.seek(0, os.SEEK_END) > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    file.write(b"\n")
         with open(ruleset_path, "a") as file:
             file.write(f"{rule_string}\n")
         logging.info(f"[*] New rule added to {ruleset_path}: {rule_string}")
-        update_sniffer_ruleset()
+        # only the new rule is parsed and added to the running sniffer
+        insert_sniffer_rule(rule_string)
     except IOError as e:
         logging.error(f"Error writing to ruleset file: {e}")
 
 
-def handle_attack_detection(packet, ruleset_path=DEFAULT_RULESET_PATH):
+def handle_attack_detection(packet, ruleset_path=None):
     """
     Handle attack detection by creating and appending a new rule based on the packet details.
 
     Args:
         packet: The packet that triggered the alert.
-        ruleset_path (str): The path to the ruleset file to which the new rule will be added.
+        ruleset_path (str): The path to the ruleset file to which the new rule will be added, rules_output_path by default.
     """
     # Determine the protocol
     if TCP in packet:
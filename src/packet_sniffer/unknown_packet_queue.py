@@ -0,0 +1,120 @@
+import threading
+from collections import deque
+
+# what put() does when the queue is full
+BLOCK = "block"  # wait for the consumer, the capture then stalls and the kernel drops
+DROP_OLDEST = "drop-oldest"  # drop the oldest queued packet to make room
+SAMPLE = "sample"  # keep one of every sampleEvery packets, in place of the oldest
+POLICIES = (BLOCK, DROP_OLDEST, SAMPLE)
+
+
+class UnknownPacketQueue:
+    """
+    A bounded queue of the unknown packets handed over from the sniffer to the AIDS.
+
+    Consumers sleep on a condition until a packet is put, so an idle link costs
+    no CPU. When maxSize packets are queued, the overflow policy decides
+    between waiting, dropping the oldest packet, or sampling the new ones.
+    """
+
+    def __init__(self, maxSize=1024, policy=DROP_OLDEST, sampleEvery=10):
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy '{policy}', expected one of {POLICIES}"
+            )
+        self.maxSize = maxSize
+        self.policy = policy
+        self.sampleEvery = sampleEvery
+        self.packets = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.blocked = 0  # puts that had to wait for room
+        self.maxDepth = 0
+        self.overflow = 0  # packets put while full, for sampling
+
+    def __len__(self):
+        return len(self.packets)
+
+    def put(self, pkt):
+        """Queue the packet, applying the overflow policy if full. Returns False if it was dropped."""
+
+        with self.condition:
+            if len(self.packets) >= self.maxSize:
+                if self.policy == BLOCK:
+                    self.blocked += 1
+                    while len(self.packets) >= self.maxSize and not self.closed:
+                        self.condition.wait()
+                else:
+                    if self.policy == SAMPLE:
+                        self.overflow += 1
+                        if self.overflow % self.sampleEvery:
+                            self.dropped += 1
+                            return False
+                    self.packets.popleft()
+                    self.dropped += 1
+            if self.closed:
+                self.dropped += 1
+                return False
+
+            self.packets.append(pkt)
+            self.enqueued += 1
+            if len(self.packets) > self.maxDepth:
+                self.maxDepth = len(self.packets)
+            self.condition.notify_all()
+            return True
+
+    def getBatch(self, maxItems=None, timeout=None, linger=0):
+        """
+        Wait for a packet, then return the queued packets, up to maxItems.
+
+        Once a packet is there, waits up to linger more seconds for maxItems
+        to be queued, so packets are handed over in fuller batches.
+        Returns an empty list on timeout, or once the queue is closed and empty.
+        """
+
+        with self.condition:
+            if not self.packets and not self.closed:
+                self.condition.wait_for(
+                    lambda: self.packets or self.closed, timeout=timeout
+                )
+            if linger and maxItems is not None and self.packets:
+                self.condition.wait_for(
+                    lambda: len(self.packets) >= maxItems or self.closed,
+                    timeout=linger,
+                )
+            count = len(self.packets)
+            if maxItems is not None:
+                count = min(count, maxItems)
+            batch = [self.packets.popleft() for _ in range(count)]
+            if batch:
+                # wake up a producer waiting for room
+                self.condition.notify_all()
+            return batch
+
+    def get(self, timeout=None):
+        """Wait for a packet and return it, or None on timeout or once the queue is closed and empty."""
+        batch = self.getBatch(1, timeout)
+        return batch[0] if batch else None
+
+    def drain(self):
+        """Return every queued packet, without waiting."""
+        return self.getBatch(timeout=0)
+
+    def close(self):
+        """Wake up every waiting consumer and producer; the packets already queued can still be read."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stats(self):
+        """Return the queue counters."""
+        with self.condition:
+            return {
+                "depth": len(self.packets),
+                "max_depth": self.maxDepth,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "blocked": self.blocked,
+            }
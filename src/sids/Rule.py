@@ -6,19 +6,62 @@ from scapy.layers.inet import ICMP, IP, TCP, UDP, Ether
 from src.sids.action_enum import *
 from src.sids.ip_network_utils import *
 from src.sids.packet_string_builder import ENDC, RED, matchedPacketString, packetString
+from src.sids.packet_view import PacketView, flagsMask
 from src.sids.port_utils import *
 from src.sids.protocol_enum import *
 from src.sids.http_detection_utils import *
 
+# Options checked against the packet, in evaluation order : (attribute, predicate method).
+# A new option only needs its parsing in Rule.__init__ and an entry here.
+optionPredicates = (
+    ("tos", "checkTos"),
+    ("len", "checkLen"),
+    ("offset", "checkOffset"),
+    ("seq", "checkSeq"),
+    ("ack", "checkAck"),
+    ("flags", "checkFlags"),
+    ("http_request", "checkHttpRequest"),
+    ("content", "checkContent"),
+)
+
 
 class Rule:
     """A Signature-based Network IDS rule."""
 
+    __slots__ = (
+        "string",
+        "action",
+        "protocol",
+        "srcIps",
+        "srcPorts",
+        "dstIps",
+        "dstPorts",
+        "msg",
+        "tos",
+        "len",
+        "offset",
+        "seq",
+        "ack",
+        "flags",
+        "flagsMask",
+        "http_request",
+        "httpRequestBytes",
+        "content",
+        "contentBytes",
+        "predicates",
+        "hits",
+        "evaluations",
+    )
+
     def __init__(self, str):
         """Construct a rule from a string."""
 
         self.string = str
 
+        # times the rule was checked against a packet / matched it
+        self.evaluations = 0
+        self.hits = 0
+
         str = str.strip()
         strs = str.split(" ")
 
@@ -87,6 +130,7 @@ class Rule:
                             self.ack = int(value)
                         elif option == "flags":
                             self.flags = value
+                            self.flagsMask = flagsMask(value)
                         elif option == "http_request":
                             self.http_request = value
                             # remove starting and ending ["]
@@ -94,6 +138,7 @@ class Rule:
                                 self.http_request = self.http_request[:-1]
                             if self.http_request.startswith('"'):
                                 self.http_request = self.http_request[1:]
+                            self.httpRequestBytes = self.http_request.encode()
                         elif option == "content":
                             self.content = value
                             # remove starting and ending ["]
@@ -101,6 +146,8 @@ class Rule:
                                 self.content = self.content[:-1]
                             if self.content.startswith('"'):
                                 self.content = self.content[1:]
+                            # pre-encoded, payloads are inspected as bytes
+                            self.contentBytes = self.content.encode()
                         else:
                             raise ValueError(
                                 "Invalid rule : incorrect option : '" + option + "'."
@@ -111,6 +158,109 @@ class Rule:
                 "Invalid rule : a rule must include mandatory elements : action protocol src_ips src_ports -> dst_ips dst_ports"
             )
 
+        self.compileOptions()
+
+    def __getstate__(self):
+        # predicates are bound methods, they are compiled again when unpickling
+        return {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if name != "predicates" and hasattr(self, name)
+        }
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.compileOptions()
+
+    # slots only set for the options a rule has, kept by name in its compact state
+    optionSlots = (
+        "msg",
+        "tos",
+        "len",
+        "offset",
+        "seq",
+        "ack",
+        "flags",
+        "flagsMask",
+        "http_request",
+        "httpRequestBytes",
+        "content",
+        "contentBytes",
+    )
+
+    def compactState(self):
+        """
+        Return the parsed rule as a tuple of strings, bytes and integers.
+
+        Much cheaper to pickle than the Rule itself, e.g. from the workers
+        reading a rules file; fromCompactState builds the rule back without parsing.
+        """
+        return (
+            self.string,
+            self.action.value,
+            self.protocol.value,
+            self.srcIps.network,
+            self.srcIps.prefixLength,
+            self.srcPorts.compactState(),
+            self.dstIps.network,
+            self.dstIps.prefixLength,
+            self.dstPorts.compactState(),
+            tuple(
+                (name, getattr(self, name))
+                for name in self.optionSlots
+                if hasattr(self, name)
+            ),
+            tuple(predicate.__name__ for predicate in self.predicates),
+        )
+
+    @classmethod
+    def fromCompactState(cls, state, shared=None):
+        """
+        Build a rule from its compactState, without parsing it again.
+
+        shared, a dict, lets the rules built with it share equal Ports (see Ports.fromCompactState).
+        """
+        (
+            string,
+            actionValue,
+            protocolValue,
+            srcNetwork,
+            srcPrefixLength,
+            srcPorts,
+            dstNetwork,
+            dstPrefixLength,
+            dstPorts,
+            options,
+            predicates,
+        ) = state
+        rule = cls.__new__(cls)
+        rule.string = string
+        rule.evaluations = 0
+        rule.hits = 0
+        rule.action = Action(actionValue)
+        rule.protocol = Protocol(protocolValue)
+        rule.srcIps = IPNetwork.fromInt(srcNetwork, srcPrefixLength)
+        rule.srcPorts = Ports.fromCompactState(srcPorts, shared)
+        rule.dstIps = IPNetwork.fromInt(dstNetwork, dstPrefixLength)
+        rule.dstPorts = Ports.fromCompactState(dstPorts, shared)
+        for name, value in options:
+            setattr(rule, name, value)
+        rule.predicates = tuple(getattr(rule, method) for method in predicates)
+        return rule
+
+    def compileOptions(self):
+        """Build the tuple of predicates for the options this rule actually has."""
+        self.predicates = tuple(
+            getattr(self, method)
+            for option, method in optionPredicates
+            if hasattr(self, option)
+        )
+
+    def hasOptions(self):
+        """Returns True if and only if the rule checks any option beyond its header."""
+        return len(self.predicates) > 0
+
     def __repr__(self):
         """Returns the string representing the Rule"""
         # simply use initialization string
@@ -120,7 +270,12 @@ class Rule:
         """
         Returns True if and only if the rule is matched by given packet,
         i.e. if every part of the rule is met by the packet.
+
+        The packet may be a scapy packet or an already decoded PacketView.
         """
+        if not isinstance(pkt, PacketView):
+            pkt = PacketView(pkt)
+
         # check protocol
         if not self.checkProtocol(pkt):
             return False
@@ -140,124 +295,60 @@ class Rule:
         # otherwise the rule is met
         return True
 
-    def checkProtocol(self, pkt):
+    def checkProtocol(self, view):
         """Returns True if and only if the rule concerns packet's protocol"""
-        f = False
-        if self.protocol == Protocol.TCP and TCP in pkt:
-            f = True
-        elif self.protocol == Protocol.UDP and UDP in pkt:
-            f = True
-        elif self.protocol == Protocol.HTTP and TCP in pkt:
+        if self.protocol == Protocol.HTTP:
             # HTTP packet has to be TCP
             # check payload to determine if this is a HTTP packet
-            if isHTTP(pkt):
-                f = True
-        return f
+            return view.protocol == Protocol.TCP and view.http is not None
+        return view.protocol == self.protocol
 
-    def checkIps(self, pkt):
+    def checkIps(self, view):
         """Returns True if and only if the rule's IPs concern the pkt IPs"""
-        f = False
-        if IP not in pkt:
-            f = False
-        else:
-            srcIp = pkt[IP].src
-            dstIp = pkt[IP].dst
-            ipSrc = ip_address(unicode_(srcIp))
-            ipDst = ip_address(unicode_(dstIp))
-            if self.srcIps.contains(ipSrc) and self.dstIps.contains(ipDst):
-                # ipSrc and ipDst match rule's source and destination ips
-                f = True
-            else:
-                f = False
-        return f
-
-    def checkPorts(self, pkt):
+        if view.src is None:
+            return False
+        return self.srcIps.containsInt(view.src) and self.dstIps.containsInt(view.dst)
+
+    def checkPorts(self, view):
         """Returns True if and only if the rule's Ports concern packet's Ports"""
-        f = False
-        if UDP in pkt:
-            srcPort = pkt[UDP].sport
-            dstPort = pkt[UDP].dport
-            if self.srcPorts.contains(srcPort) and self.dstPorts.contains(dstPort):
-                f = True
-        elif TCP in pkt:
-            srcPort = pkt[TCP].sport
-            dstPort = pkt[TCP].dport
-            if self.srcPorts.contains(srcPort) and self.dstPorts.contains(dstPort):
-                f = True
-        return f
-
-    def checkOptions(self, pkt):
-        """Return True if and only if all options are matched"""
+        if view.protocol is None:
+            return False
+        return self.srcPorts.contains(view.sport) and self.dstPorts.contains(view.dport)
 
-        if hasattr(self, "tos"):
-            if IP in pkt:
-                if self.tos != int(pkt[IP].tos):
-                    return False
-            else:
+    def checkOptions(self, view):
+        """Return True if and only if all options are matched"""
+        for predicate in self.predicates:
+            if not predicate(view):
                 return False
+        return True
 
-        if hasattr(self, "len"):
-            if IP in pkt:
-                if self.len != int(pkt[IP].ihl):
-                    return False
-            else:
-                return False
+    def checkTos(self, view):
+        return self.tos == view.tos
 
-        if hasattr(self, "offset"):
-            if IP in pkt:
-                if self.offset != int(pkt[IP].frag):
-                    return False
-            else:
-                return False
+    def checkLen(self, view):
+        return self.len == view.ihl
 
-        if hasattr(self, "seq"):
-            if TCP not in pkt:
-                return False
-            else:
-                if self.seq != int(pkt[TCP].seq):
-                    return False
+    def checkOffset(self, view):
+        return self.offset == view.frag
 
-        if hasattr(self, "ack"):
-            if TCP not in pkt:
-                return False
-            else:
-                if self.ack != int(pkt[TCP].ack):
-                    return False
+    def checkSeq(self, view):
+        return self.seq == view.seq
 
-        if hasattr(self, "flags"):
-            # match if and only if the received packet has all the rule flags set
-            if TCP not in pkt:
-                return False
-            else:
-                for c in self.flags:
-                    pktFlags = pkt[TCP].underlayer.sprintf("%TCP.flags%")
-                    if c not in pktFlags:
-                        return False
-
-        if hasattr(self, "http_request"):
-            if not isHTTP(pkt):
-                return False
-            elif TCP in pkt and pkt[TCP].payload:
-                data = str(pkt[TCP].payload)
-                words = data.split(" ")
-                if (len(words) < 1) or (words[0].rstrip() != self.http_request):
-                    return False
-            else:
-                return False
+    def checkAck(self, view):
+        return self.ack == view.ack
 
-        if hasattr(self, "content"):
-            payload = None
-            if TCP in pkt:
-                payload = pkt[TCP].payload
-            elif UDP in pkt:
-                payload = pkt[UDP].payload
-            if payload:
-                if self.content not in str(payload):
-                    return False
-            else:
-                return False
+    def checkFlags(self, view):
+        # match if and only if the received packet has all the rule flags set
+        if view.flags is None or self.flagsMask is None:
+            return False
+        return view.flags & self.flagsMask == self.flagsMask
 
-        return True
+    def checkHttpRequest(self, view):
+        # the payload was parsed once by the PacketView
+        return view.http is not None and view.http.method == self.httpRequestBytes
+
+    def checkContent(self, view):
+        return bool(view.payload) and self.contentBytes in view.payload
 
     def getMatchedMessage(self, pkt):
         """Return the message to be logged when the packet triggered the rule."""
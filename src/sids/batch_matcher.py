@@ -0,0 +1,154 @@
+"""Vectorized matching of packet batches against the header-only rules of a ruleset."""
+
+import numpy as np
+
+from src.sids.protocol_enum import Protocol
+
+# packet field columns, as built by packetFields
+PROTOCOL, SRC, DST, SPORT, DPORT = range(5)
+
+NO_MATCH = -1
+
+
+def isHeaderOnly(rule):
+    """Returns True if and only if the rule is decided by protocol, IPs and ports alone."""
+    return rule.protocol != Protocol.HTTP and not rule.hasOptions()
+
+
+def packetFields(views):
+    """Return the N x 5 int64 array (protocol, src, dst, sport, dport) of decoded packets."""
+
+    fields = np.zeros((len(views), 5), dtype=np.int64)
+    for i, view in enumerate(views):
+        if view.protocol is None or view.src is None:
+            continue  # protocol 0 matches no rule
+        fields[i] = (
+            view.protocol.value,
+            view.src,
+            view.dst,
+            view.sport,
+            view.dport,
+        )
+    return fields
+
+
+def ruleRows(rule, position):
+    """Return the rows of a rule : one per (sport, dport) interval pair, none if it is not header-only."""
+
+    if not isHeaderOnly(rule):
+        return []
+    return [
+        (
+            position,
+            rule.protocol.value,
+            rule.srcIps.network,
+            rule.srcIps.mask,
+            rule.dstIps.network,
+            rule.dstIps.mask,
+            sportLow,
+            sportHigh,
+            dportLow,
+            dportHigh,
+        )
+        for sportLow, sportHigh in rule.srcPorts.intervals
+        for dportLow, dportHigh in rule.dstPorts.intervals
+    ]
+
+
+class BatchMatcher:
+    """
+    The header-only rules of a ruleset stored as NumPy columns.
+
+    A rule with several port intervals takes one row per (sport, dport)
+    interval pair; every row keeps the position of its rule in the ruleset.
+    """
+
+    def __init__(self, ruleList, chunkSize=4096):
+        """Build the columns from the header-only rules of ruleList, chunkSize bounding the rows compared at once."""
+
+        self.chunkSize = chunkSize
+
+        rows = []
+        for position, rule in enumerate(ruleList):
+            rows.extend(ruleRows(rule, position))
+
+        self.setColumns(np.array(rows, dtype=np.int64).reshape(-1, 10))
+
+    def setColumns(self, columns):
+        """Split a rows x 10 array into the column attributes."""
+        (
+            self.position,
+            self.protocol,
+            self.srcNetwork,
+            self.srcMask,
+            self.dstNetwork,
+            self.dstMask,
+            self.sportLow,
+            self.sportHigh,
+            self.dportLow,
+            self.dportHigh,
+        ) = columns.T.copy()
+        self.ruleCount = len(set(self.position.tolist()))
+
+    def __len__(self):
+        return self.ruleCount
+
+    def columns(self):
+        """Return the rows x 10 array of the columns."""
+        return np.stack(
+            (
+                self.position,
+                self.protocol,
+                self.srcNetwork,
+                self.srcMask,
+                self.dstNetwork,
+                self.dstMask,
+                self.sportLow,
+                self.sportHigh,
+                self.dportLow,
+                self.dportHigh,
+            ),
+            axis=1,
+        )
+
+    def withRule(self, rule, position):
+        """Return a new matcher with the rule added at position, leaving this one untouched."""
+        rows = np.array(ruleRows(rule, position), dtype=np.int64).reshape(-1, 10)
+        matcher = BatchMatcher([], self.chunkSize)
+        matcher.setColumns(np.concatenate((self.columns(), rows)))
+        return matcher
+
+    def match(self, fields):
+        """Return, for every row of the N x 5 fields array, the position of the first matching rule or NO_MATCH."""
+
+        count = len(fields)
+        first = np.full(count, np.iinfo(np.int64).max, dtype=np.int64)
+        if count == 0 or len(self.position) == 0:
+            return np.full(count, NO_MATCH, dtype=np.int64)
+
+        protocol = fields[:, PROTOCOL, None]
+        src = fields[:, SRC, None]
+        dst = fields[:, DST, None]
+        sport = fields[:, SPORT, None]
+        dport = fields[:, DPORT, None]
+
+        for start in range(0, len(self.position), self.chunkSize):
+            rows = slice(start, start + self.chunkSize)
+            matched = (
+                (protocol == self.protocol[rows])
+                & ((src & self.srcMask[rows]) == self.srcNetwork[rows])
+                & ((dst & self.dstMask[rows]) == self.dstNetwork[rows])
+                & (sport >= self.sportLow[rows])
+                & (sport <= self.sportHigh[rows])
+                & (dport >= self.dportLow[rows])
+                & (dport <= self.dportHigh[rows])
+            )
+            positions = np.where(matched, self.position[rows], first[:, None])
+            np.minimum(first, positions.min(axis=1), out=first)
+
+        first[first == np.iinfo(np.int64).max] = NO_MATCH
+        return first
+
+    def matchViews(self, views):
+        """Return the position of the first matching header-only rule for every decoded packet."""
+        return self.match(packetFields(views))
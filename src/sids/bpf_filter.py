@@ -0,0 +1,160 @@
+"""Kernel capture filter (BPF expression) derived from the rules, so unmatchable packets stay out of userspace."""
+
+import logging
+
+from scapy.data import DLT_EN10MB
+from scapy.error import Scapy_Exception
+
+from src.sids.ip_network_utils import intToIp
+from src.sids.protocol_enum import Protocol
+
+# above this many distinct rule terms, the compiled program could exceed the kernel limits
+MAX_FILTER_TERMS = 256
+
+# largest program the kernel accepts (BPF_MAXINSNS)
+MAX_INSTRUCTIONS = 4096
+
+# filter of a capture that keeps every IPv4 packet
+ALL_IP = "ip"
+
+# filter matching no packet at all, e.g. for an empty ruleset
+NO_PACKET = "ip and not ip"
+
+
+def networkFilter(direction, ips):
+    """Return the BPF primitive of an IPNetwork ("src" or "dst"), or None for any address."""
+
+    if ips.prefixLength == 0:
+        return None
+    if ips.prefixLength == 32:
+        return f"{direction} host {intToIp(ips.network)}"
+    return f"{direction} net {intToIp(ips.network)}/{ips.prefixLength}"
+
+
+def portsFilter(direction, ports):
+    """Return the BPF expression of a Ports ("src" or "dst"), or None for any port."""
+
+    if ports.intervals == [(0, 65535)]:
+        return None
+    terms = [
+        (
+            f"{direction} port {low}"
+            if low == high
+            else f"{direction} portrange {low}-{high}"
+        )
+        for low, high in ports.intervals
+    ]
+    if len(terms) == 1:
+        return terms[0]
+    return "(" + " or ".join(terms) + ")"
+
+
+def ruleFilter(rule, reverse=False):
+    """
+    Return the BPF expression of the packets the rule header may match, or None if it matches none.
+
+    With reverse, return the expression of the replies to these packets instead.
+    """
+
+    if not rule.srcPorts.intervals or not rule.dstPorts.intervals:
+        return None
+    src, dst = ("dst", "src") if reverse else ("src", "dst")
+    # HTTP rules are checked against TCP packets
+    terms = ["udp" if rule.protocol == Protocol.UDP else "tcp"]
+    for term in (
+        networkFilter(src, rule.srcIps),
+        portsFilter(src, rule.srcPorts),
+        networkFilter(dst, rule.dstIps),
+        portsFilter(dst, rule.dstPorts),
+    ):
+        if term is not None:
+            terms.append(term)
+    return "(" + " and ".join(terms) + ")"
+
+
+def captureFilter(ruleList, unknownSource=None, maxTerms=MAX_FILTER_TERMS):
+    """
+    Return the BPF expression of the packets some rule may match.
+
+    Options are not expressed, the filter only narrows on protocol, networks
+    and ports. If unknownSource is given, the UDP packets from this address
+    are kept too, to be handed over to the AIDS when no rule matches.
+    The replies are kept as well, so the flow table counts both directions.
+    Falls back to every IP packet when there are more than maxTerms terms.
+    """
+
+    terms = dict()
+    for rule in ruleList:
+        terms[ruleFilter(rule)] = None
+        terms[ruleFilter(rule, reverse=True)] = None
+    terms.pop(None, None)
+    if unknownSource is not None:
+        terms[f"(udp and host {unknownSource})"] = None
+
+    if not terms:
+        return NO_PACKET
+    if len(terms) > maxTerms:
+        return ALL_IP
+    return ALL_IP + " and (" + " or ".join(terms) + ")"
+
+
+def admits(expression, rule, unknownSource=None):
+    """
+    Returns True if the capture filter, built by captureFilter, already keeps every packet the rule header may match, and their replies.
+
+    Either the filter keeps every IP packet, or it has the terms of the rule,
+    or the rule only concerns UDP packets to or from the unknownSource address.
+    """
+
+    if expression == ALL_IP:
+        return True
+    if (
+        unknownSource is not None
+        and rule.protocol == Protocol.UDP
+        and f"(udp and host {unknownSource})" in expression
+    ):
+        if networkFilter("src", rule.srcIps) == f"src host {unknownSource}":
+            return True
+        if networkFilter("dst", rule.dstIps) == f"dst host {unknownSource}":
+            return True
+    # terms are only ever preceded and followed by " or " at the top level of the expression
+    prefix = ALL_IP + " and ("
+    if not expression.startswith(prefix):
+        return ruleFilter(rule) is None
+    terms = " or " + expression[len(prefix) : -1] + " or "
+    return all(
+        term is None or " or " + term + " or " in terms
+        for term in (ruleFilter(rule), ruleFilter(rule, reverse=True))
+    )
+
+
+def checkedFilter(expression, iface=None):
+    """
+    Return the expression if libpcap compiles it into a program the kernel accepts, ALL_IP otherwise.
+
+    The expression is returned unchecked when libpcap is not available.
+    """
+
+    if expression == ALL_IP:
+        return expression
+    try:
+        from scapy.arch.common import compile_filter
+        from scapy.libs.winpcapy import pcap_freecode
+
+        program = compile_filter(expression, iface=iface, linktype=DLT_EN10MB)
+    except (ImportError, OSError):
+        return expression
+    except Scapy_Exception as err:
+        logging.warning(
+            f"[*] Invalid capture filter, every IP packet is captured : {err}"
+        )
+        return ALL_IP
+
+    instructions = program.bf_len
+    pcap_freecode(program)
+    if instructions > MAX_INSTRUCTIONS:
+        logging.warning(
+            f"[*] Capture filter of {instructions} instructions is too long for the kernel, every IP packet is captured."
+        )
+        return ALL_IP
+    return expression
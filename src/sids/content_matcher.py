@@ -0,0 +1,65 @@
+from collections import deque
+
+
+class ContentMatcher:
+    """
+    An Aho-Corasick automaton over the 'content' literals of a ruleset.
+
+    Each literal holds an integer bitset of rule positions. A single pass over
+    the payload returns the union of the bitsets of every literal found in it.
+    Works on str or bytes, as long as payloads and literals are of the same type.
+    """
+
+    def __init__(self, patterns=()):
+        """Build the automaton from (literal, bitset) pairs."""
+
+        self.patterns = list(patterns)
+
+        # state 0 is the root
+        self.goto = [dict()]
+        self.fail = [0]
+        self.out = [0]
+
+        for pattern, bits in self.patterns:
+            state = 0
+            for symbol in pattern:
+                nextState = self.goto[state].get(symbol)
+                if nextState is None:
+                    nextState = len(self.goto)
+                    self.goto.append(dict())
+                    self.fail.append(0)
+                    self.out.append(0)
+                    self.goto[state][symbol] = nextState
+                state = nextState
+            self.out[state] |= bits
+
+        # breadth-first pass for failure links, merging outputs along them
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, nextState in self.goto[state].items():
+                queue.append(nextState)
+                f = self.fail[state]
+                while f and symbol not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nextState] = self.goto[f].get(symbol, 0)
+                self.out[nextState] |= self.out[self.fail[nextState]]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def search(self, data):
+        """Return the union of the bitsets of all literals found in data."""
+
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+
+        state = 0
+        bits = out[0]  # empty literals match anything
+        for symbol in data:
+            while state and symbol not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(symbol, 0)
+            bits |= out[state]
+        return bits
@@ -3,6 +3,8 @@ from enum import Enum
 from scapy.all import *
 from scapy.layers.inet import ICMP, IP, TCP, UDP, Ether
 
+from src.sids.payload_utils import payloadBytes
+
 HTTPcommands = [
     "GET",
     "HEAD",
@@ -16,17 +18,64 @@ HTTPcommands = [
 ]
 
 
+# HTTP commands as they appear on the wire
+HTTPcommandsBytes = frozenset(command.encode() for command in HTTPcommands)
+
+
+# first bytes of every HTTP request or response, to reject other payloads with one lookup
+HTTPprefixes = frozenset(command[:3] for command in HTTPcommandsBytes) | {b"HTT"}
+
+
+class HTTPRequest:
+    """The first token (method, or HTTP/x.y for a response), URI and Host of an HTTP payload."""
+
+    __slots__ = ("method", "uri", "host")
+
+    def __init__(self, method, uri, host):
+        self.method = method
+        self.uri = uri
+        self.host = host
+
+
+def decodeHTTP(data):
+    """Return the HTTPRequest of payload bytes starting like an HTTP request or response, None otherwise."""
+
+    if data[:3] not in HTTPprefixes:
+        return None
+
+    # the first token is what rules compare, even if the line does not end there
+    space = data.find(b" ")
+    method = (data if space < 0 else data[:space]).rstrip()
+    if method not in HTTPcommandsBytes:
+        slash = data.find(b"/")
+        if (data if slash < 0 else data[:slash]).rstrip() != b"HTTP":
+            return None
+
+    lineEnd = data.find(b"\r\n")
+    if lineEnd < 0:
+        lineEnd = len(data)
+    uri = None
+    if 0 <= space < lineEnd:
+        uri = data[space + 1 : lineEnd].split(b" ", 1)[0]
+
+    host = None
+    headers = data[lineEnd + 2 :].partition(b"\r\n\r\n")[0]
+    for header in headers.split(b"\r\n"):
+        name, _, value = header.partition(b":")
+        if name.strip().lower() == b"host":
+            host = value.strip()
+            break
+
+    return HTTPRequest(method, uri, host)
+
+
+def isHTTPPayload(data):
+    """Return True if and only if the payload bytes start like an HTTP request or response."""
+    return bool(data) and decodeHTTP(data) is not None
+
+
 def isHTTP(pkt):
-    if TCP in pkt and pkt[TCP].payload:
-        data = str(pkt[TCP].payload)
-        words = data.split("/")
-        if len(words) >= 1 and words[0].rstrip() == "HTTP":
-            return True
-
-        words = data.split(" ")
-        if len(words) >= 1 and words[0].rstrip() in HTTPcommands:
-            return True
-        else:
-            return False
+    if TCP in pkt:
+        return isHTTPPayload(payloadBytes(pkt))
     else:
         return False
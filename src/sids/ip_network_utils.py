@@ -1,8 +1,21 @@
+import socket
 from ipaddress import ip_network
 
 from numpy import unicode_
 
 
+def ipToInt(ip):
+    """Return the 32-bit integer value of a dotted IPv4 address string."""
+
+    return int.from_bytes(socket.inet_aton(ip), "big")
+
+
+def intToIp(ip):
+    """Return the dotted string of a 32-bit integer IPv4 address."""
+
+    return socket.inet_ntoa(ip.to_bytes(4, "big"))
+
+
 class IPNetwork:
     """An IP network with CIDR block. Represents a set of IPs."""
 
@@ -24,11 +37,45 @@ class IPNetwork:
         except:
             raise ValueError("Incorrect input string.")
 
+        # integer form of the network, used for fast membership tests
+        self.network = int(self.ipn.network_address)
+        self.prefixLength = self.ipn.prefixlen
+        self.mask = int(self.ipn.netmask)
+
+    @classmethod
+    def fromInt(cls, network, prefixLength):
+        """Construct a IPNetwork from its integer network and prefix length, without parsing."""
+
+        ipn = cls.__new__(cls)
+        ipn.network = network
+        ipn.prefixLength = prefixLength
+        ipn.mask = (0xFFFFFFFF << (32 - prefixLength)) & 0xFFFFFFFF
+        # ipn is built on first use
+        return ipn
+
+    def __getstate__(self):
+        # the integer form is enough, ipn is rebuilt on first use
+        state = self.__dict__.copy()
+        state.pop("ipn", None)  # not rebuilt yet if unpickled then pickled again
+        return state
+
+    def __getattr__(self, name):
+        # only called for missing attributes, i.e. ipn after unpickling or fromInt
+        if name == "ipn" and "network" in self.__dict__:
+            self.ipn = ip_network((self.network, self.prefixLength))
+            return self.ipn
+        raise AttributeError(name)
+
     def contains(self, ip):
         """Check if input ip is in the IPNetwork, return True iff yes."""
 
         return ip in self.ipn
 
+    def containsInt(self, ip):
+        """Check if the integer ip is in the IPNetwork, return True iff yes."""
+
+        return (ip & self.mask) == self.network
+
     def __repr__(self):
         """String representation of the IPNetwork"""
 
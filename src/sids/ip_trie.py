@@ -0,0 +1,59 @@
+class IPTrie:
+    """
+    A binary radix trie of IPv4 prefixes, keyed on 32-bit integer addresses.
+
+    Each prefix holds an integer bitset of rule positions. Looking up an
+    address walks the trie once and returns the union of the bitsets of every
+    prefix containing it.
+    """
+
+    def __init__(self):
+        # a node is [child for bit 0, child for bit 1, bitset]
+        self.root = [None, None, 0]
+        self.depth = 0  # longest prefix inserted
+
+    def insert(self, network, prefixLength, bits):
+        """Add bits to the prefix network/prefixLength, network being an integer."""
+
+        node = self.root
+        for shift in range(31, 31 - prefixLength, -1):
+            branch = (network >> shift) & 1
+            child = node[branch]
+            if child is None:
+                child = [None, None, 0]
+                node[branch] = child
+            node = child
+        node[2] |= bits
+        if prefixLength > self.depth:
+            self.depth = prefixLength
+
+    def inserted(self, network, prefixLength, bits):
+        """
+        Return a new trie with bits added to the prefix, leaving this one untouched.
+
+        Only the nodes along the prefix path are copied, the rest is shared.
+        """
+
+        trie = IPTrie()
+        trie.depth = max(self.depth, prefixLength)
+        node = trie.root = list(self.root)
+        for shift in range(31, 31 - prefixLength, -1):
+            branch = (network >> shift) & 1
+            child = node[branch]
+            child = [None, None, 0] if child is None else list(child)
+            node[branch] = child
+            node = child
+        node[2] |= bits
+        return trie
+
+    def lookup(self, address):
+        """Return the union of the bitsets of all prefixes containing the integer address."""
+
+        node = self.root
+        bits = node[2]
+        for shift in range(31, 31 - self.depth, -1):
+            node = node[(address >> shift) & 1]
+            if node is None:
+                break
+            bits |= node[2]
+        return bits
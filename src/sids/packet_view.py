@@ -0,0 +1,224 @@
+import struct
+
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.layers.l2 import Ether
+
+from src.sids.http_detection_utils import decodeHTTP
+from src.sids.ip_network_utils import ipToInt
+from src.sids.packet_string_builder import ACK, CWR, ECE, FIN, PSH, RST, SYN, URG
+from src.sids.payload_utils import payloadBytes
+from src.sids.protocol_enum import Protocol
+
+NS = 0x100
+
+# TCP flag letters, as printed by scapy's %TCP.flags%
+TCPflagBits = {
+    "F": FIN,
+    "S": SYN,
+    "R": RST,
+    "P": PSH,
+    "A": ACK,
+    "U": URG,
+    "E": ECE,
+    "C": CWR,
+    "N": NS,
+}
+
+
+# raw frame layouts, for frames parsed without scapy
+ETHER_TYPE = struct.Struct("!H")
+IPV4 = struct.Struct(
+    "!BBHHHBBHII"
+)  # version/ihl, tos, length, id, flags/frag, ttl, proto, checksum, src, dst
+PORTS = struct.Struct("!HH")
+UDP_LENGTH = struct.Struct("!H")
+TCP_HEADER = struct.Struct("!IIBB")  # seq, ack, data offset/NS, flags
+ETH_P_IP = 0x0800
+ETH_P_8021Q = 0x8100
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+
+def flagsMask(flags):
+    """Return the bitmask of a string of TCP flag letters, or None if a letter is unknown."""
+
+    mask = 0
+    for c in flags:
+        if c not in TCPflagBits:
+            return None
+        mask |= TCPflagBits[c]
+    return mask
+
+
+def udpEndpoints(frame):
+    """
+    Return the (source, source port, destination, destination port) of a raw Ethernet frame
+    holding an IPv4 UDP packet, None otherwise, reading only these headers.
+
+    The frames PacketView.fromFrame decodes as UDP are exactly those with endpoints.
+    """
+
+    start = 14
+    if len(frame) < start:
+        return None
+    etherType = ETHER_TYPE.unpack_from(frame, 12)[0]
+    if etherType == ETH_P_8021Q and len(frame) >= 18:
+        etherType = ETHER_TYPE.unpack_from(frame, 16)[0]
+        start = 18
+    if etherType != ETH_P_IP or len(frame) < start + IPV4.size:
+        return None
+
+    versionIhl, _, length, _, flagsFrag, _, proto, _, src, dst = IPV4.unpack_from(
+        frame, start
+    )
+    l4 = start + (versionIhl & 0xF) * 4
+    if proto != IPPROTO_UDP or flagsFrag & 0x1FFF:
+        return None
+    if l4 + 8 > min(start + length, len(frame)):
+        return None
+    sport, dport = PORTS.unpack_from(frame, l4)
+    return src, sport, dst, dport
+
+
+class PacketView:
+    """
+    The header fields and payload of a packet, decoded once and shared by every rule check.
+
+    Addresses are 32-bit integers and TCP flags a bitmask. Fields of a missing
+    layer are None. TCP payloads that look like HTTP are parsed once into http.
+
+    A view built from a raw Ethernet frame only dissects it with scapy when
+    pkt is first used, e.g. to log a match.
+    """
+
+    __slots__ = (
+        "scapyPkt",
+        "frame",
+        "timestamp",
+        "protocol",
+        "src",
+        "dst",
+        "sport",
+        "dport",
+        "tos",
+        "ttl",
+        "length",
+        "ihl",
+        "frag",
+        "seq",
+        "ack",
+        "flags",
+        "payload",
+        "http",
+    )
+
+    def __init__(self, pkt):
+        """Decode a scapy packet."""
+
+        self.scapyPkt = pkt
+        self.frame = None
+        self.timestamp = None
+        self.protocol = None
+        self.src = self.dst = None
+        self.sport = self.dport = None
+        self.tos = self.ttl = self.length = self.ihl = self.frag = None
+        self.seq = self.ack = self.flags = None
+        self.payload = b""
+        self.http = None
+
+        if IP in pkt:
+            ip = pkt[IP]
+            self.src = ipToInt(ip.src)
+            self.dst = ipToInt(ip.dst)
+            self.tos = ip.tos
+            self.ttl = ip.ttl
+            self.length = ip.len if ip.len is not None else len(ip)
+            self.ihl = ip.ihl
+            self.frag = ip.frag
+
+        if UDP in pkt:
+            udp = pkt[UDP]
+            self.protocol = Protocol.UDP
+            self.sport = udp.sport
+            self.dport = udp.dport
+        elif TCP in pkt:
+            tcp = pkt[TCP]
+            self.protocol = Protocol.TCP
+            self.sport = tcp.sport
+            self.dport = tcp.dport
+            self.seq = tcp.seq
+            self.ack = tcp.ack
+            self.flags = int(tcp.flags)
+
+        if self.protocol is not None:
+            self.payload = payloadBytes(pkt)
+            if self.protocol == Protocol.TCP and self.payload:
+                self.http = decodeHTTP(self.payload)
+
+    @classmethod
+    def fromFrame(cls, frame, timestamp=None):
+        """Decode the IPv4, TCP and UDP headers of a raw Ethernet frame, without scapy."""
+
+        view = cls.__new__(cls)
+        view.scapyPkt = None
+        view.frame = frame
+        view.timestamp = timestamp
+        view.protocol = None
+        view.src = view.dst = None
+        view.sport = view.dport = None
+        view.tos = view.ttl = view.length = view.ihl = view.frag = None
+        view.seq = view.ack = view.flags = None
+        view.payload = b""
+        view.http = None
+
+        start = 14
+        if len(frame) < start:
+            return view
+        etherType = ETHER_TYPE.unpack_from(frame, 12)[0]
+        if etherType == ETH_P_8021Q and len(frame) >= 18:
+            etherType = ETHER_TYPE.unpack_from(frame, 16)[0]
+            start = 18
+        if etherType != ETH_P_IP or len(frame) < start + IPV4.size:
+            return view
+
+        versionIhl, tos, length, _, flagsFrag, ttl, proto, _, src, dst = (
+            IPV4.unpack_from(frame, start)
+        )
+        view.src = src
+        view.dst = dst
+        view.tos = tos
+        view.ttl = ttl
+        view.length = length
+        view.ihl = versionIhl & 0xF
+        view.frag = flagsFrag & 0x1FFF
+        end = min(start + length, len(frame))
+        l4 = start + view.ihl * 4
+
+        # like scapy, the transport layer of a non-first fragment is not decoded
+        if view.frag or l4 + 8 > end:
+            return view
+        if proto == IPPROTO_UDP:
+            view.protocol = Protocol.UDP
+            view.sport, view.dport = PORTS.unpack_from(frame, l4)
+            udpLength = UDP_LENGTH.unpack_from(frame, l4 + 4)[0]
+            if udpLength >= 8:
+                end = min(end, l4 + udpLength)
+            view.payload = bytes(frame[l4 + 8 : end])
+        elif proto == IPPROTO_TCP and l4 + 20 <= end:
+            view.protocol = Protocol.TCP
+            view.sport, view.dport = PORTS.unpack_from(frame, l4)
+            view.seq, view.ack, offset, flags = TCP_HEADER.unpack_from(frame, l4 + 4)
+            view.flags = (offset & 1) << 8 | flags
+            view.payload = bytes(frame[l4 + (offset >> 4) * 4 : end])
+            if view.payload:
+                view.http = decodeHTTP(view.payload)
+        return view
+
+    @property
+    def pkt(self):
+        """The scapy packet, dissected from the raw frame on first use."""
+        if self.scapyPkt is None:
+            self.scapyPkt = Ether(bytes(self.frame))
+            if self.timestamp is not None:
+                self.scapyPkt.time = self.timestamp
+        return self.scapyPkt
@@ -0,0 +1,26 @@
+from scapy.layers.inet import TCP, UDP
+from scapy.packet import Padding, Raw
+
+
+def payloadBytes(pkt):
+    """
+    Return the transport payload of the packet as bytes, or b"" if there is none.
+
+    A Raw payload is returned as is, without rebuilding the layer. The padding
+    of a short Ethernet frame is not part of the payload.
+    """
+    if TCP in pkt:
+        payload = pkt[TCP].payload
+    elif UDP in pkt:
+        payload = pkt[UDP].payload
+    else:
+        return b""
+    if isinstance(payload, Padding):
+        return b""
+    if isinstance(payload, Raw):
+        return payload.load
+    data = bytes(payload)
+    padding = payload.getlayer(Padding)
+    if padding is not None:
+        data = data[: len(data) - len(padding.load)]
+    return data
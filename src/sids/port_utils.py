@@ -1,3 +1,6 @@
+from bisect import bisect_right
+
+
 class Ports:
     """A TCP/UPD port set : a list, a range, or 'any'."""
 
@@ -41,18 +44,72 @@ class Ports:
         except:
             raise ValueError("Incorrect input string.")
 
-    def contains(self, port):
+        self.compile()
+
+    def compile(self):
+        """
+        Compile the port set into sorted, disjoint intervals (lows[i], highs[i]).
+
+        'any' is the single interval 0:65535, so contains() is the same bisection for every type.
+        """
+
         if (self.type == "any"):
-            return True
+            intervals = [(0, 65535)]
         elif (self.type == "range"):
-            if (self.lowPort == -1):
-                return port <= self.highPort
-            elif (self.highPort == -1):
-                return port >= self.lowPort
+            low = 0 if self.lowPort == -1 else self.lowPort
+            high = 65535 if self.highPort == -1 else self.highPort
+            intervals = [(low, high)] if low <= high else []
+        else:
+            intervals = [(port, port) for port in sorted(set(self.listPorts))]
+
+        # merge adjacent intervals
+        merged = []
+        for low, high in intervals:
+            if merged and low <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
             else:
-                return self.lowPort <= port and port <= self.highPort
+                merged.append((low, high))
+
+        self.intervals = merged
+        self.lows = [low for low, high in merged]
+        self.highs = [high for low, high in merged]
+
+    def compactState(self):
+        """Return the port set as a tuple of strings and integers, cheap to pickle (see Rule.compactState)."""
+        if (self.type == "range"):
+            ports = (self.lowPort, self.highPort)
         elif (self.type == "list"):
-            return port in self.listPorts
+            ports = tuple(self.listPorts)
+        else:
+            ports = ()
+        return (self.type, ports, tuple(self.lows), tuple(self.highs))
+
+    @classmethod
+    def fromCompactState(cls, state, shared=None):
+        """
+        Build a Ports from its compactState, without parsing nor compiling it again.
+
+        shared, a dict, lets the port sets built with it share equal Ports instead of building them again.
+        """
+        if shared is not None:
+            ports = shared.get(state)
+            if ports is None:
+                ports = shared[state] = cls.fromCompactState(state)
+            return ports
+        ports = cls.__new__(cls)
+        ports.type, values, lows, highs = state
+        if (ports.type == "range"):
+            ports.lowPort, ports.highPort = values
+        elif (ports.type == "list"):
+            ports.listPorts = list(values)
+        ports.intervals = list(zip(lows, highs))
+        ports.lows = list(lows)
+        ports.highs = list(highs)
+        return ports
+
+    def contains(self, port):
+        i = bisect_right(self.lows, port) - 1
+        return i >= 0 and port <= self.highs[i]
 
     def __repr__(self):
         """
@@ -71,3 +128,74 @@ class Ports:
                     return str(self.lowPort) + ":" + str(self.highPort)
         elif (self.type == "list"):
             return self.listPorts.__repr__()
+
+
+class PortTable:
+    """
+    A port -> bitset table over many Ports, e.g. the destination ports of every rule of a ruleset.
+
+    Single ports are kept in a dict, 'any' in a common bitset, and ranges are cut into
+    disjoint segments, each holding the bitset of the ranges covering it.
+    A lookup is one dict access and one bisection.
+    """
+
+    def __init__(self):
+        self.anyBits = 0
+        self.portBits = dict()
+        self.ranges = list()  # (low, high, bits) for port ranges
+        self.segmentStarts = [0]
+        self.segmentBits = [0]
+        self.compiled = True
+
+    def copy(self):
+        """Return an independent copy of the table."""
+
+        table = PortTable()
+        table.anyBits = self.anyBits
+        table.portBits = dict(self.portBits)
+        table.ranges = list(self.ranges)
+        table.segmentStarts = self.segmentStarts
+        table.segmentBits = self.segmentBits
+        table.compiled = self.compiled
+        return table
+
+    def add(self, ports, bits):
+        """Add bits to every port of the Ports."""
+
+        if (ports.type == "any"):
+            self.anyBits |= bits
+        elif (ports.type == "range"):
+            for low, high in ports.intervals:
+                self.ranges.append((low, high, bits))
+            self.compiled = False
+        else:
+            for port in ports.listPorts:
+                self.portBits[port] = self.portBits.get(port, 0) | bits
+
+    def compile(self):
+        """Cut the ranges into disjoint segments."""
+
+        boundaries = {0}
+        for low, high, bits in self.ranges:
+            boundaries.add(low)
+            boundaries.add(high + 1)
+        starts = sorted(boundaries)
+
+        segmentBits = [0] * len(starts)
+        for low, high, bits in self.ranges:
+            i = bisect_right(starts, low) - 1
+            while (i < len(starts) and starts[i] <= high):
+                segmentBits[i] |= bits
+                i += 1
+
+        self.segmentStarts = starts
+        self.segmentBits = segmentBits
+        self.compiled = True
+
+    def lookup(self, port):
+        """Return the bitset of every Ports containing port."""
+
+        if not self.compiled:
+            self.compile()
+        i = bisect_right(self.segmentStarts, port) - 1
+        return self.anyBits | self.portBits.get(port, 0) | self.segmentBits[i]
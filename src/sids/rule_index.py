@@ -0,0 +1,213 @@
+"""Compiled index over a ruleset, used to select candidate rules for a packet."""
+
+import copy
+import itertools
+
+from src.sids.batch_matcher import BatchMatcher, isHeaderOnly
+from src.sids.content_matcher import ContentMatcher
+from src.sids.ip_trie import IPTrie
+from src.sids.port_utils import PortTable
+from src.sids.protocol_enum import Protocol
+from src.sids.rule_optimizer import semanticKey
+
+# versions of the compiled rulesets, e.g. to tell cached verdicts apart
+generations = itertools.count()
+
+# content literals from which the automaton scan beats testing each literal with `in`
+# (on a 1.3 KB payload : 1 literal 0.6 us vs 50 us, 40 literals 29 us vs 67 us, 120 literals 78 us vs 66 us)
+CONTENT_AUTOMATON_MIN_LITERALS = 100
+
+
+def iterBits(bits):
+    """Yield the positions of the set bits of an integer bitset, lowest first."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class RuleIndex:
+    """
+    Groups the rules of a ruleset by protocol, destination port, networks and content.
+
+    Every rule gets a position (its order in the ruleset) and each group is
+    stored as an integer bitset of positions, so merging groups is a single OR
+    and candidates always come out in ruleset order.
+    """
+
+    def __init__(self, ruleList, sourceKeys=()):
+        """
+        Build the index from a list of rules, as returned by rule_file_reader.read.
+
+        sourceKeys are the semantic keys of rules this ruleset was derived from,
+        e.g. before optimization merged them, which hasRule also recognizes.
+        """
+
+        self.generation = next(generations)
+        self.rules = list(ruleList)
+
+        self.protocolBits = {protocol: 0 for protocol in Protocol}
+        self.dstPortTable = PortTable()
+        self.srcTrie = IPTrie()
+        self.dstTrie = IPTrie()
+        self.contentBits = 0  # rules with a content option
+        self.headerOnlyBits = 0  # rules decided by protocol, IPs and ports alone
+        self.httpRequestBits = 0  # rules with an http_request option
+        self.httpMethodBits = dict()  # http_request method -> bitset
+        self.keys = set(sourceKeys)
+        self.keys.update(semanticKey(rule) for rule in self.rules)
+        contents = dict()  # content literal -> bitset
+
+        for position, rule in enumerate(self.rules):
+            bit = 1 << position
+            self.indexRule(rule, bit)
+            self.srcTrie.insert(rule.srcIps.network, rule.srcIps.prefixLength, bit)
+            self.dstTrie.insert(rule.dstIps.network, rule.dstIps.prefixLength, bit)
+            if hasattr(rule, "content"):
+                contents[rule.contentBytes] = contents.get(rule.contentBytes, 0) | bit
+
+        self.contentMatcher = ContentMatcher(contents.items())
+        self.batchMatcher = None
+        self.resetCaches()
+
+    def indexRule(self, rule, bit):
+        """Add the rule to the bitsets and the port table."""
+        self.protocolBits[rule.protocol] |= bit
+        self.dstPortTable.add(rule.dstPorts, bit)
+        if isHeaderOnly(rule):
+            self.headerOnlyBits |= bit
+        if hasattr(rule, "content"):
+            self.contentBits |= bit
+        if hasattr(rule, "http_request"):
+            self.httpRequestBits |= bit
+            method = rule.httpRequestBytes
+            self.httpMethodBits[method] = self.httpMethodBits.get(method, 0) | bit
+
+    def resetCaches(self):
+        """Derive the per-packet lookup tables from the bitsets."""
+
+        # HTTP rules are checked against TCP packets
+        self.packetProtocolBits = {
+            Protocol.UDP: self.protocolBits[Protocol.UDP],
+            Protocol.TCP: self.protocolBits[Protocol.TCP]
+            | self.protocolBits[Protocol.HTTP],
+        }
+
+        # (protocol, dport) -> bitset of candidate rules, filled lazily
+        self.headerBitsCache = dict()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # an unpickled index is a new version for this process
+        self.generation = next(generations)
+
+    def withRule(self, rule):
+        """
+        Return a new index with the rule appended, leaving this one untouched.
+
+        Only the structures the rule touches are copied, so the current index can
+        keep serving packets until the new one is published.
+        """
+
+        position = len(self.rules)
+        bit = 1 << position
+
+        index = copy.copy(self)
+        index.generation = next(generations)
+        index.rules = self.rules + [rule]
+        index.keys = self.keys | {semanticKey(rule)}
+        index.protocolBits = dict(self.protocolBits)
+        index.dstPortTable = self.dstPortTable.copy()
+        index.httpMethodBits = dict(self.httpMethodBits)
+        index.indexRule(rule, bit)
+        index.srcTrie = self.srcTrie.inserted(
+            rule.srcIps.network, rule.srcIps.prefixLength, bit
+        )
+        index.dstTrie = self.dstTrie.inserted(
+            rule.dstIps.network, rule.dstIps.prefixLength, bit
+        )
+        if hasattr(rule, "content"):
+            index.contentMatcher = ContentMatcher(
+                self.contentMatcher.patterns + [(rule.contentBytes, bit)]
+            )
+        if self.batchMatcher is not None:
+            index.batchMatcher = self.batchMatcher.withRule(rule, position)
+        index.resetCaches()
+        return index
+
+    def hasRule(self, rule):
+        """Returns True if the index already holds a rule equivalent to this one, or was built from one."""
+        return semanticKey(rule) in self.keys
+
+    def getBatchMatcher(self):
+        """Return the vectorized matcher of the header-only rules, built on first use."""
+        if self.batchMatcher is None:
+            self.batchMatcher = BatchMatcher(self.rules)
+        return self.batchMatcher
+
+    def __len__(self):
+        return len(self.rules)
+
+    def headerBits(self, protocol, dport):
+        """Return the bitset of rules concerning given protocol and destination port."""
+        key = (protocol, dport)
+        bits = self.headerBitsCache.get(key)
+        if bits is None:
+            bits = self.packetProtocolBits[protocol] & self.dstPortTable.lookup(dport)
+            self.headerBitsCache[key] = bits
+        return bits
+
+    def ipBits(self, src, dst):
+        """Return the bitset of rules whose source and destination networks contain the integer addresses."""
+        return self.srcTrie.lookup(src) & self.dstTrie.lookup(dst)
+
+    def contentFilter(self, view):
+        """
+        Return the bitset of rules not excluded by their content option.
+
+        Large sets of literals are found with a single automaton scan of the
+        payload, small ones by looking each literal up in it.
+        """
+        payload = view.payload
+        if not payload:
+            found = 0
+        elif len(self.contentMatcher) >= CONTENT_AUTOMATON_MIN_LITERALS:
+            found = self.contentMatcher.search(payload)
+        else:
+            found = 0
+            for literal, bits in self.contentMatcher.patterns:
+                if literal in payload:
+                    found |= bits
+        return ~self.contentBits | found
+
+    def flowBits(self, view):
+        """Return the bitset of rules whose protocol, networks and destination port concern the decoded packet."""
+        if view.src is None or view.protocol is None:
+            return 0
+        bits = self.headerBits(view.protocol, view.dport)
+        if bits:
+            bits &= self.ipBits(view.src, view.dst)
+        return bits
+
+    def httpFilter(self, view):
+        """Return the bitset of rules not excluded by the packet's HTTP request line, with one dict lookup."""
+        if view.http is None:
+            return ~(self.protocolBits[Protocol.HTTP] | self.httpRequestBits)
+        return ~self.httpRequestBits | self.httpMethodBits.get(view.http.method, 0)
+
+    def isFlowInvariant(self, bits):
+        """Returns True if the rules of the bitset give the same verdict to every packet of a 5-tuple."""
+        return not bits & ~self.headerOnlyBits
+
+    def candidateBits(self, view):
+        """Return the bitset of rules that may match the decoded packet."""
+        bits = self.flowBits(view)
+        if bits & self.contentBits:
+            bits &= self.contentFilter(view)
+        if bits & (self.httpRequestBits | self.protocolBits[Protocol.HTTP]):
+            bits &= self.httpFilter(view)
+        return bits
+
+    def candidates(self, view):
+        """Return the rules that may match the decoded packet, in ruleset order."""
+        return [self.rules[position] for position in iterBits(self.candidateBits(view))]
@@ -0,0 +1,215 @@
+"""Ruleset optimization : duplicate removal and merging of rules into port ranges and CIDR blocks."""
+
+import logging
+import os
+from ipaddress import collapse_addresses
+
+from src.sids.Rule import Rule
+from src.sids.rule_stats import overlaps
+
+# rule attributes compared besides the header
+OPTIONS = (
+    "msg",
+    "tos",
+    "len",
+    "offset",
+    "seq",
+    "ack",
+    "flags",
+    "http_request",
+    "content",
+)
+
+# header fields rules may be merged on, in the order they are tried
+MERGE_FIELDS = ("dstPorts", "srcPorts", "dstIps", "srcIps")
+
+
+def fieldKey(rule, field):
+    """Return the comparable value of a header field."""
+    value = getattr(rule, field)
+    if field.endswith("Ips"):
+        return (value.network, value.prefixLength)
+    return tuple(value.intervals)
+
+
+def semanticKey(rule, exclude=None):
+    """Return a key equal for rules matching exactly the same packets with the same message, optionally ignoring one header field."""
+    header = tuple(fieldKey(rule, field) for field in MERGE_FIELDS if field != exclude)
+    options = tuple(getattr(rule, option, None) for option in OPTIONS)
+    return (rule.action, rule.protocol) + header + options
+
+
+def networkString(network):
+    """String of a network as written in rules : 'any', 'a.b.c.d' or 'a.b.c.d/e'."""
+    if network.prefixlen == 0:
+        return "any"
+    if network.prefixlen == 32:
+        return str(network.network_address)
+    return str(network)
+
+
+def portsString(intervals):
+    """String of sorted port intervals as written in rules, or None if it cannot be written as one Ports."""
+    if intervals == [(0, 65535)]:
+        return "any"
+    if len(intervals) == 1:
+        low, high = intervals[0]
+        return str(low) if low == high else str(low) + ":" + str(high)
+    if all(low == high for low, high in intervals):
+        return ",".join(str(low) for low, high in intervals)
+    return None
+
+
+def mergeIntervals(intervals):
+    """Sort and merge overlapping or adjacent intervals."""
+    merged = []
+    for low, high in sorted(intervals):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def withHeader(rule, **fields):
+    """Return a new Rule equal to rule but for the given header field strings."""
+
+    tokens = rule.string.strip().split(" ")
+    header = {
+        "srcIps": tokens[2],
+        "srcPorts": tokens[3],
+        "dstIps": tokens[5],
+        "dstPorts": tokens[6],
+    }
+    header.update(fields)
+
+    string = " ".join(
+        [
+            tokens[0],
+            tokens[1],
+            header["srcIps"],
+            header["srcPorts"],
+            "->",
+            header["dstIps"],
+            header["dstPorts"],
+        ]
+    )
+    options = rule.string.strip().partition("(")
+    if options[1]:
+        string += " (" + options[2]
+    return Rule(string)
+
+
+def mergedRules(rules, field):
+    """Return the rules replacing the given ones, which differ only by field, or None if they cannot be merged."""
+
+    if field.endswith("Ips"):
+        networks = list(collapse_addresses(getattr(rule, field).ipn for rule in rules))
+        if len(networks) >= len(rules):
+            return None
+        merged = [withHeader(rules[0], **{field: networkString(n)}) for n in networks]
+    else:
+        intervals = mergeIntervals(
+            interval for rule in rules for interval in getattr(rule, field).intervals
+        )
+        string = portsString(intervals)
+        if string is None:
+            return None
+        merged = [withHeader(rules[0], **{field: string})]
+
+    # counters of the merged rules carry on
+    for rule in merged:
+        rule.hits = sum(r.hits for r in rules)
+        rule.evaluations = sum(r.evaluations for r in rules)
+    return merged
+
+
+def deduplicate(ruleList):
+    """Return the rules without exact or semantic duplicates, the first occurrence being kept."""
+    seen = set()
+    rules = []
+    for rule in ruleList:
+        key = semanticKey(rule)
+        if key not in seen:
+            seen.add(key)
+            rules.append(rule)
+    return rules
+
+
+def mergeOn(ruleList, field):
+    """
+    Merge groups of rules differing only by field, each group taking the place of its first rule.
+
+    A rule only joins its group if it does not overlap any other rule placed
+    between the group's first rule and itself, so no packet changes verdict.
+    Returns the new list and whether anything was merged.
+    """
+
+    groups = dict()
+    for position, rule in enumerate(ruleList):
+        groups.setdefault(semanticKey(rule, exclude=field), []).append(position)
+
+    replacements = dict()  # first position -> merged rules
+    removed = set()
+    for positions in groups.values():
+        if len(positions) < 2:
+            continue
+        first = positions[0]
+        members = [first]
+        memberSet = {first}
+        for position in positions[1:]:
+            rule = ruleList[position]
+            if not any(
+                overlaps(ruleList[between], rule)
+                for between in range(first + 1, position)
+                if between not in memberSet
+            ):
+                members.append(position)
+                memberSet.add(position)
+        if len(members) < 2:
+            continue
+        merged = mergedRules([ruleList[position] for position in members], field)
+        if merged is None:
+            continue
+        replacements[first] = merged
+        removed.update(members)
+
+    if not replacements:
+        return ruleList, False
+
+    rules = []
+    for position, rule in enumerate(ruleList):
+        if position in replacements:
+            rules.extend(replacements[position])
+        elif position not in removed:
+            rules.append(rule)
+    return rules, True
+
+
+def optimize(ruleList):
+    """Return an equivalent, smaller ruleset : duplicates removed, then rules merged until nothing changes."""
+
+    rules = deduplicate(ruleList)
+    changed = True
+    while changed:
+        changed = False
+        for field in MERGE_FIELDS:
+            rules, merged = mergeOn(rules, field)
+            changed = changed or merged
+        rules = deduplicate(rules)
+
+    if len(rules) < len(ruleList):
+        logging.info(
+            f"[*] Ruleset optimized : {len(ruleList)} rules reduced to {len(rules)}."
+        )
+    return rules
+
+
+def writeRules(ruleList, filename):
+    """Rewrite a rules file with the given rules, one per line."""
+
+    tmpPath = filename + ".tmp"
+    with open(tmpPath, "w") as f:
+        for rule in ruleList:
+            f.write(rule.string.strip() + "\n")
+    os.replace(tmpPath, filename)
@@ -0,0 +1,96 @@
+"""Per-rule hit counters, persisted next to the ruleset, and the rule reordering based on them."""
+
+import json
+import logging
+import os
+
+from src.sids.protocol_enum import Protocol
+
+
+def statsPath(rulesetPath):
+    """Return the path of the counters file of a ruleset."""
+    return rulesetPath + ".stats.json"
+
+
+def portsOverlap(a, b):
+    """Returns True if and only if two Ports share at least one port."""
+    for low, high in a.intervals:
+        for otherLow, otherHigh in b.intervals:
+            if low <= otherHigh and otherLow <= high:
+                return True
+    return False
+
+
+def networksOverlap(a, b):
+    """Returns True if and only if two IPNetworks share at least one address."""
+    return (a.network & b.mask) == b.network or (b.network & a.mask) == a.network
+
+
+def overlaps(a, b):
+    """
+    Returns True if some packet may match both rules, i.e. if their relative order matters.
+
+    Options are not looked at, so rules differing only in options always overlap.
+    """
+    tcp = (Protocol.TCP, Protocol.HTTP)
+    if a.protocol != b.protocol and not (a.protocol in tcp and b.protocol in tcp):
+        return False
+    if not networksOverlap(a.srcIps, b.srcIps):
+        return False
+    if not networksOverlap(a.dstIps, b.dstIps):
+        return False
+    return portsOverlap(a.srcPorts, b.srcPorts) and portsOverlap(a.dstPorts, b.dstPorts)
+
+
+def reorder(ruleList):
+    """
+    Return the rules with the most hit ones first.
+
+    A rule only moves ahead of rules it cannot overlap with, so the first rule
+    matched by any packet stays the same.
+    """
+    ordered = []
+    for rule in ruleList:
+        position = len(ordered)
+        while (
+            position > 0
+            and ordered[position - 1].hits < rule.hits
+            and not overlaps(ordered[position - 1], rule)
+        ):
+            position -= 1
+        ordered.insert(position, rule)
+    return ordered
+
+
+def loadStats(ruleList, rulesetPath):
+    """Restore the counters of the rules from the ruleset's counters file, if any."""
+
+    path = statsPath(rulesetPath)
+    if not os.path.isfile(path):
+        return
+    try:
+        with open(path, "r") as f:
+            stats = json.load(f)
+    except (IOError, ValueError) as e:
+        logging.error(f"Error reading rule counters from {path}: {e}")
+        return
+
+    for rule in ruleList:
+        hits, evaluations = stats.get(rule.string.strip(), (0, 0))
+        rule.hits = hits
+        rule.evaluations = evaluations
+
+
+def saveStats(ruleList, rulesetPath):
+    """Write the counters of the rules to the ruleset's counters file."""
+
+    stats = dict()
+    for rule in ruleList:
+        stats[rule.string.strip()] = (rule.hits, rule.evaluations)
+
+    path = statsPath(rulesetPath)
+    try:
+        with open(path, "w") as f:
+            json.dump(stats, f)
+    except IOError as e:
+        logging.error(f"Error writing rule counters to {path}: {e}")
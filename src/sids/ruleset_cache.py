@@ -0,0 +1,151 @@
+"""Compiled ruleset artifacts, stored next to the rules file, keyed by its content hash and signed."""
+
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import secrets
+
+from src.sids.rule_file_reader import read
+from src.sids.rule_index import RuleIndex
+from src.sids.rule_optimizer import deduplicate, optimize, semanticKey, writeRules
+
+# bump whenever Rule or RuleIndex change shape, so old artifacts are rebuilt
+COMPILED_FORMAT = b"HNIDS-RULESET-5"
+
+# Secret signing the artifacts, readable only by the user running the IDS :
+# an artifact is unpickled only if it was written by this user, so write access
+# to the rules directory is not enough to run code through a forged artifact.
+KEY_PATH = os.path.join(os.path.expanduser("~"), ".hnids", "ruleset.key")
+
+
+def compiledPath(filename):
+    """Return the path of the compiled artifact of a rules file."""
+    return filename + ".compiled"
+
+
+def rulesetHash(data, optimized=False):
+    """Return the key of a rules file content : format tag, optimization flag and SHA-256 digest."""
+    tag = b":optimized:" if optimized else b":"
+    return COMPILED_FORMAT + tag + hashlib.sha256(data).hexdigest().encode()
+
+
+def signingKey():
+    """Return the secret signing the artifacts, created on first use, or None if it cannot be read or created."""
+
+    try:
+        with open(KEY_PATH, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    except IOError as e:
+        logging.warning(f"Compiled rulesets disabled, cannot read {KEY_PATH}: {e}")
+        return None
+
+    secret = secrets.token_bytes(32)
+    try:
+        os.makedirs(os.path.dirname(KEY_PATH), mode=0o700, exist_ok=True)
+        fd = os.open(KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secret)
+    except FileExistsError:
+        # created meanwhile by another process
+        return signingKey()
+    except IOError as e:
+        logging.warning(f"Compiled rulesets disabled, cannot create {KEY_PATH}: {e}")
+        return None
+    return secret
+
+
+def signature(secret, key, payload):
+    """Return the HMAC-SHA256 of an artifact's key and payload."""
+    return hmac.new(secret, key + b"\n" + payload, hashlib.sha256).hexdigest().encode()
+
+
+def loadArtifact(path, key):
+    """
+    Return the (ruleList, errorCount, ruleIndex) stored at path if it was compiled from the same content, None otherwise.
+
+    The payload is only unpickled if its signature matches.
+    """
+
+    secret = signingKey()
+    if secret is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except IOError:
+        return None
+
+    header, _, payload = data.partition(b"\n")
+    artifactKey, _, artifactSignature = header.partition(b" ")
+    if artifactKey != key:
+        return None
+    if not hmac.compare_digest(artifactSignature, signature(secret, key, payload)):
+        logging.warning(f"Compiled ruleset {path} is not signed by this user, ignored.")
+        return None
+    try:
+        return pickle.loads(payload)
+    except Exception as e:
+        logging.error(f"Error loading compiled ruleset {path}: {e}")
+        return None
+
+
+def saveArtifact(path, key, compiled):
+    """Write the compiled ruleset with its signature, replacing any previous artifact atomically."""
+
+    secret = signingKey()
+    if secret is None:
+        return
+    tmpPath = path + ".tmp"
+    try:
+        payload = pickle.dumps(compiled, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(tmpPath, "wb") as f:
+            f.write(key + b" " + signature(secret, key, payload) + b"\n")
+            f.write(payload)
+        os.replace(tmpPath, path)
+    except (IOError, pickle.PicklingError, TypeError, AttributeError) as e:
+        logging.error(f"Error writing compiled ruleset {path}: {e}")
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+
+def readCompiled(filename, optimized=False, rewrite=False):
+    """
+    Return the rules, the number of line errors and the RuleIndex of a rules file.
+
+    The compiled artifact next to the file is used when its hash matches the
+    file content; otherwise the file is parsed and the artifact rewritten.
+    Duplicates are always removed; with optimized, rules are also merged (see
+    rule_optimizer), and with rewrite the rules file itself is replaced by the
+    optimized ruleset.
+    """
+
+    with open(filename, "rb") as f:
+        key = rulesetHash(f.read(), optimized)
+
+    path = compiledPath(filename)
+    compiled = loadArtifact(path, key)
+    if compiled is not None:
+        logging.info(f"[*] Loaded compiled ruleset from {path}.")
+        return compiled
+
+    ruleList, errorCount = read(filename)
+    sourceKeys = ()
+    if optimized:
+        # rules folded into merged ones are still known to be in use
+        sourceKeys = [semanticKey(rule) for rule in ruleList]
+        optimizedList = optimize(ruleList)
+        if rewrite and len(optimizedList) < len(ruleList):
+            writeRules(optimizedList, filename)
+            logging.info(f"[*] Optimized ruleset written to {filename}.")
+            with open(filename, "rb") as f:
+                key = rulesetHash(f.read(), optimized)
+        ruleList = optimizedList
+    else:
+        ruleList = deduplicate(ruleList)
+    compiled = (ruleList, errorCount, RuleIndex(ruleList, sourceKeys))
+    saveArtifact(path, key, compiled)
+    return compiled
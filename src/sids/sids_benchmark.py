@@ -0,0 +1,348 @@
+"""
+Benchmarks of the SIDS engine on synthetic rulesets and traffic.
+
+    python -m src.sids.sids_benchmark [--sizes 10 100 1000 10000 100000] [--packets 5000]
+
+Rulesets are generated with rule_creator.create_rule, packets with scapy, a
+share of them built to match some rule. For each ruleset size the report
+gives packets/sec, per-packet latency percentiles and memory use, for the
+indexed matcher and (up to --linear-max rules) the plain first-match scan.
+Micro-benchmarks of Rule.match, Ports.contains, IPNetwork.contains and
+isHTTP are included. Results are written as JSON, to compare runs across
+commits.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+from ipaddress import ip_address
+
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.packet import Raw
+
+# imported first, as in src.main, so the sids_main <-> rule_creator imports resolve
+from src.aids import aids_main  # isort: skip
+from src.packet_sniffer.packet_sniffer import Sniffer
+from src.packet_sniffer.rule_creator import create_rule
+from src.sids.http_detection_utils import isHTTP
+from src.sids.ip_network_utils import IPNetwork, intToIp
+from src.sids.packet_view import PacketView
+from src.sids.port_utils import Ports
+from src.sids.Rule import Rule
+from src.sids.rule_index import RuleIndex
+
+BENCHMARK_LOG_DIRECTORY = "logs/benchmarks"
+
+# rules only ever concern 10.0.0.0/8, so packets to 172.16.0.0/12 match nothing
+RULE_NETWORK = 10 << 24
+UNMATCHED_NETWORK = (172 << 24) | (16 << 16)
+
+HTTP_PAYLOAD = b"GET /index.html HTTP/1.1\r\nHost: example.com\r\n\r\n"
+OTHER_PAYLOAD = b"\x00\x01payload\x02\x03"
+
+
+def randomAddress(rng, network, prefixLength):
+    return intToIp(network | rng.getrandbits(32 - prefixLength))
+
+
+def syntheticRules(count, seed=0):
+    """Return count rule strings over 10.0.0.0/8, mixing hosts, /24 networks, 'any', single ports and ranges."""
+
+    rng = random.Random(seed)
+    rules = []
+    for _ in range(count):
+        srcIp = rng.choice(
+            [
+                "any",
+                randomAddress(rng, RULE_NETWORK, 8),
+                randomAddress(rng, RULE_NETWORK, 8),
+            ]
+        )
+        dstIp = randomAddress(rng, RULE_NETWORK, 8)
+        if rng.random() < 0.3:
+            dstIp = dstIp.rsplit(".", 1)[0] + ".0/24"
+        dstPort = rng.choice(
+            [str(rng.randint(1, 65535)), str(rng.randint(1, 1024)), "any"]
+        )
+        if rng.random() < 0.2:
+            low = rng.randint(1, 60000)
+            dstPort = f"{low}:{low + rng.randint(1, 100)}"
+        rules.append(
+            create_rule(
+                action="alert",
+                protocol=rng.choice(["udp", "tcp"]),
+                src_ip=srcIp,
+                src_port=rng.choice(["any", str(rng.randint(1024, 65535))]),
+                dst_ip=dstIp,
+                dst_port=dstPort,
+                msg="Benchmark",
+            )
+        )
+    return rules
+
+
+def packetFor(rule, rng):
+    """Return a packet matching the header of the rule."""
+
+    def address(ips):
+        return randomAddress(rng, ips.network, ips.prefixLength)
+
+    def port(ports):
+        low, high = rng.choice(ports.intervals)
+        return rng.randint(max(low, 1), high)
+
+    layer = UDP if rule.protocol.name == "UDP" else TCP
+    return (
+        IP(src=address(rule.srcIps), dst=address(rule.dstIps))
+        / layer(sport=port(rule.srcPorts), dport=port(rule.dstPorts))
+        / Raw(HTTP_PAYLOAD if layer is TCP and rng.random() < 0.5 else OTHER_PAYLOAD)
+    )
+
+
+def syntheticPackets(ruleList, count, matchRatio=0.5, seed=0):
+    """
+    Return count dissected packets, a matchRatio share of them built from a random rule.
+
+    The others go to a network no rule concerns.
+    """
+
+    rng = random.Random(seed)
+    packets = []
+    for _ in range(count):
+        if ruleList and rng.random() < matchRatio:
+            pkt = packetFor(rng.choice(ruleList), rng)
+        else:
+            layer = rng.choice([UDP, TCP])
+            pkt = (
+                IP(
+                    src=randomAddress(rng, UNMATCHED_NETWORK, 12),
+                    dst=randomAddress(rng, UNMATCHED_NETWORK, 12),
+                )
+                / layer(sport=rng.randint(1, 65535), dport=rng.randint(1, 65535))
+                / Raw(OTHER_PAYLOAD)
+            )
+        # dissect from bytes, like a captured packet
+        packets.append(IP(bytes(pkt)))
+    return packets
+
+
+def percentiles(latencies):
+    """Return the latency percentiles in microseconds of a list of nanosecond durations."""
+    ordered = sorted(latencies)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] / 1000
+
+    return {
+        "p50_us": at(0.50),
+        "p90_us": at(0.90),
+        "p99_us": at(0.99),
+        "max_us": ordered[-1] / 1000,
+    }
+
+
+def linearMatch(ruleList):
+    """The first-match scan over every rule, as the sniffer did before the index."""
+
+    def match(pkt):
+        view = PacketView(pkt)
+        for rule in ruleList:
+            if rule.match(view):
+                return rule
+        return None
+
+    return match
+
+
+def indexedMatch(ruleList, ruleIndex):
+    """The sniffer's matcher, without flows so no verdict is cached and every packet is really matched."""
+    sniffer = Sniffer(ruleList, False, ruleIndex=ruleIndex)
+
+    def match(pkt):
+        return sniffer.matchPacket(PacketView(pkt))
+
+    return match
+
+
+def runEngine(match, packets):
+    """Match every packet, returning throughput, latency percentiles and the number of matches."""
+
+    latencies = []
+    matches = 0
+    gc.collect()
+    start = time.perf_counter()
+    for pkt in packets:
+        t0 = time.perf_counter_ns()
+        rule = match(pkt)
+        latencies.append(time.perf_counter_ns() - t0)
+        matches += rule is not None
+    elapsed = time.perf_counter() - start
+    result = {
+        "packets": len(packets),
+        "matches": matches,
+        "seconds": elapsed,
+        "packets_per_second": len(packets) / elapsed if elapsed else 0.0,
+    }
+    result.update(percentiles(latencies))
+    return result
+
+
+def benchmarkSize(size, packetCount, matchRatio, linearMax, seed):
+    """Build a ruleset of the given size and run every engine on the same packets."""
+
+    ruleStrings = syntheticRules(size, seed)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    ruleList = [Rule(string) for string in ruleStrings]
+    parseSeconds = time.perf_counter() - start
+    rulesMemory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    ruleIndex = RuleIndex(ruleList)
+    indexSeconds = time.perf_counter() - start
+    indexMemory = tracemalloc.get_traced_memory()[0] - rulesMemory
+    tracemalloc.stop()
+
+    packets = syntheticPackets(ruleList, packetCount, matchRatio, seed)
+    result = {
+        "rules": size,
+        "parse_seconds": parseSeconds,
+        "index_seconds": indexSeconds,
+        "rules_memory_bytes": rulesMemory,
+        "index_memory_bytes": indexMemory,
+        "engines": {"indexed": runEngine(indexedMatch(ruleList, ruleIndex), packets)},
+    }
+    if size <= linearMax:
+        result["engines"]["linear"] = runEngine(linearMatch(ruleList), packets)
+    result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def nanoseconds(statement, number):
+    """Return the nanoseconds per call of a callable."""
+    return timeit.timeit(statement, number=number) / number * 1e9
+
+
+def microBenchmarks(number=20000, seed=0):
+    """Return the nanoseconds per call of the basic rule checks."""
+
+    rule = Rule(syntheticRules(1, seed)[0])
+    pkt = syntheticPackets([rule], 1, 1.0, seed)[0]
+    view = PacketView(pkt)
+    httpPkt = IP(bytes(IP() / TCP(dport=80) / Raw(HTTP_PAYLOAD)))
+    ports = Ports("1000:2000")
+    network = IPNetwork("10.1.0.0/16")
+    address = ip_address("10.1.2.3")
+    return {
+        "Rule.match(packet)_ns": nanoseconds(lambda: rule.match(pkt), number),
+        "Rule.match(view)_ns": nanoseconds(lambda: rule.match(view), number),
+        "PacketView_ns": nanoseconds(lambda: PacketView(pkt), number),
+        "Ports.contains_ns": nanoseconds(lambda: ports.contains(1500), number),
+        "IPNetwork.contains_ns": nanoseconds(lambda: network.contains(address), number),
+        "IPNetwork.containsInt_ns": nanoseconds(
+            lambda: network.containsInt(view.src), number
+        ),
+        "isHTTP_ns": nanoseconds(lambda: isHTTP(httpPkt), number),
+    }
+
+
+def gitCommit():
+    """Return the current commit hash, or None outside of a git checkout."""
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Signature IDS engine.")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000, 100000],
+        help="ruleset sizes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--packets",
+        type=int,
+        default=5000,
+        help="packets per size (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--match-ratio",
+        type=float,
+        default=0.5,
+        help="share of packets built to match a rule (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--linear-max",
+        type=int,
+        default=10000,
+        help="largest ruleset also run through the plain scan (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        help=f"JSON result file (default: {BENCHMARK_LOG_DIRECTORY}/sids_benchmark_<time>.json)",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    results = {
+        "commit": gitCommit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "packets": args.packets,
+        "match_ratio": args.match_ratio,
+        "seed": args.seed,
+        "micro": microBenchmarks(seed=args.seed),
+        "sizes": [],
+    }
+    for size in args.sizes:
+        logging.info(f"[*] Benchmarking {size} rules...")
+        result = benchmarkSize(
+            size, args.packets, args.match_ratio, args.linear_max, args.seed
+        )
+        for engine, stats in result["engines"].items():
+            logging.info(
+                f"[*] {size} rules, {engine} : {stats['packets_per_second']:.0f} packets/s, "
+                f"p50 {stats['p50_us']:.1f} us, p99 {stats['p99_us']:.1f} us"
+            )
+        results["sizes"].append(result)
+
+    output = args.output
+    if output is None:
+        if not os.path.exists(BENCHMARK_LOG_DIRECTORY):
+            os.makedirs(BENCHMARK_LOG_DIRECTORY)
+        current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = os.path.join(
+            BENCHMARK_LOG_DIRECTORY, f"sids_benchmark_{current_time}.json"
+        )
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"[*] Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@ import concurrent.futures
 import datetime
 import logging
 import os
-import queue
 import signal
 import sys
 import threading
@@ -12,59 +11,90 @@ from scapy.all import datetime
 from src.aids import aids_main
 from src.packet_sniffer.packet_sniffer import Sniffer
 from src.packet_sniffer.packet_sniffer_manager import set_sniffer
-from src.sids.rule_file_reader import read
+from src.sids.ruleset_cache import readCompiled
 
 RED = "\033[91m"
 BLUE = "\033[34m"
 GREEN = "\033[32m"
 ENDC = "\033[0m"
 
-packet_queue = queue.Queue()
-
 DEFAULT_RULESET_PATH = "rules/rule_set.txt"
 
 
 def retrieve_unknown_packets(sniffer):
-    """Retrieve raw unknown packets from the sniffer."""
-    with sniffer.lock:
-        packets = list(sniffer.unknownPackets)
-        sniffer.unknownPackets.clear()
-    return packets
-
-
-# def process_unknown_packets(log_path):
-#     """Process unknown packets as they arrive."""
-#     while True:
-#         packet = packet_queue.get()
-#         if packet is None:
-#             break
-#         else:
-#             logging.info("[*] Unknown packet forwarded to Anomaly subsystem...")
-#             aids_main.main(funnel_packets=True, packets=[packet], log_path=log_path)
-#             packet_queue.task_done()
+    """Retrieve raw unknown packets and the features of their flows from the sniffer, without waiting."""
+    return split_unknown_packets(sniffer.unknownPackets.drain())
+
+
+def split_unknown_packets(batch):
+    """Split a batch of (packet, flow features) from the sniffer's queue into the list of packets and the list of features."""
+    packets = [pkt for pkt, features in batch]
+    features = [features for pkt, features in batch]
+    return packets, features
+
 
 max_sids_workers = 3
 
+# Unknown packets from this address only are handed over to the AIDS
+sids_unknown_source = "192.168.2.12"
+
+# Processes matching UDP packets, each owning the flows hashing to it (0 matches in the sniffer thread)
+sids_match_workers = 0
+
+# Packet capture : "scapy" (sniff) or "raw" (AF_PACKET socket, Linux only, parsed without scapy)
+sids_capture_backend = "scapy"
+
+# Derive a kernel BPF filter from the rules, so packets no rule can match (nor their replies)
+# are not captured; the flow features of the AIDS then only see the flows of the rules
+sids_capture_filter = False
+
+# Packets matched together by the vectorized header-only matcher (0 matches them one by one)
+sids_batch_size = 0
 
-def process_unknown_packets(log_path):
-    """Process unknown packets as they arrive using a thread pool."""
+# Periodically try the most hit rules first (counters are kept in <ruleset>.stats.json)
+sids_adaptive_order = False
+
+# Duplicate rules are always removed when loading. Optionally merge rules into port ranges /
+# CIDR blocks too, and write the optimized ruleset back to the rules file (merging is slow on large rulesets)
+sids_optimize_ruleset = False
+sids_rewrite_optimized_ruleset = False
+
+# Unknown packets waiting for the AIDS, and what to do when that many are waiting :
+# "block" the capture, "drop-oldest", or "sample" one of every few new packets
+sids_unknown_queue_size = 1024
+sids_unknown_queue_policy = "drop-oldest"
+
+# Unknown packets are sent to the AIDS in batches of up to sids_aids_batch_size,
+# waiting at most sids_aids_batch_delay seconds after the first one for the batch to fill
+sids_aids_batch_size = 64
+sids_aids_batch_delay = 0.05
+
+
+def process_unknown_packets(sniffer):
+    """Process unknown packets as they arrive, in batches, using a thread pool."""
+    # packets are taken from the sniffer's queue only when a worker is free,
+    # so a slow AIDS fills that bounded queue instead of the executor's
+    free_workers = threading.BoundedSemaphore(max_sids_workers)
     with concurrent.futures.ThreadPoolExecutor(
         max_workers=max_sids_workers
     ) as executor:
         while True:
-            packet = packet_queue.get()
-            if packet is None:
+            free_workers.acquire()
+            # sleeps until a packet arrives, empty once the sniffer is stopped
+            batch = sniffer.unknownPackets.getBatch(
+                sids_aids_batch_size, linger=sids_aids_batch_delay
+            )
+            if not batch:
                 break
             else:
-                logging.info("[*] Unknown packet forwarded to Anomaly subsystem...")
-                # Submit a task to the thread pool executor
-                executor.submit(
-                    aids_main.main,
-                    funnel_packets=True,
-                    packets=[packet],
-                    log_path=log_path,
+                packets, features = split_unknown_packets(batch)
+                logging.info(
+                    f"[*] {len(packets)} unknown packets forwarded to Anomaly subsystem..."
                 )
-                packet_queue.task_done()
+                # Submit the whole batch as one task to the thread pool executor,
+                # logging was already set up by main()
+                future = executor.submit(aids_main.process_packets, packets, features)
+                future.add_done_callback(lambda _: free_workers.release())
 
 
 def main(handle_unknown_packets, funnel_packets, mode, log_path):
@@ -127,7 +157,11 @@ def main(handle_unknown_packets, funnel_packets, mode, log_path):
     # Read the rule file
     logging.info("[*] Reading rule file...")
     global ruleList
-    ruleList, errorCount = read(filename)
+    ruleList, errorCount, ruleIndex = readCompiled(
+        filename,
+        optimized=sids_optimize_ruleset,
+        rewrite=sids_rewrite_optimized_ruleset,
+    )
     logging.info("[*] Finished reading rule file.")
 
     if errorCount == 0:
@@ -138,34 +172,48 @@ def main(handle_unknown_packets, funnel_packets, mode, log_path):
 
     # Begin sniffing
     logging.info("[*] Commencing packet sniffing...")
-    sniffer = Sniffer(ruleList, handle_unknown_packets)
+    sniffer = Sniffer(
+        ruleList,
+        handle_unknown_packets,
+        batch_size=sids_batch_size,
+        ruleset_path=filename,
+        adaptive_order=sids_adaptive_order,
+        ruleIndex=ruleIndex,
+        match_workers=sids_match_workers,
+        capture_backend=sids_capture_backend,
+        capture_filter=sids_capture_filter,
+        unknown_queue_size=sids_unknown_queue_size,
+        unknown_queue_policy=sids_unknown_queue_policy,
+        unknown_source=sids_unknown_source,
+    )
     set_sniffer(sniffer)
     sniffer.start()
 
     # Retrieve unknown packets - setting funnel infrastructure for AIDS
     if handle_unknown_packets and funnel_packets:
         threading.Thread(
-            target=process_unknown_packets, args=(log_path,), daemon=True
+            target=process_unknown_packets, args=(sniffer,), daemon=True
         ).start()
 
     def signal_handler(sig, frame):
         logging.info("[*] Signature IDS stopping...")
         sniffer.stop()
+        # Stop the packet processing thread first, a sniffer blocked on a full queue could not finish
+        sniffer.unknownPackets.close()
         sniffer.join()
-        packet_queue.put(None)  # Stop the packet processing thread
         sys.exit(0)
 
     signal.signal(signal.SIGINT, signal_handler)
 
     # Keep the main thread running, otherwise signals are ignored.
+    # Unknown packets go straight from the sniffer to process_unknown_packets,
+    # this thread only wakes up every second to stay responsive to signals.
     try:
-        while True:
-            # Dynamically add unknown packets to the queue
-            unknown_packets = retrieve_unknown_packets(sniffer)
-            for packet in unknown_packets:
-                packet_queue.put(packet)
+        while sniffer.is_alive():
+            sniffer.join(timeout=1)
     except KeyboardInterrupt:
         signal_handler(None, None)
+    sniffer.unknownPackets.close()
 
 
 # Global variables and setup
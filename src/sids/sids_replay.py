@@ -0,0 +1,181 @@
+"""
+Offline replay of a pcap/pcapng capture through the SIDS (and optionally the AIDS).
+
+    python -m src.sids.sids_replay capture.pcap [--rules rules/rule_set.txt] [--speed 0] [--hybrid [--rules-out copy.txt]]
+
+Packets are streamed from the file and handed to Sniffer.inPacket exactly as
+a live capture would, so throughput numbers are reproducible without root or
+real traffic. The rules the AIDS creates meanwhile are only inserted into the
+replaying sniffer, the ruleset file is left untouched.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+
+from scapy.utils import PcapReader
+
+# imported first, as in src.main, so the sids_main <-> rule_creator imports resolve
+from src.aids import aids_main  # isort: skip
+from src.packet_sniffer.packet_sniffer import Sniffer
+from src.packet_sniffer.packet_sniffer_manager import set_sniffer
+from src.packet_sniffer.rule_creator import set_rules_output
+from src.sids.ruleset_cache import readCompiled
+from src.sids.sids_main import (
+    DEFAULT_RULESET_PATH,
+    retrieve_unknown_packets,
+    sids_aids_batch_size,
+    sids_batch_size,
+    sids_match_workers,
+    sids_optimize_ruleset,
+    sids_unknown_source,
+)
+
+
+def replay(pcapPath, sniffer, speed=0, aids=None):
+    """
+    Feed every packet of the capture file to the sniffer and return the run statistics.
+
+    speed 0 replays as fast as possible, otherwise the capture's own timing
+    is followed, speed times faster. aids, if given, is called with each batch
+    of unknown packets the sniffer hands over and the features of their flows,
+    like the hybrid pipeline does.
+    """
+
+    timings = {"read": 0.0, "sids": 0.0, "aids": 0.0}
+    packets = 0
+    firstTime = None
+    start = time.perf_counter()
+
+    sniffer.startShards()
+    with PcapReader(pcapPath) as reader:
+        # packets are read one at a time, the file is never loaded whole
+        packetIterator = iter(reader)
+        while True:
+            t0 = time.perf_counter()
+            pkt = next(packetIterator, None)
+            t1 = time.perf_counter()
+            timings["read"] += t1 - t0
+            if pkt is None:
+                break
+            packets += 1
+
+            if speed:
+                # wait until the packet is due, relative to the first one
+                if firstTime is None:
+                    firstTime = float(pkt.time)
+                due = start + (float(pkt.time) - firstTime) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                t1 = time.perf_counter()
+
+            sniffer.inPacket(pkt)
+            t2 = time.perf_counter()
+            timings["sids"] += t2 - t1
+
+            if aids is not None and len(sniffer.unknownPackets) >= sids_aids_batch_size:
+                aids(*retrieve_unknown_packets(sniffer))
+                timings["aids"] += time.perf_counter() - t2
+
+    t0 = time.perf_counter()
+    sniffer.flushBatch()
+    if sniffer.shards is not None:
+        sniffer.shards.close()
+        sniffer.shards = None
+    timings["sids"] += time.perf_counter() - t0
+    if aids is not None and sniffer.unknownPackets:
+        t0 = time.perf_counter()
+        aids(*retrieve_unknown_packets(sniffer))
+        timings["aids"] += time.perf_counter() - t0
+
+    elapsed = time.perf_counter() - start
+    return {
+        "pcap": pcapPath,
+        "packets": packets,
+        "seconds": elapsed,
+        "packets_per_second": packets / elapsed if elapsed else 0.0,
+        "alerts": sniffer.alertCount,
+        "unknown": sniffer.unknownCount,
+        "rules": len(sniffer.ruleList),
+        "stage_seconds": timings,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a pcap/pcapng file through the Signature IDS."
+    )
+    parser.add_argument("pcap", help="capture file to replay")
+    parser.add_argument(
+        "--rules",
+        default=DEFAULT_RULESET_PATH,
+        help="ruleset file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="time multiplier of the capture timing, 0 for as fast as possible (default)",
+    )
+    parser.add_argument(
+        "--hybrid",
+        action="store_true",
+        help="hand unknown packets over to the AIDS, as the hybrid system does",
+    )
+    parser.add_argument(
+        "--rules-out",
+        help="copy the ruleset to this file and append the rules created by the AIDS to it "
+        "(by default they are only kept in memory)",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="only log warnings and the final report"
+    )
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.WARNING if args.quiet else logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+
+    ruleList, errorCount, ruleIndex = readCompiled(
+        args.rules, optimized=sids_optimize_ruleset
+    )
+    if errorCount:
+        logging.warning(f"[*] {errorCount} rules have errors and could not be read.")
+
+    aids = None
+    if args.hybrid:
+        aids = aids_main.process_packets
+    # the replayed traffic must not change the ruleset itself
+    if args.rules_out and os.path.abspath(args.rules_out) != os.path.abspath(
+        args.rules
+    ):
+        shutil.copyfile(args.rules, args.rules_out)
+    set_rules_output(args.rules_out)
+
+    sniffer = Sniffer(
+        ruleList,
+        args.hybrid,
+        batch_size=sids_batch_size,
+        ruleIndex=ruleIndex,
+        match_workers=sids_match_workers,
+        unknown_source=sids_unknown_source,
+    )
+    # rules created by the AIDS are inserted into the running sniffer
+    set_sniffer(sniffer)
+    stats = replay(args.pcap, sniffer, speed=args.speed, aids=aids)
+
+    report = json.dumps(stats, indent=2)
+    print(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
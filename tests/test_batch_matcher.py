@@ -0,0 +1,96 @@
+import random
+
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.layers.l2 import ARP, Ether
+from scapy.packet import Raw
+
+from src.packet_sniffer.flow_table import FlowTable
+from src.packet_sniffer.packet_matcher import Matcher
+from src.sids.batch_matcher import NO_MATCH, BatchMatcher, isHeaderOnly
+from src.sids.packet_view import PacketView
+from src.sids.Rule import Rule
+from src.sids.rule_index import RuleIndex
+
+NETWORKS = ["any", "10.0.0.0/8", "10.1.0.0/16", "10.1.2.3", "192.168.2.12"]
+PORTS = ["any", "53", "80", "1000:2000", "22,80,443", ":1024", "5000:"]
+ADDRESSES = ["10.1.2.3", "10.1.9.9", "10.200.0.1", "192.168.2.12", "8.8.8.8"]
+
+
+def randomRule(i):
+    protocol = random.choice(["tcp", "udp", "tcp", "udp", "http"])
+    options = f'msg:"r{i}"'
+    if random.random() < 0.3:
+        options += "; content:" + random.choice(['"abc"', '"GET"', '"zz"'])
+    if protocol == "tcp" and random.random() < 0.2:
+        options += "; flags:" + random.choice(["S", "A", "PA"])
+    return Rule(
+        f"alert {protocol} {random.choice(NETWORKS)} {random.choice(PORTS)} -> "
+        f"{random.choice(NETWORKS)} {random.choice(PORTS)} ({options})"
+    )
+
+
+def randomView():
+    if random.random() < 0.05:
+        return PacketView(Ether() / ARP())
+    sport = random.choice([53, 80, 443, 1500, 40000])
+    dport = random.choice([22, 53, 80, 443, 1000, 1500, 2000, 5000, 60000])
+    if random.random() < 0.5:
+        l4 = UDP(sport=sport, dport=dport)
+    else:
+        l4 = TCP(sport=sport, dport=dport, flags=random.choice(["S", "A", "PA"]))
+    payload = random.choice([b"", b"abc", b"GET / HTTP/1.1\r\n\r\n", b"xzzx"])
+    ip = IP(src=random.choice(ADDRESSES), dst=random.choice(ADDRESSES))
+    return PacketView(IP(bytes(ip / l4 / Raw(payload))))
+
+
+def firstMatch(rules, view):
+    return next((rule for rule in rules if rule.match(view)), None)
+
+
+def test_columns_find_the_first_header_only_match():
+    random.seed(8)
+    rules = [randomRule(i) for i in range(120)]
+    views = [randomView() for _ in range(300)]
+    headerOnly = [rule if isHeaderOnly(rule) else None for rule in rules]
+
+    # a small chunk size compares the rows over several chunks
+    for chunkSize in (7, 4096):
+        matcher = BatchMatcher(rules, chunkSize)
+        assert len(matcher) == sum(rule is not None for rule in headerOnly)
+        for view, first in zip(views, matcher.matchViews(views).tolist()):
+            expected = next(
+                (
+                    position
+                    for position, rule in enumerate(headerOnly)
+                    if rule is not None and rule.match(view)
+                ),
+                NO_MATCH,
+            )
+            assert first == expected
+
+
+def test_batch_verdicts_are_the_scan_verdicts():
+    random.seed(80)
+    rules = [randomRule(i) for i in range(120)]
+    matcher = Matcher(RuleIndex(rules), FlowTable())
+    views = [randomView() for _ in range(300)]
+    assert matcher.matchBatch(views) == [firstMatch(rules, view) for view in views]
+    assert matcher.matchBatch([]) == []
+
+
+def test_matcher_with_rule_leaves_the_original_untouched():
+    random.seed(81)
+    rules = [randomRule(i) for i in range(40)]
+    rule = Rule('alert tcp any any -> any 22 (msg:"ssh")')
+    matcher = BatchMatcher(rules)
+    extended = matcher.withRule(rule, len(rules))
+    views = [randomView() for _ in range(200)]
+
+    assert len(extended) == len(matcher) + 1
+    before = matcher.matchViews(views).tolist()
+    after = extended.matchViews(views).tolist()
+    for view, old, new in zip(views, before, after):
+        if old == NO_MATCH and rule.match(view):
+            assert new == len(rules)
+        else:
+            assert new == old
@@ -0,0 +1,78 @@
+import time
+
+from src.packet_sniffer import packet_sniffer
+from src.packet_sniffer.packet_sniffer import Sniffer
+from src.sids.bpf_filter import ALL_IP, NO_PACKET, admits, captureFilter, ruleFilter
+from src.sids.Rule import Rule
+
+RULES = [
+    'alert udp any any -> 8.8.8.8 53 (msg:"DNS to google")',
+    'alert tcp 10.0.0.0/8 any -> any 80,443 (msg:"web")',
+]
+UNKNOWN_SOURCE = "192.168.2.12"
+
+
+def test_rule_filter_and_its_replies():
+    rule = Rule(RULES[1])
+    assert (
+        ruleFilter(rule)
+        == "(tcp and src net 10.0.0.0/8 and (dst port 80 or dst port 443))"
+    )
+    assert ruleFilter(rule, reverse=True) == (
+        "(tcp and dst net 10.0.0.0/8 and (src port 80 or src port 443))"
+    )
+    assert captureFilter([]) == NO_PACKET
+
+
+def test_filter_admits_the_rules_it_was_built_from():
+    rules = [Rule(rule) for rule in RULES]
+    expression = captureFilter(rules, UNKNOWN_SOURCE)
+    assert all(admits(expression, rule, UNKNOWN_SOURCE) for rule in rules)
+    assert admits(ALL_IP, Rule("alert tcp any any -> any 22"))
+
+    # a port of another rule, or a term nested in another one, is not enough
+    assert not admits(expression, Rule("alert udp any any -> 8.8.8.8 any"))
+    assert not admits(expression, Rule("alert tcp 10.0.0.0/8 any -> any 80"))
+    # UDP traffic of the unknown source is kept for the AIDS, whatever its ports
+    assert admits(
+        expression, Rule(f"alert udp {UNKNOWN_SOURCE} any -> any 23"), UNKNOWN_SOURCE
+    )
+    assert admits(
+        expression, Rule(f"alert udp any any -> {UNKNOWN_SOURCE} 23"), UNKNOWN_SOURCE
+    )
+    assert not admits(expression, Rule(f"alert udp any any -> {UNKNOWN_SOURCE} 23"))
+    assert not admits(
+        expression, Rule(f"alert tcp {UNKNOWN_SOURCE} any -> any 23"), UNKNOWN_SOURCE
+    )
+
+
+def test_inserted_rules_share_one_filter_update(monkeypatch):
+    monkeypatch.setattr(packet_sniffer, "FILTER_UPDATE_INTERVAL", 0.5)
+    sniffer = Sniffer(
+        [Rule(RULES[0])], True, capture_filter=True, unknown_source=UNKNOWN_SOURCE
+    )
+    restarts = []
+    monkeypatch.setattr(
+        sniffer, "restartCapture", lambda: restarts.append(sniffer.bpfFilter)
+    )
+
+    # covered by the filter already : no restart
+    sniffer.insert_rule(f"alert udp {UNKNOWN_SOURCE} any -> any 23")
+    assert restarts == []
+
+    first = Rule(RULES[1])
+    sniffer.insert_rule(RULES[1])
+    assert len(restarts) == 1 and admits(restarts[0], first)
+
+    # within the interval, the updates are coalesced
+    second = Rule("alert tcp any any -> any 22")
+    third = Rule("alert tcp any any -> any 25")
+    sniffer.insert_rule(second.string)
+    sniffer.insert_rule(third.string)
+    assert len(restarts) == 1
+    deadline = time.monotonic() + 5
+    while len(restarts) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.1)
+    assert len(restarts) == 2
+    assert admits(restarts[1], second) and admits(restarts[1], third)
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.packet import Raw
+
+from src.sids import rule_index
+from src.sids.content_matcher import ContentMatcher
+from src.sids.packet_view import PacketView
+from src.sids.Rule import Rule
+from src.sids.rule_index import RuleIndex, iterBits
+
+LITERALS = [b"he", b"she", b"his", b"hers", b"passwd", b"", b"/etc/shadow", b"ss"]
+
+
+def firstMatch(rules, view):
+    for rule in rules:
+        if rule.match(view):
+            return rule
+    return None
+
+
+def test_automaton_finds_every_literal_like_in():
+    random.seed(4)
+    matcher = ContentMatcher((literal, 1 << i) for i, literal in enumerate(LITERALS))
+    for _ in range(200):
+        data = bytes(random.choice(b"hersip/etcadow") for _ in range(30))
+        expected = 0
+        for i, literal in enumerate(LITERALS):
+            if literal in data:
+                expected |= 1 << i
+        assert matcher.search(data) == expected
+
+
+@pytest.mark.parametrize("minLiterals", [0, 1000])
+def test_content_filter_keeps_the_first_match(monkeypatch, minLiterals):
+    # 0 always scans with the automaton, 1000 looks each literal up
+    monkeypatch.setattr(rule_index, "CONTENT_AUTOMATON_MIN_LITERALS", minLiterals)
+    rules = [
+        Rule(f'alert tcp any any -> any 80 (msg:"c{i}"; content:"{literal.decode()}")')
+        for i, literal in enumerate(LITERALS)
+        if literal
+    ]
+    rules.append(Rule('alert udp any any -> any 53 (msg:"dns"; content:"ss")'))
+    rules.append(Rule('alert tcp any any -> any 80 (msg:"any web")'))
+    index = RuleIndex(rules)
+
+    random.seed(5)
+    for _ in range(300):
+        payload = bytes(random.choice(b"hersip/etcadowx") for _ in range(20))
+        l4 = TCP(dport=80) if random.random() < 0.8 else UDP(dport=53)
+        view = PacketView(
+            IP(bytes(IP(src="10.0.0.1", dst="10.0.0.2") / l4 / Raw(payload)))
+        )
+        candidates = [index.rules[i] for i in iterBits(index.candidateBits(view))]
+        assert firstMatch(candidates, view) is firstMatch(rules, view)
+        assert all(rule in candidates for rule in rules if rule.match(view))
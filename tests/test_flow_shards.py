@@ -0,0 +1,219 @@
+import os
+import time
+
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.layers.l2 import Ether
+from scapy.packet import Raw
+
+from src.packet_sniffer import flow_shards
+from src.packet_sniffer.flow_shards import FlowShards, flowShard, udpFrameShard
+from src.packet_sniffer.flow_table import FlowTable
+from src.packet_sniffer.packet_matcher import Matcher
+from src.packet_sniffer.packet_ring import PacketRing
+from src.packet_sniffer.packet_sniffer import Sniffer
+from src.sids.ip_network_utils import ipToInt
+from src.sids.packet_view import PacketView
+from src.sids.Rule import Rule
+from src.sids.rule_index import RuleIndex
+
+RULES = [
+    'alert udp any any -> 8.8.8.8 53 (msg:"DNS to google")',
+    'alert udp 10.0.0.1 any -> any 5035 (msg:"Possible Attack")',
+]
+UNKNOWN_SOURCE = "192.168.2.12"
+
+
+def frame(src, dst, dport, payload):
+    pkt = Ether() / IP(src=src, dst=dst) / UDP(sport=40000, dport=dport) / Raw(payload)
+    return Ether(bytes(pkt))
+
+
+def test_ring_peeks_ahead_and_advances_by_count():
+    ring = PacketRing(slots=4, slotSize=16)
+    try:
+        for seq in range(3):
+            assert ring.put(bytes([seq]) * 8, seq, float(seq))
+        assert ring.peek(3) is None
+        seq, timestamp, slot = ring.peek(2)
+        assert (seq, timestamp, bytes(slot)) == (2, 2.0, b"\x02" * 8)
+        slot.release()
+        ring.advance(2)
+        assert ring.get() == (2, 2.0, b"\x02" * 8)
+        assert ring.stats() == {"written": 3, "pending": 0, "dropped": 0}
+    finally:
+        ring.close()
+
+
+def test_shards_match_long_frames_in_capture_order():
+    rules = [Rule(rule) for rule in RULES]
+    pkts = []
+    for i in range(200):
+        # every fifth frame is too long for a ring slot
+        payload = b"payload" * (500 if i % 5 == 0 else 1)
+        src = UNKNOWN_SOURCE if i % 2 else "10.0.0.1"
+        dst, dport = ("8.8.8.8", 53) if i % 7 == 0 else ("10.0.0.2", 5035)
+        pkts.append(frame(src, dst, dport, payload))
+
+    reference = Matcher(RuleIndex(rules), FlowTable())
+    expected = []
+    for pkt in pkts:
+        rule = reference.matchPacket(PacketView(pkt))
+        if rule is not None:
+            expected.append((rule.getMatchedPrintMessage(pkt), None))
+        elif pkt[IP].src == UNKNOWN_SOURCE:
+            expected.append((None, bytes(pkt)))
+
+    results = []
+    featureList = []
+    shards = FlowShards(
+        RuleIndex(rules),
+        2,
+        lambda message, pkt, features: results.append(
+            (message, None if pkt is None else bytes(pkt))
+        )
+        or featureList.append(features),
+        True,
+        ipToInt(UNKNOWN_SOURCE),
+    )
+    for pkt in pkts:
+        shards.submit(pkt)
+    oversized = shards.oversized
+    shards.close()
+
+    assert oversized == 40
+    assert {message is None for message, pkt in expected} == {True, False}
+    assert results == expected
+    # the features of the flow as they were when each unknown packet was matched
+    unknownFeatures = [
+        features for features, (message, pkt) in zip(featureList, results) if pkt
+    ]
+    assert [features["Spkts"] for features in unknownFeatures] == list(
+        range(1, len(unknownFeatures) + 1)
+    )
+
+
+def test_unknown_packets_are_queued_with_a_snapshot_of_their_flow():
+    sniffer = Sniffer([Rule(RULES[0])], True, unknown_source=UNKNOWN_SOURCE)
+    for i in range(3):
+        pkt = frame(UNKNOWN_SOURCE, "10.0.0.2", 5035, b"payload")
+        pkt.time = float(i)
+        sniffer.inPacket(pkt)
+
+    queued = sniffer.unknownPackets.drain()
+    assert [features["Spkts"] for pkt, features in queued] == [1, 2, 3]
+    assert [features["dur"] for pkt, features in queued] == [0.0, 1.0, 2.0]
+
+
+def shardResults(monkeypatch, failure, pkts):
+    """Match the packets in 2 processes, in which failure(views) is called before each batch."""
+
+    matchViews = flow_shards.matchViews
+
+    def failingMatchViews(matcher, views, *args):
+        failure(views)
+        return matchViews(matcher, views, *args)
+
+    # inherited by the forked matcher processes
+    monkeypatch.setattr(flow_shards, "matchViews", failingMatchViews)
+    results = []
+    shards = FlowShards(
+        RuleIndex([Rule(rule) for rule in RULES]),
+        2,
+        lambda message, pkt, features: results.append(message),
+        False,
+        0,
+        dispatchSize=1,
+    )
+    for pkt in pkts:
+        shards.submit(pkt)
+    shards.flush()
+    return shards, results
+
+
+def alertPackets():
+    # one flow per packet, all matching the second rule, with a payload telling the packet
+    pkts = [
+        frame("10.0.0.1", "10.0.0.%d" % (i % 50), 5035, b"%d" % i) for i in range(100)
+    ]
+    reference = Matcher(RuleIndex([Rule(rule) for rule in RULES]), FlowTable())
+    expected = [
+        reference.matchPacket(PacketView(pkt)).getMatchedPrintMessage(pkt)
+        for pkt in pkts
+    ]
+    return pkts, expected
+
+
+def test_a_failing_batch_only_loses_its_packets(monkeypatch):
+    pkts, expected = alertPackets()
+
+    def failure(views):
+        if any(view.payload == b"7" for seq, view in views):
+            raise ValueError("cannot match")
+
+    shards, results = shardResults(monkeypatch, failure, pkts)
+    shards.close()
+    assert results == expected[:7] + expected[8:]
+
+
+def test_the_results_of_a_dead_process_are_skipped(monkeypatch):
+    pkts, expected = alertPackets()
+
+    def failure(views):
+        if any(view.payload == b"7" for seq, view in views):
+            os._exit(1)
+
+    shards, results = shardResults(monkeypatch, failure, pkts)
+    deadline = time.monotonic() + 10
+    while not any(shards.dead) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    # the packets of the other process are not held back until closing
+    time.sleep(2 * flow_shards.LIVENESS_INTERVAL)
+    delivered = list(results)
+    shards.close()
+
+    assert shards.dead.count(True) == 1
+    assert delivered == results
+    alive = shards.dead.index(False)
+    kept = [
+        message for pkt, message in zip(pkts, expected) if flowShard(pkt, 2) == alive
+    ]
+    # every result of the other process, in capture order among the results
+    # the dead one sent before dying
+    assert isSubsequence(kept, results)
+    assert isSubsequence(results, expected[:7] + expected[8:])
+
+
+def isSubsequence(items, sequence):
+    rest = iter(sequence)
+    return all(any(item == other for other in rest) for item in items)
+
+
+def test_sharded_sniffer_leaves_udp_packets_to_the_processes():
+    sniffer = Sniffer(
+        [Rule(rule) for rule in RULES],
+        True,
+        match_workers=2,
+        unknown_source=UNKNOWN_SOURCE,
+    )
+    sniffer.startShards()
+    for i in range(20):
+        pkt = frame("10.0.0.1", "10.0.0.%d" % i, 5035, b"payload")
+        if i % 2:
+            sniffer.inPacket(pkt)
+        else:
+            sniffer.inFrame(bytes(pkt), float(i))
+    sniffer.shards.close()
+
+    assert sniffer.alertCount == 20
+    # neither decoded nor tracked in the capture process
+    assert sniffer.flows.stats()["created"] == 0
+
+
+def test_udp_frame_shard_is_the_same_both_ways():
+    for i in range(20):
+        pkt = frame("10.0.0.1", "10.0.0.%d" % i, 5035, b"payload")
+        reply = (
+            Ether() / IP(src=pkt[IP].dst, dst="10.0.0.1") / UDP(sport=5035, dport=40000)
+        )
+        assert udpFrameShard(bytes(pkt), 4) == udpFrameShard(bytes(reply), 4)
+    assert udpFrameShard(bytes(Ether() / IP() / TCP()), 4) is None
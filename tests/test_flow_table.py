@@ -0,0 +1,86 @@
+from scapy.layers.inet import IP, TCP
+from scapy.packet import Raw
+
+from src.packet_sniffer.flow_table import FlowTable
+from src.packet_sniffer.packet_matcher import Matcher
+from src.sids.packet_view import PacketView
+from src.sids.Rule import Rule
+from src.sids.rule_index import RuleIndex
+
+CLIENT = "10.0.0.1"
+SERVER = "10.0.0.2"
+
+
+def segment(seq, payload=b"", ack=1, src=CLIENT, dst=SERVER, flags="PA"):
+    sport, dport = (40000, 80) if src == CLIENT else (80, 40000)
+    pkt = IP(src=src, dst=dst) / TCP(
+        sport=sport, dport=dport, seq=seq, ack=ack, flags=flags
+    )
+    if payload:
+        pkt = pkt / Raw(payload)
+    return PacketView(IP(bytes(pkt)))
+
+
+def retransmissions(table, views):
+    return [table.update(view, now=float(i))[1] for i, view in enumerate(views)]
+
+
+def test_exact_repeat_is_a_retransmission():
+    table = FlowTable()
+    first = segment(1000, b"GET / HTTP/1.1\r\n\r\n")
+    assert retransmissions(table, [first, first]) == [False, True]
+    assert table.stats()["retransmissions"] == 1
+
+
+def test_reordered_segments_are_inspected():
+    table = FlowTable()
+    early = segment(1000, b"a" * 100)
+    late = segment(1100, b"b" * 100)
+    assert retransmissions(table, [late, early]) == [False, False]
+
+
+def test_forged_sequence_ahead_does_not_hide_later_payloads():
+    table = FlowTable()
+    forged = segment(1000 + (1 << 30), b"x")
+    real = segment(1000, b"GET /etc/passwd HTTP/1.1\r\n\r\n")
+    assert retransmissions(table, [forged, real]) == [False, False]
+
+
+def test_directions_are_checked_separately():
+    table = FlowTable()
+    request = segment(1000, b"ping", ack=5000)
+    reply = segment(1000, b"ping", ack=5000, src=SERVER, dst=CLIENT)
+    assert retransmissions(table, [request, reply]) == [False, False]
+
+
+def test_empty_segments_with_new_acknowledgments_are_inspected():
+    table = FlowTable()
+    acks = [segment(1000, ack=ack, flags="A") for ack in (1, 2, 3)]
+    assert retransmissions(table, acks + [acks[-1]]) == [False, False, False, True]
+
+
+def test_cached_verdicts_are_the_scan_verdicts():
+    rules = [
+        Rule('alert tcp 10.0.0.0/24 any -> any 80 (msg:"web"; content:"passwd")'),
+        Rule('alert tcp any 80 -> any any (msg:"reply")'),
+        Rule('alert tcp any any -> any 80 (msg:"web")'),
+    ]
+    matcher = Matcher(RuleIndex(rules), FlowTable())
+    payloads = [b"GET / HTTP/1.1\r\n\r\n", b"user=passwd", b""]
+    views = [
+        segment(1000 + 100 * i, payloads[i % 3], src=src, dst=dst)
+        for i in range(30)
+        for src, dst in ((CLIENT, SERVER), (SERVER, CLIENT))
+    ]
+    for i, view in enumerate(views):
+        flow = matcher.trackFlow(view, float(i))
+        expected = next((rule for rule in rules if rule.match(view)), None)
+        assert matcher.matchPacket(view, flow) is expected
+    # replies only meet header-only rules : their verdict is cached after the first one
+    assert matcher.flows.verdictHits == 29 and rules[1].hits == 30
+
+    # a new ruleset generation does not reuse the verdicts of the previous one
+    anyTcp = Rule('alert tcp any any -> any any (msg:"any tcp")')
+    matcher.ruleIndex = RuleIndex([anyTcp] + rules)
+    reply = segment(9000, b"", src=SERVER, dst=CLIENT)
+    assert matcher.matchPacket(reply, matcher.trackFlow(reply, 60.0)) is anyTcp
@@ -0,0 +1,67 @@
+import random
+
+from scapy.layers.inet import IP, TCP
+from scapy.packet import Raw
+
+from src.packet_sniffer.flow_table import FlowTable
+from src.packet_sniffer.packet_matcher import Matcher
+from src.sids.http_detection_utils import decodeHTTP
+from src.sids.packet_view import PacketView
+from src.sids.Rule import Rule
+from src.sids.rule_index import RuleIndex, iterBits
+
+RULES = [
+    'alert tcp any any -> any 80 (msg:"get"; http_request:"GET")',
+    'alert http any any -> any 80 (msg:"web")',
+    'alert tcp any any -> any 80 (msg:"post"; http_request:"POST")',
+    'alert http any any -> any 8080 (msg:"proxy"; http_request:"CONNECT")',
+    'alert tcp any any -> any 80 (msg:"secret"; content:"passwd")',
+    'alert tcp any any -> any 80:8080 (msg:"tcp"; flags:S)',
+]
+
+PAYLOADS = [
+    b"GET /index.html HTTP/1.1\r\nHost: example.org\r\n\r\n",
+    b"POST /login HTTP/1.1\r\nHost: example.org\r\n\r\npasswd=x",
+    b"CONNECT example.org:443 HTTP/1.1\r\n\r\n",
+    b"HTTP/1.1 200 OK\r\n\r\n",
+    b"GETTING passwd",
+    b"\x16\x03\x01 not http",
+    b"",
+]
+
+
+def test_decode_http_request_line_and_host():
+    request = decodeHTTP(PAYLOADS[0])
+    assert (request.method, request.uri, request.host) == (
+        b"GET",
+        b"/index.html",
+        b"example.org",
+    )
+    assert decodeHTTP(PAYLOADS[3]).method == b"HTTP/1.1"
+    assert decodeHTTP(PAYLOADS[4]) is None
+    assert decodeHTTP(PAYLOADS[5]) is None
+
+
+def test_single_and_batch_paths_prune_the_same_rules():
+    rules = [Rule(rule) for rule in RULES]
+    index = RuleIndex(rules)
+    matcher = Matcher(index, FlowTable())
+
+    random.seed(15)
+    for _ in range(200):
+        flags = random.choice(["S", "PA"])
+        dport = random.choice([80, 8080])
+        pkt = IP(src="10.0.0.1", dst="10.0.0.2") / TCP(dport=dport, flags=flags)
+        view = PacketView(IP(bytes(pkt / Raw(random.choice(PAYLOADS)))))
+        candidates = [index.rules[i] for i in iterBits(index.candidateBits(view))]
+        expected = next((rule for rule in rules if rule.match(view)), None)
+
+        for rule in rules:
+            rule.evaluations = 0
+        assert matcher.matchPacket(view) is expected
+        evaluated = [rule for rule in rules if rule.evaluations]
+        # matchPacket evaluates the candidates in order, up to the verdict
+        if expected is None:
+            assert evaluated == candidates
+        else:
+            assert evaluated == candidates[: candidates.index(expected) + 1]
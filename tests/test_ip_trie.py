@@ -0,0 +1,40 @@
+import random
+
+from src.sids.ip_network_utils import IPNetwork
+from src.sids.ip_trie import IPTrie
+
+
+def randomNetworks(count):
+    networks = [IPNetwork("any")]
+    for _ in range(count):
+        prefixLength = random.choice([8, 16, 24, 30, 32])
+        address = random.choice([0x0A000000, 0x0A010000, 0xC0A80200])
+        address |= random.getrandbits(16)
+        mask = IPNetwork.fromInt(0, prefixLength).mask
+        networks.append(IPNetwork.fromInt(address & mask, prefixLength))
+    return networks
+
+
+def test_lookup_is_the_union_of_the_containing_networks():
+    random.seed(2)
+    networks = randomNetworks(200)
+    trie = IPTrie()
+    for position, network in enumerate(networks):
+        trie.insert(network.network, network.prefixLength, 1 << position)
+
+    for _ in range(2000):
+        address = random.choice([0x0A000000, 0x0A010000, 0xC0A80200, 0x08080808])
+        address |= random.getrandbits(16)
+        expected = 0
+        for position, network in enumerate(networks):
+            if network.containsInt(address):
+                expected |= 1 << position
+        assert trie.lookup(address) == expected
+
+
+def test_inserted_leaves_the_original_trie_untouched():
+    trie = IPTrie()
+    trie.insert(0x0A000000, 8, 1)
+    copy = trie.inserted(0x0A010000, 16, 2)
+    assert (trie.lookup(0x0A010203), copy.lookup(0x0A010203)) == (1, 3)
+    assert copy.lookup(0x0A020203) == 1
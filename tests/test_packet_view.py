@@ -0,0 +1,118 @@
+import random
+
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.layers.l2 import ARP, Dot1Q, Ether
+from scapy.packet import Raw
+
+from src.sids.ip_network_utils import ipToInt
+from src.sids.packet_view import PacketView, udpEndpoints
+from src.sids.payload_utils import payloadBytes
+from src.sids.protocol_enum import Protocol
+from src.sids.Rule import Rule
+
+RULES = [
+    'alert tcp any any -> any 80 (msg:"web")',
+    'alert tcp 10.0.0.0/8 any -> any any (msg:"syn"; flags:S)',
+    'alert udp any 53 -> any any (msg:"dns reply"; tos:16)',
+    'alert http any any -> any any (msg:"get"; http_request:"GET")',
+    'alert tcp any any -> 192.168.1.1 any (msg:"secret"; content:"passwd")',
+    'alert udp any any -> any 1000:2000 (msg:"udp range"; len:5)',
+]
+
+PAYLOADS = [b"", b"GET / HTTP/1.1\r\nHost: a\r\n\r\n", b"user passwd", b"\x00\xff"]
+
+
+def randomPacket():
+    ip = IP(
+        src=random.choice(["10.0.0.1", "172.16.0.1"]),
+        dst=random.choice(["192.168.1.1", "8.8.8.8"]),
+        tos=random.choice([0, 16]),
+        ttl=random.choice([1, 64]),
+    )
+    sport = random.choice([53, 40000])
+    dport = random.choice([53, 80, 1500])
+    if random.random() < 0.5:
+        l4 = UDP(sport=sport, dport=dport)
+    else:
+        l4 = TCP(
+            sport=sport,
+            dport=dport,
+            seq=random.randrange(2**32),
+            ack=random.randrange(2**32),
+            flags=random.choice(["S", "SA", "PA", "F"]),
+        )
+    return IP(bytes(ip / l4 / Raw(random.choice(PAYLOADS))))
+
+
+def test_view_fields_are_the_scapy_fields():
+    random.seed(6)
+    for _ in range(200):
+        pkt = randomPacket()
+        view = PacketView(pkt)
+        ip = pkt[IP]
+        assert (view.src, view.dst) == (ipToInt(ip.src), ipToInt(ip.dst))
+        assert (view.tos, view.ttl, view.length, view.ihl, view.frag) == (
+            ip.tos,
+            ip.ttl,
+            ip.len,
+            ip.ihl,
+            ip.frag,
+        )
+        l4 = pkt[TCP] if TCP in pkt else pkt[UDP]
+        assert (view.sport, view.dport) == (l4.sport, l4.dport)
+        assert view.payload == payloadBytes(pkt)
+        if TCP in pkt:
+            assert view.protocol == Protocol.TCP
+            assert (view.seq, view.ack, view.flags) == (l4.seq, l4.ack, int(l4.flags))
+        else:
+            assert view.protocol == Protocol.UDP
+            assert view.seq is view.ack is view.flags is None
+
+
+def test_one_view_is_shared_by_every_rule():
+    rules = [Rule(rule) for rule in RULES]
+    random.seed(60)
+    for _ in range(300):
+        pkt = randomPacket()
+        view = PacketView(pkt)
+        # checking a rule leaves the view as decoded for the next ones
+        assert [rule.match(view) for rule in rules] == [
+            rule.match(PacketView(pkt)) for rule in rules
+        ]
+
+
+FIELDS = PacketView.__slots__[3:-1]
+
+
+def randomFrame():
+    pkt = randomPacket()
+    if random.random() < 0.2:
+        pkt.frag = random.choice([0, 1, 100])
+        pkt.flags = "MF"
+    frame = Ether() / pkt
+    if random.random() < 0.2:
+        frame = Ether() / Dot1Q(vlan=5) / pkt
+    frame = bytes(frame)
+    # short packets are padded to the minimum Ethernet frame size
+    return frame + random.choice([b"", b"\x00" * 10])
+
+
+def test_frame_views_are_the_scapy_views():
+    rules = [Rule(rule) for rule in RULES]
+    random.seed(18)
+    for _ in range(300):
+        frame = randomFrame()
+        view = PacketView.fromFrame(frame)
+        scapyView = PacketView(Ether(frame))
+        assert [getattr(view, field) for field in FIELDS] == [
+            getattr(scapyView, field) for field in FIELDS
+        ]
+        assert (view.http is None) == (scapyView.http is None)
+        if view.http is not None:
+            assert view.http.method == scapyView.http.method
+        assert (udpEndpoints(frame) is not None) == (view.protocol == Protocol.UDP)
+        assert [rule.match(view) for rule in rules] == [
+            rule.match(scapyView) for rule in rules
+        ]
+    assert PacketView.fromFrame(bytes(Ether() / ARP())).protocol is None
+    assert PacketView.fromFrame(b"\x00" * 10).src is None
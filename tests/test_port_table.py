@@ -0,0 +1,40 @@
+import random
+
+from src.sids.port_utils import Ports, PortTable
+
+PORTS = [
+    "any",
+    "80",
+    "22,80,443",
+    "1000:2000",
+    ":1024",
+    "60000:",
+    "1500:1500",
+    "2000:1000",
+]
+
+
+def test_lookup_matches_every_ports_containing_the_port():
+    random.seed(3)
+    ports = [Ports(random.choice(PORTS)) for _ in range(100)]
+    table = PortTable()
+    for position, portSet in enumerate(ports):
+        table.add(portSet, 1 << position)
+
+    for port in [0, 22, 79, 80, 81, 443, 999, 1000, 1024, 1025, 1500, 2000, 2001]:
+        for candidate in (port, random.randrange(65536)):
+            expected = 0
+            for position, portSet in enumerate(ports):
+                if portSet.contains(candidate):
+                    expected |= 1 << position
+            assert table.lookup(candidate) == expected
+
+
+def test_copy_is_independent():
+    table = PortTable()
+    table.add(Ports("1000:2000"), 1)
+    copy = table.copy()
+    copy.add(Ports("1500:3000"), 2)
+    copy.add(Ports("80"), 4)
+    assert (table.lookup(1600), copy.lookup(1600)) == (1, 3)
+    assert (table.lookup(80), copy.lookup(80)) == (0, 4)
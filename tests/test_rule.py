@@ -0,0 +1,78 @@
+from scapy.layers.inet import ICMP, IP, TCP, UDP
+from scapy.layers.l2 import Ether
+from scapy.packet import Raw
+
+from src.sids.http_detection_utils import isHTTP
+from src.sids.payload_utils import payloadBytes
+from src.sids.Rule import Rule
+
+BINARY = b"\xff\xfe\x00passwd\x80"
+
+
+def test_payload_bytes_of_each_transport():
+    assert payloadBytes(IP() / UDP() / Raw(BINARY)) == BINARY
+    assert payloadBytes(IP(bytes(IP() / TCP() / Raw(BINARY)))) == BINARY
+    assert payloadBytes(IP() / TCP()) == b""
+    assert payloadBytes(IP() / ICMP() / Raw(BINARY)) == b""
+    # the padding of a short Ethernet frame is not payload
+    assert payloadBytes(Ether(bytes(Ether() / IP() / UDP()) + b"\x00" * 10)) == b""
+    padded = Ether(bytes(Ether() / IP() / UDP() / Raw(b"ab")) + b"\x00" * 10)
+    assert payloadBytes(padded) == b"ab"
+
+
+def test_content_is_found_in_binary_payloads():
+    rule = Rule('alert udp any any -> any any (msg:"secret"; content:"passwd")')
+    assert rule.match(IP(bytes(IP() / UDP() / Raw(BINARY))))
+    assert not rule.match(IP(bytes(IP() / UDP() / Raw(b"\xff\xfe\x00pass"))))
+
+
+def test_http_is_detected_from_the_payload_bytes():
+    assert isHTTP(IP() / TCP() / Raw(b"GET / HTTP/1.1\r\n\r\n"))
+    assert not isHTTP(IP() / TCP() / Raw(BINARY))
+    assert not isHTTP(IP() / UDP() / Raw(b"GET / HTTP/1.1\r\n\r\n"))
+
+
+def optionsHold(rule, pkt):
+    """Check the options of the rule with the scapy fields of the packet, one by one."""
+    ip = pkt[IP]
+    checks = {
+        "tos": lambda: rule.tos == ip.tos,
+        "len": lambda: rule.len == ip.ihl,
+        "offset": lambda: rule.offset == ip.frag,
+        "seq": lambda: TCP in pkt and rule.seq == pkt[TCP].seq,
+        "ack": lambda: TCP in pkt and rule.ack == pkt[TCP].ack,
+        "flags": lambda: TCP in pkt and set(rule.flags) <= set(str(pkt[TCP].flags)),
+        "content": lambda: rule.contentBytes in payloadBytes(pkt),
+    }
+    return all(check() for option, check in checks.items() if hasattr(rule, option))
+
+
+def test_compiled_options_check_each_option():
+    header = "alert tcp any any -> any any"
+    options = [
+        "tos:16",
+        "len:5",
+        "offset:0",
+        "seq:100",
+        "ack:7",
+        "flags:SA",
+        'content:"abc"',
+    ]
+    rules = [Rule(f'{header} (msg:"{option}"; {option})') for option in options]
+    rules.append(Rule(f'{header} (msg:"all"; {"; ".join(options)})'))
+    rules.append(Rule(f'{header} (msg:"none")'))
+    assert [len(rule.predicates) for rule in rules[-2:]] == [len(options), 0]
+
+    for tos in (0, 16):
+        for seq, ack in ((100, 7), (101, 7)):
+            for flags in ("S", "SA", "PA"):
+                for payload in (b"", b"xabcx"):
+                    pkt = IP(
+                        bytes(
+                            IP(tos=tos)
+                            / TCP(seq=seq, ack=ack, flags=flags)
+                            / Raw(payload)
+                        )
+                    )
+                    for rule in rules:
+                        assert rule.match(pkt) == optionsHold(rule, pkt)
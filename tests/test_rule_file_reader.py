@@ -0,0 +1,63 @@
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.packet import Raw
+
+from src.sids.ip_network_utils import IPNetwork
+from src.sids.packet_view import PacketView
+from src.sids.Rule import Rule
+from src.sids.rule_file_reader import buildRules, parseChunk, readRules
+
+LINES = [
+    'alert udp 192.168.2.12 any -> 192.168.0.0/16 23 (msg:"This is an ATTACK")',
+    "alert tcp 10.0.0.0/8 1000:2000 -> any 80,443",
+    "alert udp 300.0.0.1 any -> any any",
+    'alert tcp any any -> any 80 (msg:"HTTP"; content:"passwd")',
+]
+SYN = 'alert tcp any :1024 -> 10.0.0.1 80 (msg:"SYN"; flags:S; tos:0)'
+
+
+def test_network_from_int():
+    network = IPNetwork.fromInt(0x0A010000, 16)
+    assert network.mask == IPNetwork("10.1.0.0/16").mask
+    assert network.containsInt(0x0A010203)
+    assert not network.containsInt(0x0A020203)
+    assert str(network.ipn) == "10.1.0.0/16"
+
+
+def test_pool_reads_as_the_current_process(tmp_path):
+    path = tmp_path / "rules.txt"
+    path.write_text("\n".join(LINES * 5) + "\n")
+
+    rules, errors = readRules(str(path), workers=1)
+    pooled, pooledErrors = readRules(str(path), workers=2, chunkSize=3, minPoolLines=0)
+
+    assert [repr(rule) for rule in pooled] == [repr(rule) for rule in rules]
+    assert [rule.srcIps.ipn for rule in pooled] == [rule.srcIps.ipn for rule in rules]
+    assert [rule.dstPorts.intervals for rule in pooled] == [
+        rule.dstPorts.intervals for rule in rules
+    ]
+    assert pooledErrors == errors
+    assert [lineNumber for lineNumber, reason in errors] == [3, 7, 11, 15, 19]
+
+
+def test_rules_built_from_compact_state_match_as_parsed():
+    lines = list(enumerate(LINES + [SYN], start=1))
+    parsed, errors = parseChunk(lines)
+    shared = dict()
+    rules = buildRules(parsed, shared)
+    assert [lineNumber for lineNumber, reason in errors] == [3]
+    assert [repr(rule) for rule in rules] == [
+        line for line in LINES + [SYN] if "300." not in line
+    ]
+    # equal port sets are built once
+    assert rules[0].srcPorts is rules[2].srcPorts
+
+    packets = [
+        IP(src="192.168.2.12", dst="192.168.1.1") / UDP(dport=23),
+        IP(src="10.0.0.1", dst="10.0.0.2") / TCP(sport=1500, dport=443),
+        IP(src="10.0.0.2", dst="10.0.0.1") / TCP(sport=80, dport=80) / Raw(b"passwd"),
+        IP(src="10.0.0.2", dst="10.0.0.1") / TCP(sport=80, dport=80, flags="S"),
+    ]
+    for pkt in packets:
+        view = PacketView(IP(bytes(pkt)))
+        for line, rule in zip([repr(rule) for rule in rules], rules):
+            assert rule.match(view) == Rule(line).match(view)
@@ -0,0 +1,89 @@
+import random
+
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.packet import Raw
+
+from src.packet_sniffer.flow_table import FlowTable
+from src.packet_sniffer.packet_matcher import Matcher
+from src.sids.packet_view import PacketView
+from src.sids.Rule import Rule
+from src.sids.rule_index import RuleIndex, iterBits
+
+NETWORKS = ["any", "10.0.0.0/8", "10.1.0.0/16", "10.1.2.3", "192.168.2.12"]
+PORTS = ["any", "53", "80", "1000:2000", "22,80,443", ":1024", "5000:"]
+ADDRESSES = ["10.1.2.3", "10.1.9.9", "10.200.0.1", "192.168.2.12", "8.8.8.8"]
+
+
+def randomRule(i):
+    protocol = random.choice(["tcp", "udp", "http"])
+    options = f'msg:"r{i}"'
+    if random.random() < 0.2:
+        options += "; content:" + random.choice(['"abc"', '"GET"', '"zz"'])
+    if protocol != "udp" and random.random() < 0.2:
+        options += "; flags:" + random.choice(["S", "A", "PA"])
+    return Rule(
+        f"alert {protocol} {random.choice(NETWORKS)} {random.choice(PORTS)} -> "
+        f"{random.choice(NETWORKS)} {random.choice(PORTS)} ({options})"
+    )
+
+
+def randomView():
+    sport = random.choice([53, 80, 443, 1500, 40000])
+    dport = random.choice([22, 53, 80, 443, 1000, 1500, 2000, 5000, 60000])
+    if random.random() < 0.5:
+        l4 = UDP(sport=sport, dport=dport)
+    else:
+        l4 = TCP(sport=sport, dport=dport, flags=random.choice(["S", "A", "PA"]))
+    payload = random.choice([b"", b"abc", b"GET / HTTP/1.1\r\n\r\n", b"xzzx"])
+    ip = IP(src=random.choice(ADDRESSES), dst=random.choice(ADDRESSES))
+    return PacketView(IP(bytes(ip / l4 / Raw(payload))))
+
+
+def test_candidates_keep_every_matching_rule_in_order():
+    random.seed(1)
+    rules = [randomRule(i) for i in range(150)]
+    index = RuleIndex(rules)
+    assert len(index) == len(rules)
+
+    for _ in range(500):
+        view = randomView()
+        matching = [rule for rule in rules if rule.match(view)]
+        candidates = index.candidates(view)
+        assert [rule for rule in candidates if rule.match(view)] == matching
+        positions = list(iterBits(index.candidateBits(view)))
+        assert positions == sorted(positions)
+
+
+def test_with_rule_leaves_the_original_index_untouched():
+    random.seed(12)
+    rules = [randomRule(i) for i in range(120)]
+    index = RuleIndex(rules[:60])
+    index.getBatchMatcher()
+    views = [randomView() for _ in range(300)]
+    before = [index.candidateBits(view) for view in views]
+
+    extended = index
+    for rule in rules[60:]:
+        extended = extended.withRule(rule)
+    assert len(index) == 60 and len(extended) == len(rules)
+    assert extended.generation != index.generation
+
+    for view, bits in zip(views, before):
+        assert index.candidateBits(view) == bits
+        matching = [rule for rule in rules if rule.match(view)]
+        candidates = extended.candidates(view)
+        assert [rule for rule in candidates if rule.match(view)] == matching
+
+    # the batch matcher built for the original index is extended with it
+    assert Matcher(extended, FlowTable()).matchBatch(views) == [
+        next((rule for rule in rules if rule.match(view)), None) for view in views
+    ]
+
+
+def test_has_rule_ignores_the_writing_of_a_rule():
+    index = RuleIndex([Rule('alert tcp any any -> 10.0.0.0/8 80,443 (msg:"web")')])
+    assert index.hasRule(Rule('alert tcp any any -> 10.0.0.0/8 443,80 (msg:"web")'))
+    assert not index.hasRule(Rule('alert tcp any any -> 10.0.0.0/8 80 (msg:"web")'))
+    inserted = Rule('alert udp any any -> any 53 (msg:"dns")')
+    assert not index.hasRule(inserted)
+    assert index.withRule(inserted).hasRule(inserted)
@@ -0,0 +1,58 @@
+import random
+
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.packet import Raw
+
+from src.sids import ruleset_cache
+from src.sids.packet_view import PacketView
+from src.sids.Rule import Rule
+from src.sids.rule_optimizer import deduplicate, optimize
+
+RULES = [
+    'alert tcp any any -> any 80 (msg:"web")',
+    'alert tcp any any -> any 81 (msg:"web")',
+    'alert tcp any any -> any 80 (msg:"web")',
+    'alert udp any any -> 10.0.0.1 53 (msg:"dns")',
+    'alert udp any any -> 10.0.0.0 53 (msg:"dns")',
+    'alert tcp any any -> any 82 (msg:"other")',
+    'alert tcp any any -> any 82 (msg:"web")',
+    'alert udp any any -> 10.0.0.2 any (msg:"dns")',
+    'alert udp any any -> 10.0.0.3 53 (msg:"dns")',
+    'alert tcp 10.0.0.1 any -> any 80 (msg:"web")',
+]
+
+
+def firstMessage(rules, view):
+    for rule in rules:
+        if rule.match(view):
+            return rule.msg
+    return None
+
+
+def test_optimized_ruleset_keeps_every_verdict():
+    rules = [Rule(rule) for rule in RULES]
+    optimized = optimize(rules)
+    assert len(optimized) < len(deduplicate(rules)) < len(rules)
+
+    random.seed(13)
+    for _ in range(500):
+        src = random.choice(["10.0.0.1", "172.16.0.1"])
+        dst = "10.0.0." + str(random.randrange(5))
+        dport = random.choice([53, 79, 80, 81, 82, 83])
+        l4 = TCP(dport=dport) if random.random() < 0.5 else UDP(dport=dport)
+        view = PacketView(IP(bytes(IP(src=src, dst=dst) / l4 / Raw(b"x"))))
+        assert firstMessage(optimized, view) == firstMessage(rules, view)
+
+
+def test_duplicates_are_removed_by_default(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        ruleset_cache, "KEY_PATH", str(tmp_path / "key" / "ruleset.key")
+    )
+    rulesPath = tmp_path / "rules.txt"
+    rulesPath.write_text("\n".join(RULES) + "\n")
+    ruleList, errorCount, ruleIndex = ruleset_cache.readCompiled(str(rulesPath))
+    assert [rule.string.strip() for rule in ruleList] == [
+        rule for i, rule in enumerate(RULES) if rule not in RULES[:i]
+    ]
+    # the rules file is only rewritten on request
+    assert rulesPath.read_text() == "\n".join(RULES) + "\n"
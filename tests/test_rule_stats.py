@@ -0,0 +1,69 @@
+import random
+
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.packet import Raw
+
+from src.packet_sniffer.packet_sniffer import Sniffer
+from src.sids.packet_view import PacketView
+from src.sids.Rule import Rule
+from src.sids.rule_stats import reorder
+
+RULES = [
+    'alert tcp any any -> any 80 (msg:"web")',
+    'alert tcp any any -> any 22 (msg:"ssh")',
+    'alert udp any any -> 8.8.8.8 53 (msg:"DNS to google")',
+    'alert udp 10.0.0.1 any -> any any (msg:"from host")',
+    'alert tcp 10.0.0.0/24 any -> any 1:1024 (msg:"low ports")',
+    'alert udp any any -> any 5000:6000 (msg:"high udp")',
+    'alert tcp any any -> 10.0.0.9 any (msg:"to host")',
+]
+
+
+def firstMatch(rules, view):
+    for rule in rules:
+        if rule.match(view):
+            return rule
+    return None
+
+
+def randomView():
+    src = random.choice(["10.0.0.1", "10.0.0.7", "172.16.0.1"])
+    dst = random.choice(["8.8.8.8", "10.0.0.9", "192.168.1.1"])
+    dport = random.choice([22, 53, 80, 443, 5035, 8080])
+    l4 = (
+        TCP(sport=40000, dport=dport)
+        if random.random() < 0.5
+        else UDP(sport=40000, dport=dport)
+    )
+    return PacketView(IP(bytes(IP(src=src, dst=dst) / l4 / Raw(b"x"))))
+
+
+def test_reorder_keeps_every_verdict():
+    random.seed(9)
+    for _ in range(20):
+        rules = [Rule(rule) for rule in RULES]
+        for rule in rules:
+            rule.hits = random.randrange(100)
+        reordered = reorder(rules)
+        assert sorted(map(id, reordered)) == sorted(map(id, rules))
+        for _ in range(100):
+            view = randomView()
+            assert firstMatch(reordered, view) is firstMatch(rules, view)
+
+
+def test_reorder_moves_hit_rules_ahead_of_disjoint_ones():
+    rules = [Rule(rule) for rule in RULES[:3]]
+    rules[2].hits = 5
+    assert reorder(rules) == [rules[2], rules[0], rules[1]]
+
+
+def test_unchanged_order_is_not_published():
+    sniffer = Sniffer([Rule(rule) for rule in RULES], False)
+    ruleIndex = sniffer.ruleIndex
+    sniffer.reorderRules()
+    assert sniffer.ruleIndex is ruleIndex
+
+    ruleIndex.rules[2].hits = 10
+    sniffer.reorderRules()
+    assert sniffer.ruleIndex is not ruleIndex
+    assert sniffer.ruleIndex.rules[0] is ruleIndex.rules[2]
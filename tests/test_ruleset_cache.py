@@ -0,0 +1,63 @@
+import pickle
+
+import pytest
+
+from src.sids import ruleset_cache
+from src.sids.ip_network_utils import IPNetwork
+from src.sids.Rule import Rule
+
+RULES = (
+    'alert udp 192.168.2.12 any -> 192.168.0.0/16 23 (msg:"This is an ATTACK")\n'
+    'alert tcp any any -> any 80 (msg:"HTTP"; content:"passwd")\n'
+)
+
+
+@pytest.fixture(autouse=True)
+def signingKey(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        ruleset_cache, "KEY_PATH", str(tmp_path / "key" / "ruleset.key")
+    )
+
+
+def test_network_pickles_again_after_unpickling():
+    network = pickle.loads(pickle.dumps(IPNetwork("10.1.0.0/16")))
+    network = pickle.loads(pickle.dumps(network))
+    assert network.containsInt(0x0A010203)
+    assert str(network.ipn) == "10.1.0.0/16"
+
+
+def test_rule_pickle_round_trip():
+    rule = Rule(RULES.splitlines()[0])
+    copy = pickle.loads(pickle.dumps(pickle.loads(pickle.dumps(rule))))
+    assert copy.string == rule.string
+    assert copy.dstIps.containsInt(0xC0A80101)
+
+
+def test_compiled_ruleset_round_trip(tmp_path):
+    rulesPath = tmp_path / "rules.txt"
+    rulesPath.write_text(RULES)
+    ruleList, errorCount, ruleIndex = ruleset_cache.readCompiled(str(rulesPath))
+    assert (len(ruleList), errorCount) == (2, 0)
+
+    loaded = ruleset_cache.loadArtifact(
+        ruleset_cache.compiledPath(str(rulesPath)),
+        ruleset_cache.rulesetHash(rulesPath.read_bytes()),
+    )
+    assert loaded is not None
+    assert [rule.string for rule in loaded[0]] == [rule.string for rule in ruleList]
+    # a loaded index can be pickled again, e.g. to reach the matcher processes
+    pickle.dumps(loaded[2])
+
+
+def test_tampered_artifact_is_not_loaded(tmp_path):
+    rulesPath = tmp_path / "rules.txt"
+    rulesPath.write_text(RULES)
+    ruleset_cache.readCompiled(str(rulesPath))
+    path = ruleset_cache.compiledPath(str(rulesPath))
+    header, _, payload = open(path, "rb").read().partition(b"\n")
+
+    forged = pickle.dumps(([], 0, None))
+    with open(path, "wb") as f:
+        f.write(header + b"\n" + forged)
+    key = ruleset_cache.rulesetHash(rulesPath.read_bytes())
+    assert ruleset_cache.loadArtifact(path, key) is None
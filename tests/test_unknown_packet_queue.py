@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from src.packet_sniffer.unknown_packet_queue import (
+    BLOCK,
+    DROP_OLDEST,
+    SAMPLE,
+    UnknownPacketQueue,
+)
+
+
+def test_drop_oldest_keeps_the_newest_packets():
+    queue = UnknownPacketQueue(maxSize=3, policy=DROP_OLDEST)
+    assert all(queue.put(i) for i in range(5))
+    assert queue.drain() == [2, 3, 4]
+    stats = queue.stats()
+    assert (stats["enqueued"], stats["dropped"], stats["max_depth"]) == (5, 2, 3)
+
+
+def test_sample_keeps_one_of_every_overflowing_packets():
+    queue = UnknownPacketQueue(maxSize=2, policy=SAMPLE, sampleEvery=3)
+    kept = [queue.put(i) for i in range(8)]
+    # 2 to 7 overflow : every third one replaces the oldest queued packet
+    assert kept == [True, True, False, False, True, False, False, True]
+    assert queue.drain() == [4, 7]
+    assert queue.stats()["dropped"] == 6
+
+
+def test_block_waits_for_room():
+    queue = UnknownPacketQueue(maxSize=2, policy=BLOCK)
+    queue.put(0)
+    queue.put(1)
+    producer = threading.Thread(target=queue.put, args=(2,))
+    producer.start()
+    time.sleep(0.1)
+    assert producer.is_alive() and len(queue) == 2
+
+    assert queue.getBatch(1) == [0]
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+    assert queue.drain() == [1, 2]
+    assert queue.stats()["blocked"] == 1 and queue.stats()["dropped"] == 0
+
+
+def test_close_wakes_up_producers_and_consumers():
+    queue = UnknownPacketQueue(maxSize=1, policy=BLOCK)
+    queue.put(0)
+    results = []
+    producer = threading.Thread(target=lambda: results.append(queue.put(1)))
+    producer.start()
+    time.sleep(0.1)
+    queue.close()
+    producer.join(timeout=5)
+    assert results == [False]
+
+    # packets already queued can still be read, then consumers stop waiting
+    assert queue.get() == 0
+    assert queue.get() is None
+    assert queue.getBatch(10, timeout=5) == []
+
+
+def test_get_batch_lingers_for_fuller_batches():
+    queue = UnknownPacketQueue()
+    queue.put(0)
+    threading.Timer(0.05, lambda: [queue.put(i) for i in (1, 2)]).start()
+    assert queue.getBatch(3, timeout=1, linger=2) == [0, 1, 2]
+    assert queue.getBatch(3, timeout=0.01) == []
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        UnknownPacketQueue(policy="spill")